@@ -39,6 +39,7 @@ def create_app(config_name=None):
     from routes.attendance import attendance_bp
     from routes.finance import finance_bp
     from routes.schedule import schedule_bp
+    from routes.calendar import calendar_bp
     
     # Initialize OAuth
     init_oauth(app)
@@ -49,6 +50,11 @@ def create_app(config_name=None):
     app.register_blueprint(attendance_bp)
     app.register_blueprint(finance_bp)
     app.register_blueprint(schedule_bp)
+    app.register_blueprint(calendar_bp)
+    
+    # Dashboard cache, invalidated from session commits
+    from utils.dashboard_cache import dashboard_cache
+    dashboard_cache.init_app(app, db.session)
     
     # Create database tables
     with app.app_context():
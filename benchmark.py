@@ -0,0 +1,363 @@
+#!/usr/bin/env python
+"""Performance benchmarks against an in-memory SQLite database"""
+import io
+import sys
+import time as timer
+from contextlib import contextmanager
+from datetime import date, time, timedelta
+import numpy as np
+from sqlalchemy import event
+from app import create_app, db
+from models import User, Class, Lesson, Attendance, Finance, Collection, RecurringLesson, Holiday
+from routes.schedule import bucket_by_day
+from utils.conflicts import Slot, ScheduleIndex, lesson_slots, find_conflicts
+from utils.lesson_import import read_timetable, import_timetable
+
+
+@contextmanager
+def count_queries():
+    """Count the SQL statements executed inside the block"""
+    counter = {'queries': 0}
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        counter['queries'] += 1
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    start = timer.perf_counter()
+    try:
+        yield counter
+    finally:
+        counter['ms'] = (timer.perf_counter() - start) * 1000
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def create_class(size, lessons=1):
+    """Create a teacher, a class with ``size`` students and one lesson per past day"""
+    suffix = f'{size}_{User.query.count()}'
+    teacher = User(
+        google_id=f'bench_teacher_{suffix}',
+        email=f'teacher_{suffix}@bench.local',
+        full_name='Bench Teacher',
+        role='teacher'
+    )
+    db.session.add(teacher)
+    db.session.flush()
+
+    class_obj = Class(name=f'Bench {size}', teacher_id=teacher.id)
+    db.session.add(class_obj)
+    db.session.flush()
+
+    db.session.add_all(
+        User(
+            google_id=f'bench_student_{suffix}_{i}',
+            email=f'student_{suffix}_{i}@bench.local',
+            full_name=f'Student {i}',
+            role='student',
+            class_id=class_obj.id
+        )
+        for i in range(size)
+    )
+    db.session.add_all(
+        Lesson(
+            subject=('Math', 'Physics', 'History')[i % 3],
+            class_id=class_obj.id,
+            date=date.today() - timedelta(days=i),
+            start_time=time(9, 0),
+            end_time=time(10, 0),
+            created_by=teacher.id
+        )
+        for i in range(lessons)
+    )
+    db.session.commit()
+
+    return teacher, class_obj
+
+
+def bench_attendance():
+    """Query count of bulk attendance marking as the class grows"""
+    print("\n=== Bulk attendance marking ===")
+    print(f"{'Students':>10} {'Insert queries':>16} {'Update queries':>16} {'Insert ms':>10} {'Update ms':>10}")
+
+    for size in (10, 35, 100, 500):
+        teacher, class_obj = create_class(size)
+        teacher_id = teacher.id
+        lesson_id = class_obj.lessons[0].id
+        student_ids = [student.id for student in class_obj.get_students()]
+
+        results = []
+        for status in ('present', 'late'):
+            marks = [{'student_id': sid, 'status': status, 'notes': ''} for sid in student_ids]
+            with count_queries() as counter:
+                Attendance.bulk_upsert(lesson_id, marks, teacher_id)
+                db.session.commit()
+            results.append(counter)
+
+        print(f"{size:>10} {results[0]['queries']:>16} {results[1]['queries']:>16} "
+              f"{results[0]['ms']:>10.1f} {results[1]['ms']:>10.1f}")
+
+
+def bench_analytics():
+    """Attendance analytics on a synthetic class of 30 students x 1,000 lessons"""
+    from utils.analytics import class_attendance_analytics
+
+    print("\n=== Attendance analytics (30 students x 1,000 lessons) ===")
+
+    teacher, class_obj = create_class(30, lessons=1000)
+    student_ids = [student.id for student in class_obj.get_students()]
+    lesson_ids = [lesson.id for lesson in class_obj.lessons]
+
+    rng = np.random.default_rng(42)
+    statuses = rng.choice(['present', 'late', 'absent'], p=[0.8, 0.1, 0.1], size=(len(student_ids), len(lesson_ids)))
+    db.session.execute(Attendance.__table__.insert(), [
+        {
+            'student_id': student_id,
+            'lesson_id': lesson_id,
+            'status': statuses[i, j],
+            'marked_by': teacher.id
+        }
+        for i, student_id in enumerate(student_ids)
+        for j, lesson_id in enumerate(lesson_ids)
+    ])
+    db.session.commit()
+
+    class_id = class_obj.id
+    for run in range(3):
+        with count_queries() as counter:
+            analytics = class_attendance_analytics(class_id)
+        print(f"Run {run + 1}: {counter['queries']} queries, {counter['ms']:.1f} ms, "
+              f"{len(analytics['at_risk'])} at-risk students")
+
+
+def new_collection(class_obj, teacher_id, name):
+    """Add and flush a collection for a class"""
+    collection = Collection(
+        class_id=class_obj.id,
+        name=name,
+        amount_per_student=10,
+        created_by=teacher_id
+    )
+    db.session.add(collection)
+    db.session.flush()
+    return collection
+
+
+def bench_collections():
+    """Creating a collection's finance records: per-student ORM objects vs INSERT ... SELECT"""
+    print("\n=== Collection creation ===")
+    print(f"{'Students':>10} {'ORM queries':>12} {'Bulk queries':>13} {'ORM ms':>8} {'Bulk ms':>8}")
+
+    for size in (35, 100, 500, 2000):
+        teacher, class_obj = create_class(size)
+        teacher_id = teacher.id
+        class_id = class_obj.id
+        db.session.expire_all()
+
+        # Previous path: load every member, filter by role, add one object per student
+        with count_queries() as orm:
+            class_obj = db.session.get(Class, class_id)
+            collection = new_collection(class_obj, teacher_id, 'ORM')
+            students = class_obj.get_students()
+            for student in students:
+                db.session.add(Finance(
+                    class_id=class_id,
+                    collection_id=collection.id,
+                    collection_name=collection.name,
+                    amount=collection.amount_per_student,
+                    student_id=student.id,
+                    paid=False,
+                    created_by=teacher_id
+                ))
+            collection.student_count = len(students)
+            db.session.commit()
+        db.session.expire_all()
+
+        with count_queries() as bulk:
+            class_obj = db.session.get(Class, class_id)
+            collection = new_collection(class_obj, teacher_id, 'Bulk')
+            collection.create_student_records(teacher_id)
+            db.session.commit()
+
+        print(f"{size:>10} {orm['queries']:>12} {bulk['queries']:>13} {orm['ms']:>8.1f} {bulk['ms']:>8.1f}")
+
+
+def bench_recurring():
+    """Expanding a full academic year of weekly lessons for 30 classes"""
+    print("\n=== Recurring lesson expansion ===")
+
+    start = date(date.today().year, 9, 1)
+    end = date(start.year + 1, 6, 30)
+    rules = []
+
+    for i in range(30):
+        teacher, class_obj = create_class(1, lessons=0)
+        for weekday in range(5):
+            for slot in range(2):
+                rules.append(RecurringLesson(
+                    class_id=class_obj.id,
+                    subject=('Math', 'Physics', 'History')[(weekday + slot) % 3],
+                    weekday=weekday,
+                    start_time=time(9 + slot * 2, 0),
+                    end_time=time(10 + slot * 2, 0),
+                    start_date=start,
+                    end_date=end,
+                    created_by=teacher.id
+                ))
+
+    db.session.add_all(rules)
+    db.session.add_all(
+        Holiday(date=start + timedelta(weeks=week), name='Break', created_by=rules[0].created_by)
+        for week in (8, 16, 17, 30)
+    )
+    db.session.commit()
+
+    with count_queries() as counter:
+        rules = RecurringLesson.query.all()
+        created = RecurringLesson.materialize(rules, end)
+        db.session.commit()
+    print(f"{len(rules)} rules, {created} lessons: {counter['queries']} queries, {counter['ms']:.1f} ms")
+
+    with count_queries() as counter:
+        rules = RecurringLesson.query.all()
+        created = RecurringLesson.materialize(rules, end, since=start)
+        db.session.commit()
+    print(f"Re-run: {created} lessons, {counter['queries']} queries, {counter['ms']:.1f} ms")
+
+
+def bench_schedule():
+    """Reading schedule ranges out of two years of lessons for 50 classes"""
+    print("\n=== Schedule range ===")
+
+    classes = [create_class(1, lessons=730)[1] for _ in range(50)]
+    today = date.today()
+
+    for label, class_ids, start in (
+        ('One class, one month', [classes[0].id], today - timedelta(days=30)),
+        ('Ten classes, 92 days', [class_obj.id for class_obj in classes[:10]], today - timedelta(days=91)),
+    ):
+        db.session.expire_all()
+        with count_queries() as counter:
+            days = bucket_by_day(Lesson.in_range(class_ids, start, today), start, today)
+        lessons = sum(len(day) for day in days.values())
+        print(f"{label}: {lessons} lessons over {len(days)} days, {counter['queries']} queries, {counter['ms']:.1f} ms")
+
+
+def bench_conflicts():
+    """Conflict checks against a term of lessons for 50 classes sharing 20 rooms"""
+    print("\n=== Lesson conflicts ===")
+
+    classes = [create_class(1, lessons=0)[1] for _ in range(50)]
+    rng = np.random.default_rng(42)
+    today = date.today()
+
+    db.session.add_all(
+        Lesson(
+            subject='Math',
+            class_id=class_obj.id,
+            date=today + timedelta(days=day),
+            start_time=time(8 + slot, 0),
+            end_time=time(8 + slot, 45),
+            location=f'Room {rng.integers(20)}',
+            created_by=class_obj.teacher_id
+        )
+        for class_obj in classes
+        for day in range(120)
+        for slot in range(6)
+    )
+    db.session.commit()
+
+    with count_queries() as counter:
+        index = ScheduleIndex(lesson_slots(Lesson.date >= today, Lesson.date <= today + timedelta(days=119)))
+    print(f"Index of a 120-day term: {counter['queries']} queries, {counter['ms']:.1f} ms")
+
+    candidates = [
+        Slot.for_lesson(
+            classes[rng.integers(50)],
+            today + timedelta(days=int(rng.integers(120))),
+            time(int(rng.integers(8, 15)), 15),
+            time(int(rng.integers(15, 17)), 0),
+            f'Room {rng.integers(25)}'
+        )
+        for _ in range(10000)
+    ]
+    start = timer.perf_counter()
+    clashes = sum(1 for slot in candidates if index.conflicts(slot))
+    per_check = (timer.perf_counter() - start) / len(candidates) * 1e6
+    print(f"{len(candidates)} checks, {clashes} with clashes: {per_check:.1f} us per check")
+
+    rule_slots = [
+        Slot.for_lesson(classes[0], today + timedelta(weeks=week), time(15, 0), time(15, 45), 'Room 3')
+        for week in range(17)
+    ]
+    with count_queries() as counter:
+        conflicts = find_conflicts(rule_slots)
+    print(f"Recurring lesson over the term: {len(conflicts)} conflicts, {counter['queries']} queries, {counter['ms']:.1f} ms")
+
+
+def bench_import():
+    """Importing a 40-class term timetable from a CSV upload"""
+    print("\n=== Timetable import ===")
+
+    teacher, first = create_class(1, lessons=0)
+    classes = [first] + [Class(name=f'Import {i}', teacher_id=teacher.id) for i in range(1, 40)]
+    db.session.add_all(classes[1:])
+    db.session.commit()
+
+    # One teacher across 40 classes would clash, so every class gets its own room and hour
+    lines = ['subject,date,start_time,end_time,location,class']
+    start = date.today() + timedelta(days=1)
+    for day in range(120):
+        for index, class_obj in enumerate(classes):
+            hour = 7 + (index % 12)
+            lines.append(f'Math,{start + timedelta(days=day)},{hour:02d}:{(index // 12) * 15:02d},{hour:02d}:{(index // 12) * 15 + 10:02d},Room {index},{class_obj.name}')
+    lines.append(f'Broken,{start},10:00,09:00,,{first.name}')
+    data = '\n'.join(lines).encode()
+
+    with count_queries() as counter:
+        frame = read_timetable(io.BytesIO(data), 'term.csv')
+        created, errors, _ = import_timetable(frame, classes, teacher.id)
+        db.session.commit()
+    print(f"{len(frame)} rows ({len(data) / 1024:.0f} KB): {created} lessons, {len(errors)} errors, {counter['queries']} queries, {counter['ms']:.1f} ms")
+
+
+BENCHMARKS = {
+    'attendance': bench_attendance,
+    'analytics': bench_analytics,
+    'collections': bench_collections,
+    'recurring': bench_recurring,
+    'schedule': bench_schedule,
+    'conflicts': bench_conflicts,
+    'import': bench_import,
+}
+
+
+def main():
+    """Main function"""
+    if len(sys.argv) < 2:
+        print("Benchmark Tool")
+        print("\nUsage:")
+        print("  python benchmark.py all          - Run every benchmark")
+        print("  python benchmark.py attendance   - Bulk attendance marking")
+        print("  python benchmark.py analytics    - Attendance analytics engine")
+        print("  python benchmark.py collections  - Collection finance record creation")
+        print("  python benchmark.py recurring    - Recurring lesson expansion")
+        print("  python benchmark.py schedule     - Schedule range reads")
+        print("  python benchmark.py conflicts    - Lesson conflict checks")
+        print("  python benchmark.py import       - Timetable CSV import")
+        sys.exit(1)
+
+    command = sys.argv[1]
+
+    if command != 'all' and command not in BENCHMARKS:
+        print(f"Unknown benchmark: {command}")
+        sys.exit(1)
+
+    app = create_app('testing')
+
+    with app.app_context():
+        for name, benchmark in BENCHMARKS.items():
+            if command in ('all', name):
+                benchmark()
+
+
+if __name__ == '__main__':
+    main()
@@ -40,6 +40,32 @@ class Config:
     # Pagination
     ITEMS_PER_PAGE = 20
     
+    # Offline attendance sync
+    SYNC_MAX_BATCH = 500
+    
+    # Attendance analytics
+    ANALYTICS_WINDOW = 10  # lessons in the rolling attendance rate
+    AT_RISK_RATE = 75  # percent
+    AT_RISK_STREAK = 3  # consecutive absences
+    
+    # Attendance change log: events older than this are folded into snapshots
+    ATTENDANCE_EVENT_RETENTION_DAYS = 90
+    
+    # Recurring lessons are expanded this many days ahead (extended daily by 'init_db.py materialize')
+    RECURRING_HORIZON_DAYS = 90
+    
+    # Longest span the schedule range API returns in one request
+    SCHEDULE_MAX_RANGE_DAYS = 92
+    
+    # Calendar feeds include lessons from this many days back onwards
+    CALENDAR_FEED_PAST_DAYS = 30
+    
+    # Dashboard fragment cache: 'memory' (per process) or 'redis' (shared by all workers)
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND') or 'memory'
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL') or 'redis://localhost:6379/0'
+    CACHE_MAXSIZE = 1024  # fragments kept by the memory backend
+    CACHE_TIMEOUT = 300  # seconds
+    
     # Timezone
     TIMEZONE = 'UTC'
 
@@ -2,8 +2,12 @@
 """Database initialization script"""
 import os
 import sys
+from collections import Counter
+from datetime import date, datetime, timedelta
+from sqlalchemy import ForeignKeyConstraint, UniqueConstraint, and_, func, inspect, select, text, update
+from sqlalchemy.schema import AddConstraint, CreateTable
 from app import create_app, db
-from models import User, Class, Lesson, Attendance, Finance, Collection
+from models import User, Class, Lesson, Attendance, AttendanceEvent, AttendanceSnapshot, Finance, Collection, RecurringLesson
 
 
 def init_database():
@@ -61,6 +65,279 @@ def reset_database():
         print("✓ Database reset successfully!")
 
 
+def add_missing_columns(table, inspector):
+    """Add columns that exist on the model but not yet in the database"""
+    existing = {column['name'] for column in inspector.get_columns(table.name)}
+    
+    for column in table.columns:
+        if column.name in existing:
+            continue
+        
+        ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=db.engine.dialect)}'
+        if column.server_default is not None:
+            ddl += f" DEFAULT '{column.server_default.arg}'"
+            if not column.nullable:
+                ddl += ' NOT NULL'
+        
+        # Existing rows have no value yet, so such columns stay nullable until backfilled
+        print(f"  + {table.name}.{column.name}")
+        db.session.execute(text(ddl))
+
+
+def widen_timestamp_columns(table, inspector):
+    """Give existing MySQL DATETIME columns the fractional seconds the model declares"""
+    dialect = db.engine.dialect
+    if dialect.name != 'mysql':
+        return
+    
+    existing = {column['name']: column for column in inspector.get_columns(table.name)}
+    
+    for column in table.columns:
+        if column.name not in existing:
+            continue
+        
+        declared = column.type.compile(dialect=dialect)
+        if declared.startswith('DATETIME(') and existing[column.name]['type'].compile(dialect=dialect) == 'DATETIME':
+            print(f"  ~ {table.name}.{column.name} {declared}")
+            null = 'NULL' if existing[column.name]['nullable'] else 'NOT NULL'
+            db.session.execute(text(f'ALTER TABLE {table.name} MODIFY COLUMN {column.name} {declared} {null}'))
+
+
+def add_missing_indexes(table, inspector):
+    """Create indexes that exist on the model but not yet in the database"""
+    existing = {index['name'] for index in inspector.get_indexes(table.name)}
+    
+    for index in table.indexes:
+        if index.name not in existing:
+            print(f"  + index {index.name}")
+            index.create(db.session.connection())
+
+
+def add_missing_constraints(table, inspector):
+    """Create foreign keys and unique constraints that exist on the model but not yet in the database
+    
+    SQLite cannot add constraints to an existing table, so unique constraints
+    become unique indexes there and foreign keys are skipped.
+    """
+    sqlite = db.engine.dialect.name == 'sqlite'
+    foreign_keys = {tuple(fk['constrained_columns']) for fk in inspector.get_foreign_keys(table.name)}
+    unique = {constraint['name'] for constraint in inspector.get_unique_constraints(table.name)}
+    unique |= {index['name'] for index in inspector.get_indexes(table.name) if index['unique']}
+    
+    for constraint in table.constraints:
+        if isinstance(constraint, ForeignKeyConstraint):
+            if sqlite or tuple(constraint.column_keys) in foreign_keys:
+                continue
+            print(f"  + foreign key {table.name}({', '.join(constraint.column_keys)})")
+            db.session.execute(AddConstraint(constraint))
+        elif isinstance(constraint, UniqueConstraint) and constraint.name and constraint.name not in unique:
+            print(f"  + unique {constraint.name}")
+            if sqlite:
+                columns = ', '.join(column.name for column in constraint.columns)
+                db.session.execute(text(f'CREATE UNIQUE INDEX {constraint.name} ON {table.name} ({columns})'))
+            else:
+                db.session.execute(AddConstraint(constraint))
+
+
+def tighten_not_null_columns(table, inspector):
+    """Make backfilled columns NOT NULL where the model declares them so
+    
+    SQLite cannot alter a column, so there the table is rebuilt from the
+    model: created under a temporary name, filled, swapped in and indexed.
+    """
+    nullable = {column['name'] for column in inspector.get_columns(table.name) if column['nullable']}
+    columns = [
+        column for column in table.columns
+        if column.name in nullable and not column.nullable and not column.primary_key
+    ]
+    if not columns:
+        return
+    
+    dialect = db.engine.dialect
+    for column in columns:
+        print(f"  ~ {table.name}.{column.name} NOT NULL")
+    
+    if dialect.name == 'sqlite':
+        rebuilt = f'_new_{table.name}'
+        ddl = str(CreateTable(table).compile(dialect=dialect)).strip()
+        ddl = ddl.replace(f'CREATE TABLE {table.name} ', f'CREATE TABLE {rebuilt} ', 1)
+        names = ', '.join(column.name for column in table.columns)
+        db.session.execute(text(ddl))
+        db.session.execute(text(f'INSERT INTO {rebuilt} ({names}) SELECT {names} FROM {table.name}'))
+        db.session.execute(text(f'DROP TABLE {table.name}'))
+        db.session.execute(text(f'ALTER TABLE {rebuilt} RENAME TO {table.name}'))
+        for index in table.indexes:
+            index.create(db.session.connection())
+    elif dialect.name == 'mysql':
+        for column in columns:
+            db.session.execute(text(
+                f'ALTER TABLE {table.name} MODIFY COLUMN {column.name} {column.type.compile(dialect=dialect)} NOT NULL'
+            ))
+    else:
+        for column in columns:
+            db.session.execute(text(f'ALTER TABLE {table.name} ALTER COLUMN {column.name} SET NOT NULL'))
+
+
+def backfill_finance_collections():
+    """Link finance records to their collection by the old (class_id, collection_name) match
+    
+    Returns the IDs of the records that match no collection.
+    """
+    match = and_(Collection.class_id == Finance.class_id, Collection.name == Finance.collection_name)
+    
+    # Names unique within their class: one correlated UPDATE
+    db.session.execute(
+        update(Finance).where(
+            Finance.collection_id.is_(None),
+            select(func.count(Collection.id)).where(match).scalar_subquery() == 1
+        ).values(
+            collection_id=select(func.min(Collection.id)).where(match).scalar_subquery()
+        ).execution_options(synchronize_session=False)
+    )
+    
+    # Repeated names: pair each student's records with the collections in creation order
+    leftovers = db.session.query(
+        Finance.id, Finance.class_id, Finance.collection_name, Finance.student_id
+    ).filter(Finance.collection_id.is_(None)).order_by(Finance.id).all()
+    
+    if not leftovers:
+        return []
+    
+    collections = {}
+    for collection_id, class_id, name in db.session.query(Collection.id, Collection.class_id, Collection.name).order_by(Collection.id):
+        collections.setdefault((class_id, name), []).append(collection_id)
+    
+    seen = Counter()
+    links = []
+    for finance_id, class_id, name, student_id in leftovers:
+        candidates = collections.get((class_id, name), [])
+        position = seen[(class_id, name, student_id)]
+        seen[(class_id, name, student_id)] += 1
+        
+        if position < len(candidates):
+            links.append({'id': finance_id, 'collection_id': candidates[position]})
+    
+    if links:
+        db.session.execute(update(Finance), links)
+    
+    linked = {link['id'] for link in links}
+    return [finance_id for finance_id, _, _, _ in leftovers if finance_id not in linked]
+
+
+def migrate_database():
+    """Bring an existing database up to date with the models"""
+    app = create_app()
+    
+    with app.app_context():
+        print("Migrating database...")
+        inspector = inspect(db.engine)
+        
+        for table in db.metadata.tables.values():
+            add_missing_columns(table, inspector)
+            widen_timestamp_columns(table, inspector)
+            add_missing_indexes(table, inspector)
+        
+        print("Backfilling lesson attendance counters...")
+        Lesson.recount_attendance()
+        
+        print("Seeding attendance snapshots...")
+        print(f"  + {AttendanceSnapshot.backfill()} snapshot(s)")
+        
+        print("Linking finance records to collections...")
+        unlinked = backfill_finance_collections()
+        if unlinked:
+            db.session.rollback()
+            print(f"✗ {len(unlinked)} finance record(s) match no collection: {', '.join(map(str, unlinked))}")
+            print("  Create the missing collections or delete these records, then run the migration again.")
+            sys.exit(1)
+        
+        print("Backfilling collection payment counters...")
+        Collection.recount_payments()
+        
+        inspector = inspect(db.session.connection())
+        for table in db.metadata.tables.values():
+            tighten_not_null_columns(table, inspector)
+        
+        inspector = inspect(db.session.connection())
+        for table in db.metadata.tables.values():
+            add_missing_constraints(table, inspector)
+        
+        db.session.commit()
+        print("✓ Database migrated successfully!")
+
+
+def verify_counters(fix=False):
+    """Report (and optionally repair) lesson attendance counters that drifted"""
+    app = create_app()
+    
+    with app.app_context():
+        drift = Lesson.find_attendance_count_drift()
+        
+        for lesson_id, stored, actual in drift:
+            print(f"Lesson {lesson_id}: stored {stored}, actual {actual}")
+        
+        if not drift:
+            print("✓ All lesson attendance counters are consistent.")
+        elif fix:
+            Lesson.recount_attendance([lesson_id for lesson_id, _, _ in drift])
+            db.session.commit()
+            print(f"✓ Rebuilt counters for {len(drift)} lesson(s).")
+        else:
+            print(f"{len(drift)} lesson(s) out of sync. Run 'python init_db.py rebuild-counters' to repair.")
+        
+        return drift
+
+
+def verify_collections(fix=False):
+    """Report (and optionally repair) collection payment counters that drifted"""
+    app = create_app()
+    
+    with app.app_context():
+        drift = Collection.find_payment_count_drift()
+        
+        for collection_id, stored, actual in drift:
+            print(f"Collection {collection_id}: stored {stored}, actual {actual}")
+        
+        if not drift:
+            print("✓ All collection payment counters are consistent.")
+        elif fix:
+            Collection.recount_payments([collection_id for collection_id, _, _ in drift])
+            db.session.commit()
+            print(f"✓ Rebuilt counters for {len(drift)} collection(s).")
+        else:
+            print(f"{len(drift)} collection(s) out of sync. Run 'python init_db.py rebuild-collections' to repair.")
+        
+        return drift
+
+
+def compact_events(days=None):
+    """Fold old attendance change events into snapshots"""
+    app = create_app()
+    
+    with app.app_context():
+        days = app.config['ATTENDANCE_EVENT_RETENTION_DAYS'] if days is None else days
+        before = datetime.utcnow() - timedelta(days=days)
+        
+        print(f"Compacting attendance events before {before:%Y-%m-%d %H:%M}...")
+        folded = AttendanceSnapshot.compact(before)
+        db.session.commit()
+        print(f"✓ Folded {folded} event(s) into snapshots.")
+
+
+def materialize_lessons(days=None):
+    """Extend recurring lessons up to the rolling horizon"""
+    app = create_app()
+    
+    with app.app_context():
+        days = app.config['RECURRING_HORIZON_DAYS'] if days is None else days
+        until = date.today() + timedelta(days=days)
+        
+        print(f"Scheduling recurring lessons up to {until:%Y-%m-%d}...")
+        created = RecurringLesson.extend_all(until)
+        db.session.commit()
+        print(f"✓ Created {created} lesson(s).")
+
+
 def show_stats():
     """Show database statistics"""
     app = create_app()
@@ -73,7 +350,10 @@ def show_stats():
         print(f"  - Students: {User.query.filter_by(role='student').count()}")
         print(f"Classes: {Class.query.count()}")
         print(f"Lessons: {Lesson.query.count()}")
+        print(f"Recurring Lessons: {RecurringLesson.query.count()}")
         print(f"Attendance Records: {Attendance.query.count()}")
+        print(f"Attendance Events: {AttendanceEvent.query.count()}")
+        print(f"Attendance Snapshots: {AttendanceSnapshot.query.count()}")
         print(f"Finance Records: {Finance.query.count()}")
         print(f"Collections: {Collection.query.count()}")
 
@@ -85,7 +365,14 @@ def main():
         print("\nUsage:")
         print("  python init_db.py init      - Initialize database")
         print("  python init_db.py reset     - Reset database (CAUTION: deletes all data)")
+        print("  python init_db.py migrate   - Add new columns and indexes to an existing database")
         print("  python init_db.py stats     - Show database statistics")
+        print("  python init_db.py verify-counters  - Check lesson attendance counters")
+        print("  python init_db.py rebuild-counters - Repair lesson attendance counters")
+        print("  python init_db.py verify-collections  - Check collection payment counters")
+        print("  python init_db.py rebuild-collections - Repair collection payment counters")
+        print("  python init_db.py compact-events [days] - Fold old attendance events into snapshots")
+        print("  python init_db.py materialize [days]    - Schedule recurring lessons ahead (run daily)")
         sys.exit(1)
     
     command = sys.argv[1]
@@ -94,8 +381,24 @@ def main():
         init_database()
     elif command == 'reset':
         reset_database()
+    elif command == 'migrate':
+        migrate_database()
     elif command == 'stats':
         show_stats()
+    elif command == 'verify-counters':
+        if verify_counters():
+            sys.exit(1)
+    elif command == 'rebuild-counters':
+        verify_counters(fix=True)
+    elif command == 'verify-collections':
+        if verify_collections():
+            sys.exit(1)
+    elif command == 'rebuild-collections':
+        verify_collections(fix=True)
+    elif command == 'compact-events':
+        compact_events(int(sys.argv[2]) if len(sys.argv) > 2 else None)
+    elif command == 'materialize':
+        materialize_lessons(int(sys.argv[2]) if len(sys.argv) > 2 else None)
     else:
         print(f"Unknown command: {command}")
         sys.exit(1)
@@ -1,7 +1,8 @@
 from .user import User
 from .class_model import Class
 from .lesson import Lesson
-from .attendance import Attendance
+from .attendance import Attendance, AttendanceSyncKey, AttendanceEvent, AttendanceSnapshot
 from .finance import Finance, Collection
+from .recurring import RecurringLesson, RecurringLessonException, Holiday
 
-__all__ = ['User', 'Class', 'Lesson', 'Attendance', 'Finance', 'Collection']
\ No newline at end of file
+__all__ = ['User', 'Class', 'Lesson', 'Attendance', 'AttendanceSyncKey', 'AttendanceEvent', 'AttendanceSnapshot', 'Finance', 'Collection', 'RecurringLesson', 'RecurringLessonException', 'Holiday']
\ No newline at end of file
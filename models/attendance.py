@@ -1,5 +1,8 @@
 from datetime import datetime
+from sqlalchemy import and_, exists, func, insert, literal, select
+from sqlalchemy.dialects import mysql, postgresql, sqlite
 from app import db
+from .types import Timestamp
 
 
 class Attendance(db.Model):
@@ -14,7 +17,7 @@ class Attendance(db.Model):
     marked_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     marked_at = db.Column(db.DateTime, default=datetime.utcnow)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = db.Column(Timestamp, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationships
     student = db.relationship('User', foreign_keys=[student_id], back_populates='attendance_records')
@@ -29,6 +32,86 @@ class Attendance(db.Model):
     def __repr__(self):
         return f'<Attendance {self.student_id} - {self.lesson_id}: {self.status}>'
     
+    @classmethod
+    def bulk_upsert(cls, lesson_id, marks, marked_by, source='bulk'):
+        """Insert or update attendance for many students of a lesson at once
+        
+        ``marks`` is an iterable of dicts with ``student_id``, ``status`` and
+        optional ``notes``. On MySQL, PostgreSQL and SQLite this is a single
+        ``INSERT ... ON DUPLICATE KEY UPDATE`` / ``ON CONFLICT`` statement keyed
+        on ``unique_student_lesson``; other dialects load the existing records
+        for the lesson in one query. Every mark is also appended to the change
+        log. The caller is responsible for committing.
+        """
+        now = datetime.utcnow()
+        
+        # Later marks for the same student win, as they would with row-by-row updates
+        rows = {}
+        for mark in marks:
+            rows[int(mark['student_id'])] = {
+                'student_id': int(mark['student_id']),
+                'lesson_id': lesson_id,
+                'status': mark['status'],
+                'notes': mark.get('notes', ''),
+                'marked_by': marked_by,
+                'marked_at': now,
+                'created_at': now,
+                'updated_at': now
+            }
+        
+        if not rows:
+            return 0
+        
+        count = len(rows)
+        events = list(rows.values())
+        dialect = db.session.get_bind().dialect.name
+        
+        if dialect == 'mysql':
+            stmt = mysql.insert(cls.__table__).values(list(rows.values()))
+            stmt = stmt.on_duplicate_key_update(
+                status=stmt.inserted.status,
+                notes=stmt.inserted.notes,
+                marked_by=stmt.inserted.marked_by,
+                marked_at=stmt.inserted.marked_at,
+                updated_at=stmt.inserted.updated_at
+            )
+            db.session.execute(stmt)
+        elif dialect in ('postgresql', 'sqlite'):
+            insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+            stmt = insert(cls.__table__).values(list(rows.values()))
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['student_id', 'lesson_id'],
+                set_={
+                    'status': stmt.excluded.status,
+                    'notes': stmt.excluded.notes,
+                    'marked_by': stmt.excluded.marked_by,
+                    'marked_at': stmt.excluded.marked_at,
+                    'updated_at': stmt.excluded.updated_at
+                }
+            )
+            db.session.execute(stmt)
+        else:
+            existing = cls.query.filter(
+                cls.lesson_id == lesson_id,
+                cls.student_id.in_(rows.keys())
+            ).all()
+            
+            for attendance in existing:
+                row = rows.pop(attendance.student_id)
+                attendance.status = row['status']
+                attendance.notes = row['notes']
+                attendance.marked_by = marked_by
+                attendance.marked_at = now
+            
+            db.session.add_all(cls(**row) for row in rows.values())
+        
+        AttendanceEvent.record([
+            AttendanceEvent.entry(row['lesson_id'], row['student_id'], row['status'], row['notes'], marked_by, now, source)
+            for row in events
+        ])
+        
+        return count
+    
     def to_dict(self):
         """Convert attendance to dictionary"""
         return {
@@ -41,4 +124,264 @@ class Attendance(db.Model):
             'marked_by': self.marked_by,
             'marked_by_name': self.marker.full_name if self.marker else None,
             'marked_at': self.marked_at.isoformat() if self.marked_at else None
-        }
\ No newline at end of file
+        }
+
+class AttendanceSyncKey(db.Model):
+    """Idempotency keys of attendance marks applied through offline sync"""
+    __tablename__ = 'attendance_sync_keys'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    key = db.Column(db.String(64), nullable=False)
+    result = db.Column(db.String(20), nullable=False)  # e.g., "applied", "stale"
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Keys are generated on the client, so they are only unique per user
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'key', name='unique_user_sync_key'),
+    )
+    
+    def __repr__(self):
+        return f'<AttendanceSyncKey {self.user_id}:{self.key} {self.result}>'
+
+
+class AttendanceEvent(db.Model):
+    """Append-only log of attendance changes
+    
+    One row is written for every mark, in the same transaction as the
+    attendance record itself. Rows are never updated; old ones are folded
+    into ``AttendanceSnapshot`` by ``AttendanceSnapshot.compact``.
+    """
+    __tablename__ = 'attendance_events'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    lesson_id = db.Column(db.Integer, db.ForeignKey('lessons.id', ondelete='CASCADE'), nullable=False)
+    student_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    status = db.Column(db.Enum('present', 'late', 'absent'), nullable=False)
+    notes = db.Column(db.Text)
+    changed_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    changed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    source = db.Column(db.String(20), nullable=False)  # e.g., "mark", "bulk", "sync"
+    
+    __table_args__ = (
+        db.Index('ix_attendance_events_lesson', 'lesson_id', 'student_id', 'id'),
+        db.Index('ix_attendance_events_student', 'student_id', 'id'),
+        db.Index('ix_attendance_events_changed_at', 'changed_at'),
+    )
+    
+    def __repr__(self):
+        return f'<AttendanceEvent {self.student_id} - {self.lesson_id}: {self.status}>'
+    
+    @staticmethod
+    def entry(lesson_id, student_id, status, notes, changed_by, changed_at, source):
+        """Build an event row for ``record``"""
+        return {
+            'lesson_id': lesson_id,
+            'student_id': student_id,
+            'status': status,
+            'notes': notes,
+            'changed_by': changed_by,
+            'changed_at': changed_at,
+            'source': source
+        }
+    
+    @classmethod
+    def record(cls, entries):
+        """Append a batch of events with a single executemany INSERT"""
+        if entries:
+            db.session.execute(insert(cls.__table__), entries)
+    
+    @classmethod
+    def state_as_of(cls, lesson_id, at):
+        """Attendance of a lesson as it stood at ``at``
+        
+        Reads the lesson's snapshot rows plus the uncompacted tail of the log,
+        so the cost does not grow with the full history. Returns a dict of
+        student ID to a dict with ``status``, ``notes``, ``changed_by`` and
+        ``changed_at``. Exact for any time after the last compaction cutoff;
+        before that only the compacted state is known.
+        """
+        state = {}
+        
+        for snapshot in AttendanceSnapshot.query.filter(
+            AttendanceSnapshot.lesson_id == lesson_id,
+            AttendanceSnapshot.changed_at <= at
+        ):
+            state[snapshot.student_id] = snapshot.state()
+        
+        for event in cls.query.filter(
+            cls.lesson_id == lesson_id,
+            cls.changed_at <= at
+        ).order_by(cls.id):
+            state[event.student_id] = event.state()
+        
+        return state
+    
+    @classmethod
+    def history(cls, lesson_id, student_id=None):
+        """Who changed what: the compacted state followed by every later event
+        
+        Returns ``(snapshots, events)`` ordered oldest first, optionally for a
+        single student.
+        """
+        snapshots = AttendanceSnapshot.query.filter(AttendanceSnapshot.lesson_id == lesson_id)
+        events = cls.query.filter(cls.lesson_id == lesson_id)
+        
+        if student_id is not None:
+            snapshots = snapshots.filter(AttendanceSnapshot.student_id == student_id)
+            events = events.filter(cls.student_id == student_id)
+        
+        return (
+            snapshots.order_by(AttendanceSnapshot.changed_at).all(),
+            events.order_by(cls.id).all()
+        )
+    
+    def state(self):
+        """The attendance state this event set"""
+        return {
+            'status': self.status,
+            'notes': self.notes,
+            'changed_by': self.changed_by,
+            'changed_at': self.changed_at
+        }
+    
+    def to_dict(self):
+        """Convert event to dictionary"""
+        return {
+            'id': self.id,
+            'lesson_id': self.lesson_id,
+            'student_id': self.student_id,
+            'status': self.status,
+            'notes': self.notes,
+            'changed_by': self.changed_by,
+            'changed_at': self.changed_at.isoformat() if self.changed_at else None,
+            'source': self.source
+        }
+
+
+class AttendanceSnapshot(db.Model):
+    """Compacted attendance state per student and lesson
+    
+    Holds the last state each record reached before the log was compacted,
+    so "as of" queries only need the snapshot plus the remaining events.
+    """
+    __tablename__ = 'attendance_snapshots'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    lesson_id = db.Column(db.Integer, db.ForeignKey('lessons.id', ondelete='CASCADE'), nullable=False)
+    student_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    status = db.Column(db.Enum('present', 'late', 'absent'), nullable=False)
+    notes = db.Column(db.Text)
+    changed_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    changed_at = db.Column(db.DateTime, nullable=False)
+    event_id = db.Column(db.Integer)  # last folded event, empty when seeded from attendance
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.UniqueConstraint('lesson_id', 'student_id', name='unique_snapshot_lesson_student'),
+    )
+    
+    def __repr__(self):
+        return f'<AttendanceSnapshot {self.student_id} - {self.lesson_id}: {self.status}>'
+    
+    @classmethod
+    def compact(cls, before):
+        """Fold events older than ``before`` into snapshots and drop them
+        
+        Set-based regardless of log size: replaced snapshots are deleted and
+        re-inserted from the latest old event of each record, then the folded
+        events are deleted. Returns the number of events folded. The caller
+        is responsible for committing.
+        """
+        event = AttendanceEvent.__table__
+        snapshot = cls.__table__
+        
+        # Marks only ever move a record's timestamp forward, so per record the
+        # old events are exactly a prefix of its log
+        folded = event.c.changed_at < before
+        latest = select(func.max(event.c.id)).where(folded).group_by(event.c.lesson_id, event.c.student_id)
+        
+        # Replace the snapshots of every record that has events to fold
+        db.session.execute(
+            snapshot.delete().where(
+                exists().where(
+                    folded,
+                    event.c.lesson_id == snapshot.c.lesson_id,
+                    event.c.student_id == snapshot.c.student_id
+                )
+            )
+        )
+        
+        db.session.execute(
+            insert(snapshot).from_select(
+                ['lesson_id', 'student_id', 'status', 'notes', 'changed_by', 'changed_at', 'event_id', 'created_at'],
+                select(
+                    event.c.lesson_id,
+                    event.c.student_id,
+                    event.c.status,
+                    event.c.notes,
+                    event.c.changed_by,
+                    event.c.changed_at,
+                    event.c.id,
+                    literal(datetime.utcnow(), db.DateTime)
+                ).where(event.c.id.in_(latest))
+            )
+        )
+        
+        return db.session.execute(event.delete().where(folded)).rowcount
+    
+    @classmethod
+    def backfill(cls):
+        """Seed snapshots for attendance recorded before the change log existed
+        
+        Only records with neither a snapshot nor any event are seeded, so this
+        is safe to run repeatedly. Returns the number of snapshots created.
+        """
+        record = Attendance.__table__
+        event = AttendanceEvent.__table__
+        snapshot = cls.__table__
+        
+        return db.session.execute(
+            insert(snapshot).from_select(
+                ['lesson_id', 'student_id', 'status', 'notes', 'changed_by', 'changed_at', 'created_at'],
+                select(
+                    record.c.lesson_id,
+                    record.c.student_id,
+                    record.c.status,
+                    record.c.notes,
+                    record.c.marked_by,
+                    func.coalesce(record.c.marked_at, record.c.created_at),
+                    literal(datetime.utcnow(), db.DateTime)
+                ).where(
+                    ~exists().where(and_(
+                        snapshot.c.lesson_id == record.c.lesson_id,
+                        snapshot.c.student_id == record.c.student_id
+                    )),
+                    ~exists().where(and_(
+                        event.c.lesson_id == record.c.lesson_id,
+                        event.c.student_id == record.c.student_id
+                    ))
+                )
+            )
+        ).rowcount
+    
+    def state(self):
+        """The compacted attendance state"""
+        return {
+            'status': self.status,
+            'notes': self.notes,
+            'changed_by': self.changed_by,
+            'changed_at': self.changed_at
+        }
+    
+    def to_dict(self):
+        """Convert snapshot to dictionary"""
+        return {
+            'lesson_id': self.lesson_id,
+            'student_id': self.student_id,
+            'status': self.status,
+            'notes': self.notes,
+            'changed_by': self.changed_by,
+            'changed_at': self.changed_at.isoformat() if self.changed_at else None,
+            'compacted': True
+        }
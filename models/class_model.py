@@ -1,5 +1,6 @@
 from datetime import datetime
 from app import db
+from .types import Timestamp
 
 
 class Class(db.Model):
@@ -13,7 +14,7 @@ class Class(db.Model):
     academic_year = db.Column(db.String(20))  # e.g., "2024-2025"
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = db.Column(Timestamp, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationships
     teacher = db.relationship('User', back_populates='taught_classes', foreign_keys=[teacher_id])
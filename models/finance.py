@@ -1,5 +1,9 @@
 from datetime import datetime
+from decimal import Decimal
+from sqlalchemy import case, func, insert, literal, or_, select, update
 from app import db
+from .types import Timestamp
+from .user import User
 
 
 class Finance(db.Model):
@@ -8,30 +12,90 @@ class Finance(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     class_id = db.Column(db.Integer, db.ForeignKey('classes.id'), nullable=False)
-    collection_name = db.Column(db.String(200), nullable=False)  # e.g., "Textbooks", "School Trip"
+    collection_id = db.Column(db.Integer, db.ForeignKey('collections.id', ondelete='CASCADE'), nullable=False)
+    collection_name = db.Column(db.String(200), nullable=False)  # Copy of the collection name for display
     description = db.Column(db.Text)
-    amount = db.Column(db.Decimal(10, 2), nullable=False)  # Expected amount per student
+    amount = db.Column(db.Numeric(10, 2), nullable=False)  # Expected amount per student
     student_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     paid = db.Column(db.Boolean, default=False)
     payment_date = db.Column(db.DateTime)
     notes = db.Column(db.Text)
     created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = db.Column(Timestamp, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationships
     student = db.relationship('User', foreign_keys=[student_id], back_populates='finance_records')
     creator = db.relationship('User', foreign_keys=[created_by])
     class_obj = db.relationship('Class', foreign_keys=[class_id])
+    collection = db.relationship('Collection', back_populates='finance_records')
+    
+    # One finance record per student per collection
+    __table_args__ = (
+        db.UniqueConstraint('collection_id', 'student_id', name='unique_collection_student'),
+    )
     
     def __repr__(self):
         return f'<Finance {self.collection_name} - Student {self.student_id}: {"Paid" if self.paid else "Unpaid"}>'
     
+    @classmethod
+    def mark_paid_bulk(cls, records, payments):
+        """Mark many unpaid records as paid in one ``UPDATE ... WHERE id IN``
+        
+        ``records`` are the unpaid Finance records being paid, ideally loaded
+        ``with_for_update``; ``payments`` maps each record ID to a
+        ``(payment_date, notes)`` pair, applied through ``CASE`` on the ID.
+        Collection counters get one UPDATE per collection touched; if some
+        records were paid concurrently and skipped, the touched collections
+        are recounted instead. Returns the number of records marked. The
+        caller is responsible for committing.
+        """
+        if not records:
+            return 0
+        
+        ids = [record.id for record in records]
+        marked = db.session.execute(
+            update(cls)
+            .where(cls.id.in_(ids), cls.paid.is_(False))
+            .values(
+                paid=True,
+                payment_date=case({record_id: payments[record_id][0] for record_id in ids}, value=cls.id),
+                notes=case({record_id: payments[record_id][1] for record_id in ids}, value=cls.id)
+            )
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        
+        totals = {}
+        for record in records:
+            count, amount = totals.get(record.collection_id, (0, 0))
+            totals[record.collection_id] = (count + 1, amount + record.amount)
+        
+        if marked != len(ids):
+            # The deltas would count records another request already paid
+            Collection.recount_payments(totals.keys())
+        else:
+            for collection_id, (count, amount) in totals.items():
+                db.session.execute(
+                    update(Collection)
+                    .where(Collection.id == collection_id)
+                    .values(
+                        paid_count=Collection.paid_count + count,
+                        collected_amount=Collection.collected_amount + amount
+                    )
+                )
+        
+        # The ORM copies of the records are now stale
+        for record in records:
+            db.session.expire(record)
+        
+        return marked
+    
     def to_dict(self):
         """Convert finance record to dictionary"""
         return {
             'id': self.id,
             'class_id': self.class_id,
+            'collection_id': self.collection_id,
             'collection_name': self.collection_name,
             'description': self.description,
             'amount': float(self.amount) if self.amount else 0,
@@ -53,48 +117,224 @@ class Collection(db.Model):
     class_id = db.Column(db.Integer, db.ForeignKey('classes.id'), nullable=False)
     name = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text)
-    amount_per_student = db.Column(db.Decimal(10, 2), nullable=False)
+    amount_per_student = db.Column(db.Numeric(10, 2), nullable=False)
     due_date = db.Column(db.DateTime)
     is_active = db.Column(db.Boolean, default=True)
     created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    
+    # Denormalized payment counters, kept in sync by the finance write paths
+    student_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    paid_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    collected_amount = db.Column(db.Numeric(10, 2), nullable=False, default=0, server_default='0')
+    
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = db.Column(Timestamp, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationships
     class_obj = db.relationship('Class', foreign_keys=[class_id])
     creator = db.relationship('User', foreign_keys=[created_by])
+    finance_records = db.relationship('Finance', back_populates='collection', cascade='all, delete-orphan', passive_deletes=True)
     
     def __repr__(self):
         return f'<Collection {self.name}>'
     
     def get_total_collected(self):
         """Calculate total amount collected"""
-        paid_records = Finance.query.filter_by(
-            class_id=self.class_id,
-            collection_name=self.name,
-            paid=True
-        ).all()
-        return sum(float(record.amount) for record in paid_records)
+        return self.collected_amount if self.collected_amount is not None else Decimal('0.00')
     
     def get_payment_status(self):
         """Get payment status summary"""
-        all_records = Finance.query.filter_by(
-            class_id=self.class_id,
-            collection_name=self.name
-        ).all()
-        
-        total_students = len(all_records)
-        paid_count = len([r for r in all_records if r.paid])
-        unpaid_count = total_students - paid_count
+        total_students = self.student_count or 0
+        paid_count = self.paid_count or 0
         
         return {
             'total_students': total_students,
             'paid': paid_count,
-            'unpaid': unpaid_count,
+            'unpaid': total_students - paid_count,
             'total_collected': self.get_total_collected(),
-            'expected_total': float(self.amount_per_student) * total_students
+            'expected_total': self.amount_per_student * total_students
         }
     
+    def create_student_records(self, created_by):
+        """Create an unpaid finance record for every student of the class
+        
+        A single ``INSERT ... SELECT`` from ``users`` filtered by class and
+        role, so no member rows are loaded into Python. Sets ``student_count``
+        and returns it. The collection must be flushed first; the caller is
+        responsible for committing.
+        """
+        now = datetime.utcnow()
+        students = select(
+            literal(self.class_id),
+            literal(self.id),
+            literal(self.name, db.String),
+            literal(self.description, db.Text),
+            literal(self.amount_per_student, db.Numeric(10, 2)),
+            User.id,
+            literal(False, db.Boolean),
+            literal(created_by),
+            literal(now, db.DateTime),
+            literal(now, db.DateTime)
+        ).where(
+            User.class_id == self.class_id,
+            User.role == 'student'
+        )
+        
+        result = db.session.execute(
+            insert(Finance).from_select(
+                ['class_id', 'collection_id', 'collection_name', 'description', 'amount', 'student_id',
+                 'paid', 'created_by', 'created_at', 'updated_at'],
+                students
+            )
+        )
+        
+        self.student_count = result.rowcount
+        return self.student_count
+    
+    @classmethod
+    def get_payment_statuses(cls, collections):
+        """Payment status summaries for many collections, keyed by collection ID"""
+        return {collection.id: collection.get_payment_status() for collection in collections}
+    
+    def adjust_payment_counts(self, paid=0, collected=0, students=0):
+        """Apply counter deltas after a payment or enrollment change, in one atomic UPDATE"""
+        db.session.execute(
+            update(Collection)
+            .where(Collection.id == self.id)
+            .values(
+                paid_count=Collection.paid_count + paid,
+                collected_amount=Collection.collected_amount + collected,
+                student_count=Collection.student_count + students
+            )
+        )
+    
+    @classmethod
+    def enroll_student(cls, class_id, student_id, created_by):
+        """Give a student joining a class an unpaid record in each active collection
+        
+        Returns the number of records created. The caller is responsible for
+        committing.
+        """
+        collections = db.session.query(cls.id, cls.name, cls.description, cls.amount_per_student).filter(
+            cls.class_id == class_id,
+            cls.is_active.is_(True),
+            ~select(Finance.id).where(
+                Finance.collection_id == cls.id,
+                Finance.student_id == student_id
+            ).exists()
+        ).all()
+        
+        if not collections:
+            return 0
+        
+        now = datetime.utcnow()
+        db.session.execute(insert(Finance.__table__), [
+            {
+                'class_id': class_id,
+                'collection_id': collection_id,
+                'collection_name': name,
+                'description': description,
+                'amount': amount,
+                'student_id': student_id,
+                'paid': False,
+                'created_by': created_by,
+                'created_at': now,
+                'updated_at': now
+            }
+            for collection_id, name, description, amount in collections
+        ])
+        
+        collection_ids = [collection[0] for collection in collections]
+        db.session.execute(
+            update(cls)
+            .where(cls.id.in_(collection_ids))
+            .values(student_count=cls.student_count + 1)
+            .execution_options(synchronize_session=False)
+        )
+        
+        return len(collection_ids)
+    
+    @classmethod
+    def withdraw_student(cls, class_id, student_id):
+        """Drop a student's unpaid records when they leave a class
+        
+        Paid records are kept as history. Returns the number of records
+        removed. The caller is responsible for committing.
+        """
+        unpaid = db.session.query(Finance.id, Finance.collection_id).filter(
+            Finance.class_id == class_id,
+            Finance.student_id == student_id,
+            Finance.paid.is_(False)
+        ).all()
+        
+        if not unpaid:
+            return 0
+        
+        db.session.execute(
+            Finance.__table__.delete().where(Finance.id.in_([record[0] for record in unpaid]))
+        )
+        db.session.execute(
+            update(cls)
+            .where(cls.id.in_([record[1] for record in unpaid]))
+            .values(student_count=cls.student_count - 1)
+            .execution_options(synchronize_session=False)
+        )
+        
+        return len(unpaid)
+    
+    @staticmethod
+    def _actual_counts():
+        """Correlated subqueries over a collection's finance records"""
+        records = Finance.collection_id == Collection.id
+        paid = Finance.paid.is_(True)
+        
+        return {
+            'student_count': select(func.count(Finance.id)).where(records).scalar_subquery(),
+            'paid_count': select(func.count(Finance.id)).where(records, paid).scalar_subquery(),
+            'collected_amount': select(func.coalesce(func.sum(Finance.amount), 0)).where(records, paid).scalar_subquery()
+        }
+    
+    @classmethod
+    def recount_payments(cls, collection_ids=None):
+        """Recompute payment counters from the finance table in one UPDATE"""
+        stmt = update(cls).values(updated_at=cls.updated_at, **cls._actual_counts())
+        
+        if collection_ids is not None:
+            stmt = stmt.where(cls.id.in_(list(collection_ids)))
+        
+        db.session.execute(stmt.execution_options(synchronize_session=False))
+    
+    @classmethod
+    def find_payment_count_drift(cls):
+        """Return (collection_id, stored, actual) for collections whose counters are out of sync"""
+        actual = cls._actual_counts()
+        
+        rows = db.session.query(
+            cls.id,
+            cls.student_count,
+            cls.paid_count,
+            cls.collected_amount,
+            actual['student_count'],
+            actual['paid_count'],
+            actual['collected_amount']
+        ).filter(
+            or_(
+                cls.student_count != actual['student_count'],
+                cls.paid_count != actual['paid_count'],
+                # Rounded, as SQLite keeps NUMERIC values as floats
+                func.round(cls.collected_amount, 2) != func.round(actual['collected_amount'], 2)
+            )
+        ).all()
+        
+        return [
+            (
+                row[0],
+                {'students': row[1], 'paid': row[2], 'collected': row[3]},
+                {'students': row[4], 'paid': row[5], 'collected': row[6]}
+            )
+            for row in rows
+        ]
+    
     def to_dict(self):
         """Convert collection to dictionary"""
         return {
@@ -106,5 +346,8 @@ class Collection(db.Model):
             'due_date': self.due_date.isoformat() if self.due_date else None,
             'is_active': self.is_active,
             'created_at': self.created_at.isoformat() if self.created_at else None,
-            'payment_status': self.get_payment_status()
+            'payment_status': {
+                key: float(value) if isinstance(value, Decimal) else value
+                for key, value in self.get_payment_status().items()
+            }
         }
\ No newline at end of file
@@ -1,5 +1,8 @@
 from datetime import datetime
+from sqlalchemy import case, func, or_, select, update
 from app import db
+from .types import Timestamp
+from .attendance import Attendance
 
 
 class Lesson(db.Model):
@@ -15,31 +18,132 @@ class Lesson(db.Model):
     description = db.Column(db.Text)
     location = db.Column(db.String(100))  # e.g., "Room 204"
     created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    recurring_id = db.Column(db.Integer, db.ForeignKey('recurring_lessons.id', ondelete='SET NULL'))  # Rule that generated the lesson
+    
+    # Denormalized attendance counters, kept in sync by the attendance write paths
+    present_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    late_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    absent_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = db.Column(Timestamp, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationships
     class_obj = db.relationship('Class', back_populates='lessons')
     creator = db.relationship('User', foreign_keys=[created_by])
     attendance_records = db.relationship('Attendance', back_populates='lesson', cascade='all, delete-orphan')
+    recurring = db.relationship('RecurringLesson', foreign_keys=[recurring_id])
+    
+    # One generated lesson per rule and date; schedule ranges are read in
+    # (class, date, start time) order straight from the index, and room
+    # conflict checks look up (date, location)
+    __table_args__ = (
+        db.UniqueConstraint('recurring_id', 'date', name='unique_recurring_date'),
+        db.Index('ix_lessons_class_date', 'class_id', 'date', 'start_time'),
+        db.Index('ix_lessons_date_location', 'date', 'location'),
+    )
     
     def __repr__(self):
         return f'<Lesson {self.subject} on {self.date}>'
     
+    @classmethod
+    def in_range(cls, class_ids, start, end):
+        """Lessons of the given classes from ``start`` to ``end`` inclusive, in schedule order"""
+        return cls.query.filter(
+            cls.class_id.in_(list(class_ids)),
+            cls.date >= start,
+            cls.date <= end
+        ).order_by(cls.date, cls.start_time).all()
+    
     def get_attendance_count(self):
         """Get attendance statistics for this lesson"""
-        total = len(self.attendance_records)
-        present = len([a for a in self.attendance_records if a.status == 'present'])
-        late = len([a for a in self.attendance_records if a.status == 'late'])
-        absent = len([a for a in self.attendance_records if a.status == 'absent'])
+        present = self.present_count or 0
+        late = self.late_count or 0
+        absent = self.absent_count or 0
         
         return {
-            'total': total,
+            'total': present + late + absent,
             'present': present,
             'late': late,
             'absent': absent
         }
     
+    def adjust_attendance_count(self, old_status, new_status):
+        """Move one student between counters after a single attendance change"""
+        if old_status == new_status:
+            return
+        
+        values = {}
+        if old_status:
+            column = getattr(Lesson, f'{old_status}_count')
+            values[column.key] = column - 1
+        if new_status:
+            column = getattr(Lesson, f'{new_status}_count')
+            values[column.key] = column + 1
+        
+        # Counter changes are not schedule changes, so keep updated_at as is
+        db.session.execute(
+            update(Lesson)
+            .where(Lesson.id == self.id)
+            .values(updated_at=Lesson.updated_at, **values)
+        )
+    
+    @staticmethod
+    def _actual_count(status):
+        """Correlated subquery counting a lesson's attendance records by status"""
+        return select(func.count(Attendance.id)).where(
+            Attendance.lesson_id == Lesson.id,
+            Attendance.status == status
+        ).scalar_subquery()
+    
+    @classmethod
+    def recount_attendance(cls, lesson_ids=None):
+        """Recompute attendance counters from the attendance table in one UPDATE"""
+        stmt = update(cls).values(
+            present_count=cls._actual_count('present'),
+            late_count=cls._actual_count('late'),
+            absent_count=cls._actual_count('absent'),
+            updated_at=cls.updated_at
+        )
+        
+        if lesson_ids is not None:
+            stmt = stmt.where(cls.id.in_(list(lesson_ids)))
+        
+        db.session.execute(stmt.execution_options(synchronize_session=False))
+    
+    @classmethod
+    def find_attendance_count_drift(cls):
+        """Return (lesson_id, stored, actual) for lessons whose counters are out of sync"""
+        actual = db.session.query(
+            Attendance.lesson_id.label('lesson_id'),
+            func.sum(case((Attendance.status == 'present', 1), else_=0)).label('present'),
+            func.sum(case((Attendance.status == 'late', 1), else_=0)).label('late'),
+            func.sum(case((Attendance.status == 'absent', 1), else_=0)).label('absent')
+        ).group_by(Attendance.lesson_id).subquery()
+        
+        present = func.coalesce(actual.c.present, 0)
+        late = func.coalesce(actual.c.late, 0)
+        absent = func.coalesce(actual.c.absent, 0)
+        
+        rows = db.session.query(
+            cls.id, cls.present_count, cls.late_count, cls.absent_count, present, late, absent
+        ).outerjoin(actual, actual.c.lesson_id == cls.id).filter(
+            or_(
+                cls.present_count != present,
+                cls.late_count != late,
+                cls.absent_count != absent
+            )
+        ).all()
+        
+        return [
+            (
+                row[0],
+                {'present': row[1], 'late': row[2], 'absent': row[3]},
+                {'present': row[4], 'late': row[5], 'absent': row[6]}
+            )
+            for row in rows
+        ]
+    
     def to_dict(self):
         """Convert lesson to dictionary"""
         return {
@@ -52,5 +156,6 @@ class Lesson(db.Model):
             'end_time': self.end_time.strftime('%H:%M') if self.end_time else None,
             'description': self.description,
             'location': self.location,
+            'recurring_id': self.recurring_id,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
\ No newline at end of file
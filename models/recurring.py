@@ -0,0 +1,351 @@
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from sqlalchemy import and_, delete, exists, insert, or_, update
+from app import db
+from .types import Timestamp
+from .attendance import Attendance
+from .lesson import Lesson
+
+
+WEEKDAYS = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+
+
+class RecurringLesson(db.Model):
+    """Weekly lesson rule, expanded into Lesson rows up to a rolling horizon"""
+    __tablename__ = 'recurring_lessons'
+    
+    # Lessons written per executemany INSERT when expanding rules
+    BATCH_SIZE = 1000
+    
+    id = db.Column(db.Integer, primary_key=True)
+    class_id = db.Column(db.Integer, db.ForeignKey('classes.id'), nullable=False)
+    subject = db.Column(db.String(100), nullable=False)
+    weekday = db.Column(db.Integer, nullable=False)  # 0 = Monday
+    start_time = db.Column(db.Time, nullable=False)
+    end_time = db.Column(db.Time, nullable=False)
+    description = db.Column(db.Text)
+    location = db.Column(db.String(100))
+    start_date = db.Column(db.Date, nullable=False)
+    end_date = db.Column(db.Date, nullable=False)
+    materialized_until = db.Column(db.Date)  # Last date expanded into lessons
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(Timestamp, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # Relationships
+    class_obj = db.relationship('Class', foreign_keys=[class_id])
+    creator = db.relationship('User', foreign_keys=[created_by])
+    exceptions = db.relationship('RecurringLessonException', back_populates='recurring', cascade='all, delete-orphan', passive_deletes=True)
+    
+    __table_args__ = (
+        db.Index('ix_recurring_lessons_class', 'class_id'),
+    )
+    
+    def __repr__(self):
+        return f'<RecurringLesson {self.subject} on {WEEKDAYS[self.weekday]}s>'
+    
+    @property
+    def weekday_name(self):
+        """Name of the rule's weekday"""
+        return WEEKDAYS[self.weekday]
+    
+    def occurrences(self, start, end, skip=()):
+        """Dates of the rule from ``start`` to ``end`` inclusive, leaving out ``skip``"""
+        day = start + timedelta(days=(self.weekday - start.weekday()) % 7)
+        dates = []
+        while day <= end:
+            if day not in skip:
+                dates.append(day)
+            day += timedelta(weeks=1)
+        return dates
+    
+    @classmethod
+    def materialize(cls, rules, until, since=None):
+        """Expand rules into Lesson rows up to ``until``
+        
+        Each rule is expanded from the day after its ``materialized_until``,
+        or from ``since`` when given, and never outside its own start and
+        end dates. Exceptions, holidays and dates that already have a lesson
+        of the rule are skipped, so expanding twice is harmless. Skipped
+        dates are loaded with one query each for all rules, and lessons are
+        written with one executemany INSERT per ``BATCH_SIZE`` rows. Returns
+        the number of lessons created. The caller is responsible for
+        committing.
+        """
+        windows = {}
+        for rule in rules:
+            if since is not None:
+                start = max(rule.start_date, since)
+            elif rule.materialized_until is not None:
+                start = max(rule.start_date, rule.materialized_until + timedelta(days=1))
+            else:
+                start = rule.start_date
+            end = min(rule.end_date, until)
+            if start <= end:
+                windows[rule.id] = (start, end)
+        
+        if not windows:
+            return 0
+        
+        rule_ids = list(windows)
+        first = min(start for start, _ in windows.values())
+        last = max(end for _, end in windows.values())
+        
+        skip = defaultdict(set)
+        for rule_id, day in db.session.query(RecurringLessonException.recurring_id, RecurringLessonException.date).filter(
+            RecurringLessonException.recurring_id.in_(rule_ids),
+            RecurringLessonException.date.between(first, last)
+        ):
+            skip[rule_id].add(day)
+        for rule_id, day in db.session.query(Lesson.recurring_id, Lesson.date).filter(
+            Lesson.recurring_id.in_(rule_ids),
+            Lesson.date.between(first, last)
+        ):
+            skip[rule_id].add(day)
+        
+        holidays = Holiday.dates({rule.class_id for rule in rules}, first, last)
+        
+        now = datetime.utcnow()
+        rows = []
+        for rule in rules:
+            if rule.id not in windows:
+                continue
+            
+            start, end = windows[rule.id]
+            excluded = skip[rule.id] | holidays[None] | holidays[rule.class_id]
+            rows.extend(
+                {
+                    'subject': rule.subject,
+                    'class_id': rule.class_id,
+                    'recurring_id': rule.id,
+                    'date': day,
+                    'start_time': rule.start_time,
+                    'end_time': rule.end_time,
+                    'description': rule.description,
+                    'location': rule.location,
+                    'created_by': rule.created_by,
+                    'created_at': now,
+                    'updated_at': now
+                }
+                for day in rule.occurrences(start, end, excluded)
+            )
+            rule.materialized_until = max(rule.materialized_until or end, end)
+        
+        for offset in range(0, len(rows), cls.BATCH_SIZE):
+            db.session.execute(insert(Lesson.__table__), rows[offset:offset + cls.BATCH_SIZE])
+        
+        return len(rows)
+    
+    @classmethod
+    def extend_all(cls, until):
+        """Expand every rule still running up to ``until``; returns the number of lessons created"""
+        rules = cls.query.filter(
+            cls.end_date >= date.today(),
+            or_(
+                cls.materialized_until.is_(None),
+                and_(cls.materialized_until < cls.end_date, cls.materialized_until < until)
+            )
+        ).all()
+        return cls.materialize(rules, until)
+    
+    def remove_future_lessons(self, after):
+        """Delete the rule's lessons dated after ``after`` that have no attendance marked
+        
+        Returns the number of lessons removed.
+        """
+        return db.session.execute(
+            delete(Lesson)
+            .where(
+                Lesson.recurring_id == self.id,
+                Lesson.date > after,
+                ~exists().where(Attendance.lesson_id == Lesson.id)
+            )
+            .execution_options(synchronize_session=False)
+        ).rowcount
+    
+    def regenerate(self, until):
+        """Re-expand the rule after it changed
+        
+        Only future lessons without attendance are replaced; past and marked
+        lessons are kept as they are. Returns ``(removed, created)``. The
+        caller is responsible for committing.
+        """
+        today = date.today()
+        removed = self.remove_future_lessons(today)
+        self.materialized_until = today
+        created = RecurringLesson.materialize([self], until, since=today + timedelta(days=1))
+        return removed, created
+    
+    def skip_date(self, day, reason=None):
+        """Cancel one occurrence, removing its lesson unless attendance was marked
+        
+        Returns True when a lesson was removed.
+        """
+        if not any(exception.date == day for exception in self.exceptions):
+            self.exceptions.append(RecurringLessonException(date=day, reason=reason))
+        
+        removed = db.session.execute(
+            delete(Lesson)
+            .where(
+                Lesson.recurring_id == self.id,
+                Lesson.date == day,
+                ~exists().where(Attendance.lesson_id == Lesson.id)
+            )
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        return removed > 0
+    
+    def end(self):
+        """Stop the rule: drop its future unmarked lessons and detach the rest
+        
+        Returns the number of lessons removed. The caller deletes the rule and
+        commits.
+        """
+        removed = self.remove_future_lessons(date.today())
+        db.session.execute(
+            update(Lesson)
+            .where(Lesson.recurring_id == self.id)
+            .values(recurring_id=None)
+            .execution_options(synchronize_session=False)
+        )
+        return removed
+    
+    @staticmethod
+    def detach(lesson):
+        """Turn a generated lesson into a one-off before it is edited or deleted
+        
+        An exception is recorded for its date, so regenerating the rule does
+        not bring the original occurrence back.
+        """
+        if lesson.recurring_id is None:
+            return
+        
+        exists_already = db.session.query(
+            exists().where(
+                RecurringLessonException.recurring_id == lesson.recurring_id,
+                RecurringLessonException.date == lesson.date
+            )
+        ).scalar()
+        if not exists_already:
+            db.session.add(RecurringLessonException(recurring_id=lesson.recurring_id, date=lesson.date))
+        
+        lesson.recurring_id = None
+    
+    def to_dict(self):
+        """Convert recurring lesson to dictionary"""
+        return {
+            'id': self.id,
+            'class_id': self.class_id,
+            'subject': self.subject,
+            'weekday': self.weekday,
+            'start_time': self.start_time.strftime('%H:%M') if self.start_time else None,
+            'end_time': self.end_time.strftime('%H:%M') if self.end_time else None,
+            'description': self.description,
+            'location': self.location,
+            'start_date': self.start_date.isoformat() if self.start_date else None,
+            'end_date': self.end_date.isoformat() if self.end_date else None,
+            'materialized_until': self.materialized_until.isoformat() if self.materialized_until else None
+        }
+
+
+class RecurringLessonException(db.Model):
+    """A date on which a recurring lesson does not take place"""
+    __tablename__ = 'recurring_lesson_exceptions'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    recurring_id = db.Column(db.Integer, db.ForeignKey('recurring_lessons.id', ondelete='CASCADE'), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    reason = db.Column(db.String(200))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Relationships
+    recurring = db.relationship('RecurringLesson', back_populates='exceptions')
+    
+    __table_args__ = (
+        db.UniqueConstraint('recurring_id', 'date', name='unique_recurring_exception'),
+    )
+    
+    def __repr__(self):
+        return f'<RecurringLessonException {self.recurring_id} on {self.date}>'
+
+
+class Holiday(db.Model):
+    """A day without recurring lessons, for one class or for every class when ``class_id`` is empty"""
+    __tablename__ = 'holidays'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    class_id = db.Column(db.Integer, db.ForeignKey('classes.id'), nullable=True)
+    date = db.Column(db.Date, nullable=False)
+    name = db.Column(db.String(200), nullable=False)
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(Timestamp, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # Relationships
+    class_obj = db.relationship('Class', foreign_keys=[class_id])
+    creator = db.relationship('User', foreign_keys=[created_by])
+    
+    __table_args__ = (
+        db.Index('ix_holidays_date', 'date', 'class_id'),
+    )
+    
+    def __repr__(self):
+        return f'<Holiday {self.name} on {self.date}>'
+    
+    @classmethod
+    def dates(cls, class_ids, first, last):
+        """Holiday dates between ``first`` and ``last`` keyed by class ID, None for school-wide ones"""
+        holidays = defaultdict(set)
+        for class_id, day in db.session.query(cls.class_id, cls.date).filter(
+            or_(cls.class_id.is_(None), cls.class_id.in_(list(class_ids))),
+            cls.date.between(first, last)
+        ):
+            holidays[class_id].add(day)
+        return holidays
+    
+    def rules(self):
+        """Recurring lessons the holiday applies to"""
+        query = RecurringLesson.query.filter(
+            RecurringLesson.start_date <= self.date,
+            RecurringLesson.end_date >= self.date
+        )
+        if self.class_id is not None:
+            query = query.filter(RecurringLesson.class_id == self.class_id)
+        return query.all()
+    
+    def apply(self):
+        """Remove the unmarked generated lessons falling on the holiday
+        
+        Like ``lift``, only a future date is touched, so a holiday recorded
+        after the fact leaves past lessons in the timetable and history.
+        Returns the number of lessons removed.
+        """
+        if self.date <= date.today():
+            return 0
+        
+        rule_ids = [rule.id for rule in self.rules()]
+        if not rule_ids:
+            return 0
+        
+        return db.session.execute(
+            delete(Lesson)
+            .where(
+                Lesson.recurring_id.in_(rule_ids),
+                Lesson.date == self.date,
+                ~exists().where(Attendance.lesson_id == Lesson.id)
+            )
+            .execution_options(synchronize_session=False)
+        ).rowcount
+    
+    def lift(self):
+        """Restore the generated lessons of a holiday being removed
+        
+        Only future dates the rules have already been expanded to are
+        restored; later dates are expanded as usual. Returns the number of
+        lessons created. The caller deletes the holiday first.
+        """
+        if self.date <= date.today():
+            return 0
+        
+        rules = [rule for rule in self.rules() if rule.materialized_until and rule.materialized_until >= self.date]
+        return RecurringLesson.materialize(rules, self.date, since=self.date)
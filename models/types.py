@@ -0,0 +1,8 @@
+from sqlalchemy.dialects import mysql
+from app import db
+
+
+# MySQL's DATETIME drops fractions of a second unless asked to keep them.
+# Page ETags compare max(updated_at), so two edits within one second must
+# still leave different timestamps.
+Timestamp = db.DateTime().with_variant(mysql.DATETIME(fsp=6), 'mysql')
@@ -1,6 +1,8 @@
+import secrets
 from datetime import datetime
 from flask_login import UserMixin
 from app import db
+from .types import Timestamp
 
 
 class User(UserMixin, db.Model):
@@ -15,14 +17,15 @@ class User(UserMixin, db.Model):
     profile_picture = db.Column(db.String(500))
     class_id = db.Column(db.Integer, db.ForeignKey('classes.id'), nullable=True)
     is_active = db.Column(db.Boolean, default=True)
+    feed_secret = db.Column(db.String(32))  # Signed into calendar feed URLs; replaced to revoke them
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = db.Column(Timestamp, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationships
     class_obj = db.relationship('Class', back_populates='members', foreign_keys=[class_id])
     taught_classes = db.relationship('Class', back_populates='teacher', foreign_keys='Class.teacher_id')
-    attendance_records = db.relationship('Attendance', back_populates='student', cascade='all, delete-orphan')
-    finance_records = db.relationship('Finance', back_populates='student', cascade='all, delete-orphan')
+    attendance_records = db.relationship('Attendance', back_populates='student', foreign_keys='Attendance.student_id', cascade='all, delete-orphan')
+    finance_records = db.relationship('Finance', back_populates='student', foreign_keys='Finance.student_id', cascade='all, delete-orphan')
     
     def __repr__(self):
         return f'<User {self.email} ({self.role})>'
@@ -43,6 +46,11 @@ class User(UserMixin, db.Model):
         """Check if user can manage class (teacher or starosta)"""
         return self.role in ['teacher', 'starosta']
     
+    def reset_feed_secret(self):
+        """Replace the calendar feed secret, revoking every feed URL issued so far"""
+        self.feed_secret = secrets.token_hex(16)
+        return self.feed_secret
+    
     def to_dict(self):
         """Convert user to dictionary"""
         return {
@@ -1,11 +1,18 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, Response, stream_with_context, current_app
 from flask_login import current_user
-from datetime import datetime, timedelta
-from sqlalchemy import and_
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import and_, or_, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased, joinedload
 
 from app import db
-from models import User, Class, Lesson, Attendance
-from utils.decorators import login_required, teacher_or_starosta_required
+from models import User, Class, Lesson, Attendance, AttendanceSyncKey, AttendanceEvent
+from utils.conditional import entity_version, page_validators, not_modified, conditional
+from utils.decorators import login_required, teacher_required, teacher_or_starosta_required
+from utils.attendance_matrix import build_attendance_matrix, STATUS_LABELS
+from utils.analytics import class_attendance_analytics
+from utils.excel import write_grouped_workbook, xlsx_response
+from utils.dashboard_cache import mark_class_changed
 import io
 import csv
 
@@ -30,25 +37,175 @@ def class_attendance(class_id):
     # Get lessons for the past 30 days
     today = datetime.now().date()
     thirty_days_ago = today - timedelta(days=30)
+    in_range = and_(
+        Lesson.class_id == class_id,
+        Lesson.date >= thirty_days_ago,
+        Lesson.date <= today
+    )
     
-    lessons = Lesson.query.filter(
-        and_(
-            Lesson.class_id == class_id,
-            Lesson.date >= thirty_days_ago,
-            Lesson.date <= today
-        )
-    ).order_by(Lesson.date.desc(), Lesson.start_time.desc()).all()
+    validators = page_validators(
+        entity_version(Class, Class.id == class_id),
+        entity_version(Lesson, in_range),
+        entity_version(Attendance, Attendance.lesson_id.in_(db.select(Lesson.id).where(in_range))),
+        entity_version(User, User.class_id == class_id),
+        extra=(today,)
+    )
+    response = not_modified(validators)
+    if response:
+        return response
+    
+    lessons = Lesson.query.filter(in_range).order_by(Lesson.date.desc(), Lesson.start_time.desc()).all()
     
     students = class_obj.get_students()
     
-    return render_template(
+    return conditional(render_template(
         'attendance/class.html',
         class_obj=class_obj,
         lessons=lessons,
         students=students
+    ), validators)
+
+
+def parse_date_range(default_days=None):
+    """Read optional from/to dates (YYYY-MM-DD) from the query string
+    
+    Raises ValueError on a malformed date. When ``default_days`` is given,
+    missing bounds default to that many days back from today.
+    """
+    date_from = request.args.get('from')
+    date_to = request.args.get('to')
+    
+    date_from = datetime.strptime(date_from, '%Y-%m-%d').date() if date_from else None
+    date_to = datetime.strptime(date_to, '%Y-%m-%d').date() if date_to else None
+    
+    if default_days is not None:
+        today = datetime.now().date()
+        date_to = date_to or today
+        date_from = date_from or date_to - timedelta(days=default_days)
+    
+    return date_from, date_to
+
+
+@attendance_bp.route('/class/<int:class_id>/matrix')
+@teacher_or_starosta_required
+def attendance_matrix(class_id):
+    """Students x lessons attendance grid for a date range"""
+    class_obj = Class.query.get_or_404(class_id)
+    
+    # Check permissions
+    if current_user.is_teacher():
+        if class_obj.teacher_id != current_user.id:
+            flash('You do not have permission to view this class.', 'danger')
+            return redirect(url_for('dashboard.home'))
+    elif current_user.class_id != class_id:
+        flash('You do not have permission to view this class.', 'danger')
+        return redirect(url_for('dashboard.home'))
+    
+    try:
+        date_from, date_to = parse_date_range(default_days=30)
+    except ValueError:
+        flash('Invalid date format.', 'danger')
+        return redirect(url_for('attendance.attendance_matrix', class_id=class_id))
+    
+    matrix = build_attendance_matrix(class_id, date_from, date_to)
+    
+    return render_template(
+        'attendance/matrix.html',
+        class_obj=class_obj,
+        matrix=matrix,
+        matrix_rows=zip(matrix['students'], matrix['grid'].tolist()),
+        cell_glyphs=[label[:1].upper() for label in STATUS_LABELS],
+        date_from=date_from,
+        date_to=date_to
+    )
+
+
+@attendance_bp.route('/class/<int:class_id>/matrix.json')
+@teacher_or_starosta_required
+def attendance_matrix_json(class_id):
+    """Students x lessons attendance grid as JSON"""
+    class_obj = Class.query.get_or_404(class_id)
+    
+    # Check permissions
+    if current_user.is_teacher():
+        if class_obj.teacher_id != current_user.id:
+            return jsonify({'error': 'Permission denied'}), 403
+    elif current_user.class_id != class_id:
+        return jsonify({'error': 'Permission denied'}), 403
+    
+    try:
+        date_from, date_to = parse_date_range(default_days=30)
+    except ValueError:
+        return jsonify({'error': 'Invalid date format'}), 400
+    
+    matrix = build_attendance_matrix(class_id, date_from, date_to)
+    
+    return jsonify({
+        'from': date_from.isoformat(),
+        'to': date_to.isoformat(),
+        'statuses': STATUS_LABELS,
+        'students': matrix['students'],
+        'lessons': [
+            {
+                **lesson,
+                'date': lesson['date'].isoformat(),
+                'start_time': lesson['start_time'].strftime('%H:%M')
+            }
+            for lesson in matrix['lessons']
+        ],
+        'grid': matrix['grid'].tolist()
+    })
+
+
+def analytics_options():
+    """Analytics thresholds from the app config"""
+    return {
+        'window': current_app.config['ANALYTICS_WINDOW'],
+        'at_risk_rate': current_app.config['AT_RISK_RATE'],
+        'at_risk_streak': current_app.config['AT_RISK_STREAK']
+    }
+
+
+@attendance_bp.route('/class/<int:class_id>/analytics')
+@teacher_required
+def class_analytics(class_id):
+    """Attendance analytics for a class"""
+    class_obj = Class.query.get_or_404(class_id)
+    
+    # Check permissions
+    if class_obj.teacher_id != current_user.id:
+        flash('You do not have permission to view this class.', 'danger')
+        return redirect(url_for('dashboard.home'))
+    
+    analytics = class_attendance_analytics(class_id, **analytics_options())
+    
+    return render_template(
+        'attendance/analytics.html',
+        class_obj=class_obj,
+        analytics=analytics,
+        at_risk_rate=current_app.config['AT_RISK_RATE'],
+        at_risk_streak=current_app.config['AT_RISK_STREAK']
     )
 
 
+@attendance_bp.route('/class/<int:class_id>/analytics.json')
+@teacher_required
+def class_analytics_json(class_id):
+    """Attendance analytics for a class as JSON"""
+    class_obj = Class.query.get_or_404(class_id)
+    
+    # Check permissions
+    if class_obj.teacher_id != current_user.id:
+        return jsonify({'error': 'Permission denied'}), 403
+    
+    analytics = class_attendance_analytics(class_id, **analytics_options())
+    
+    for week in analytics['weekly']:
+        week['week'] = week['week'].isoformat()
+    
+    return jsonify(analytics)
+
+
 @attendance_bp.route('/lesson/<int:lesson_id>')
 @login_required
 def lesson_attendance(lesson_id):
@@ -65,6 +222,15 @@ def lesson_attendance(lesson_id):
         flash('You do not have permission to view this lesson.', 'danger')
         return redirect(url_for('dashboard.home'))
     
+    validators = page_validators(
+        entity_version(Lesson, Lesson.id == lesson_id),
+        entity_version(Attendance, Attendance.lesson_id == lesson_id),
+        entity_version(User, User.class_id == lesson.class_id)
+    )
+    response = not_modified(validators)
+    if response:
+        return response
+    
     students = class_obj.get_students()
     
     # Get existing attendance records
@@ -72,13 +238,13 @@ def lesson_attendance(lesson_id):
     for record in lesson.attendance_records:
         attendance_dict[record.student_id] = record
     
-    return render_template(
+    return conditional(render_template(
         'attendance/lesson.html',
         lesson=lesson,
         class_obj=class_obj,
         students=students,
         attendance_dict=attendance_dict
-    )
+    ), validators)
 
 
 @attendance_bp.route('/lesson/<int:lesson_id>/mark', methods=['POST'])
@@ -102,21 +268,30 @@ def mark_attendance(lesson_id):
     if not student_id or not status:
         return jsonify({'error': 'Student ID and status are required'}), 400
     
+    try:
+        student_id = int(student_id)
+    except ValueError:
+        return jsonify({'error': 'Invalid student ID'}), 400
+    
     if status not in ['present', 'late', 'absent']:
         return jsonify({'error': 'Invalid status'}), 400
     
-    # Check if attendance already exists
+    # Check if attendance already exists, locking it so a concurrent mark
+    # cannot read the same previous status and apply the counter delta twice
     attendance = Attendance.query.filter_by(
         student_id=student_id,
         lesson_id=lesson_id
-    ).first()
+    ).with_for_update().first()
+    
+    previous_status = attendance.status if attendance else None
+    now = datetime.utcnow()
     
     if attendance:
         # Update existing record
         attendance.status = status
         attendance.notes = notes
         attendance.marked_by = current_user.id
-        attendance.marked_at = datetime.utcnow()
+        attendance.marked_at = now
     else:
         # Create new record
         attendance = Attendance(
@@ -124,11 +299,23 @@ def mark_attendance(lesson_id):
             lesson_id=lesson_id,
             status=status,
             notes=notes,
-            marked_by=current_user.id
+            marked_by=current_user.id,
+            marked_at=now
         )
         db.session.add(attendance)
     
-    db.session.commit()
+    try:
+        # Flushing the new record first makes a concurrent first mark fail here,
+        # before its counter delta is applied
+        db.session.flush()
+        lesson.adjust_attendance_count(previous_status, status)
+        AttendanceEvent.record([
+            AttendanceEvent.entry(lesson_id, student_id, status, notes, current_user.id, now, 'mark')
+        ])
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'error': 'Attendance was marked concurrently, please retry'}), 409
     
     return jsonify({'success': True, 'message': 'Attendance marked successfully'})
 
@@ -151,37 +338,318 @@ def bulk_mark_attendance(lesson_id):
     
     students = class_obj.get_students()
     
+    marks = []
     for student in students:
         status = request.form.get(f'status_{student.id}')
         notes = request.form.get(f'notes_{student.id}', '')
         
         if status and status in ['present', 'late', 'absent']:
-            # Check if attendance already exists
-            attendance = Attendance.query.filter_by(
-                student_id=student.id,
-                lesson_id=lesson_id
-            ).first()
-            
-            if attendance:
-                attendance.status = status
-                attendance.notes = notes
-                attendance.marked_by = current_user.id
-                attendance.marked_at = datetime.utcnow()
-            else:
-                attendance = Attendance(
-                    student_id=student.id,
-                    lesson_id=lesson_id,
-                    status=status,
-                    notes=notes,
-                    marked_by=current_user.id
-                )
-                db.session.add(attendance)
+            marks.append({'student_id': student.id, 'status': status, 'notes': notes})
+    
+    # One upsert for the whole class instead of a lookup per student
+    Attendance.bulk_upsert(lesson_id, marks, current_user.id)
+    Lesson.recount_attendance([lesson_id])
+    mark_class_changed(lesson.class_id)
     
     db.session.commit()
     flash('Attendance has been marked successfully!', 'success')
     return redirect(url_for('attendance.lesson_attendance', lesson_id=lesson_id))
 
 
+@attendance_bp.route('/lesson/<int:lesson_id>/batch', methods=['POST'])
+@teacher_or_starosta_required
+def batch_mark_attendance(lesson_id):
+    """Mark attendance for multiple students from a JSON payload"""
+    lesson = Lesson.query.get_or_404(lesson_id)
+    class_obj = lesson.class_obj
+    
+    # Check permissions
+    if current_user.is_teacher():
+        if class_obj.teacher_id != current_user.id:
+            return jsonify({'error': 'Permission denied'}), 403
+    elif current_user.class_id != lesson.class_id:
+        return jsonify({'error': 'Permission denied'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'error': 'A JSON object is required'}), 400
+    
+    marks = data.get('marks')
+    
+    if not isinstance(marks, list):
+        return jsonify({'error': 'A list of marks is required'}), 400
+    
+    student_ids = {student.id for student in class_obj.get_students()}
+    
+    for mark in marks:
+        if not isinstance(mark, dict):
+            return jsonify({'error': 'Invalid mark'}), 400
+        
+        try:
+            student_id = int(mark.get('student_id'))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Student ID is required'}), 400
+        
+        if student_id not in student_ids:
+            return jsonify({'error': f'Student {student_id} is not in this class'}), 400
+        
+        if mark.get('status') not in ['present', 'late', 'absent']:
+            return jsonify({'error': f'Invalid status for student {student_id}'}), 400
+        
+        if not isinstance(mark.get('notes'), (str, type(None))):
+            return jsonify({'error': f'Notes for student {student_id} must be text'}), 400
+    
+    marked = Attendance.bulk_upsert(lesson_id, marks, current_user.id, source='batch')
+    Lesson.recount_attendance([lesson_id])
+    mark_class_changed(lesson.class_id)
+    db.session.commit()
+    
+    return jsonify({'success': True, 'marked': marked, 'message': 'Attendance marked successfully'})
+
+
+@attendance_bp.route('/sync', methods=['POST'])
+@teacher_or_starosta_required
+def sync_attendance():
+    """Apply a queued batch of offline attendance marks in one transaction
+    
+    Each mark carries a client idempotency ``key`` and the client-side
+    ``marked_at`` timestamp. Keys already seen are skipped, and a mark older
+    than the stored record loses (last writer wins on ``marked_at``).
+    """
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'error': 'A JSON object is required'}), 400
+    
+    marks = data.get('marks')
+    
+    if not isinstance(marks, list):
+        return jsonify({'error': 'A list of marks is required'}), 400
+    
+    if len(marks) > current_app.config['SYNC_MAX_BATCH']:
+        return jsonify({'error': f'At most {current_app.config["SYNC_MAX_BATCH"]} marks per batch'}), 400
+    
+    now = datetime.utcnow()
+    results = {}
+    pending = []
+    
+    # Validate the shape of every mark before touching the database
+    for index, mark in enumerate(marks):
+        if not isinstance(mark, dict) or not isinstance(mark.get('key'), str) or not 0 < len(mark['key']) <= 64:
+            results[index] = {'status': 'error', 'error': 'A key of up to 64 characters is required'}
+            continue
+        
+        try:
+            lesson_id = int(mark.get('lesson_id'))
+            student_id = int(mark.get('student_id'))
+        except (TypeError, ValueError):
+            results[index] = {'status': 'error', 'error': 'Lesson ID and student ID are required'}
+            continue
+        
+        if mark.get('status') not in ['present', 'late', 'absent']:
+            results[index] = {'status': 'error', 'error': 'Invalid status'}
+            continue
+        
+        if not isinstance(mark.get('notes'), (str, type(None))):
+            results[index] = {'status': 'error', 'error': 'Notes must be text'}
+            continue
+        
+        try:
+            marked_at = datetime.fromisoformat(mark['marked_at'])
+        except (KeyError, TypeError, ValueError):
+            results[index] = {'status': 'error', 'error': 'Invalid marked_at timestamp'}
+            continue
+        
+        if marked_at.tzinfo:
+            marked_at = marked_at.astimezone(timezone.utc).replace(tzinfo=None)
+        
+        pending.append({
+            'index': index,
+            'key': mark['key'],
+            'lesson_id': lesson_id,
+            'student_id': student_id,
+            'status': mark['status'],
+            'notes': mark.get('notes') or '',
+            # A skewed client clock must not pin a record in the future
+            'marked_at': min(marked_at, now)
+        })
+    
+    # Skip marks whose keys were already applied
+    seen = dict(
+        db.session.query(AttendanceSyncKey.key, AttendanceSyncKey.result).filter(
+            AttendanceSyncKey.user_id == current_user.id,
+            AttendanceSyncKey.key.in_({item['key'] for item in pending})
+        ).all()
+    ) if pending else {}
+    
+    fresh = []
+    batch_keys = set()
+    for item in pending:
+        if item['key'] in seen or item['key'] in batch_keys:
+            results[item['index']] = {'status': 'duplicate', 'result': seen.get(item['key'])}
+        else:
+            batch_keys.add(item['key'])
+            fresh.append(item)
+    
+    # Permissions and class membership, one query each
+    lesson_ids = {item['lesson_id'] for item in fresh}
+    student_ids = {item['student_id'] for item in fresh}
+    
+    lessons = {
+        lesson.id: lesson
+        for lesson in Lesson.query.options(joinedload(Lesson.class_obj)).filter(Lesson.id.in_(lesson_ids))
+    } if fresh else {}
+    
+    student_classes = dict(
+        db.session.query(User.id, User.class_id).filter(
+            User.id.in_(student_ids),
+            User.role == 'student'
+        ).all()
+    ) if fresh else {}
+    
+    existing = {
+        (record.lesson_id, record.student_id): record
+        for record in Attendance.query.filter(
+            Attendance.lesson_id.in_(lesson_ids),
+            Attendance.student_id.in_(student_ids)
+        )
+    } if fresh else {}
+    
+    applied_keys = []
+    new_records = {}
+    events = []
+    touched_lessons = set()
+    
+    # Apply in client order so the latest mark in the batch wins
+    for item in sorted(fresh, key=lambda item: item['marked_at']):
+        lesson = lessons.get(item['lesson_id'])
+        
+        if not lesson:
+            results[item['index']] = {'status': 'error', 'error': 'Lesson not found'}
+            continue
+        
+        if current_user.is_teacher():
+            allowed = lesson.class_obj.teacher_id == current_user.id
+        else:
+            allowed = current_user.class_id == lesson.class_id
+        
+        if not allowed:
+            results[item['index']] = {'status': 'error', 'error': 'Permission denied'}
+            continue
+        
+        if student_classes.get(item['student_id']) != lesson.class_id:
+            results[item['index']] = {'status': 'error', 'error': 'Student is not in this class'}
+            continue
+        
+        pair = (item['lesson_id'], item['student_id'])
+        attendance = existing.get(pair)
+        
+        if attendance and attendance.marked_at and attendance.marked_at > item['marked_at']:
+            result = 'stale'
+        elif attendance:
+            attendance.status = item['status']
+            attendance.notes = item['notes']
+            attendance.marked_by = current_user.id
+            attendance.marked_at = item['marked_at']
+            result = 'applied'
+        else:
+            # New records are inserted together after the loop
+            new_records[pair] = {
+                'student_id': item['student_id'],
+                'lesson_id': item['lesson_id'],
+                'status': item['status'],
+                'notes': item['notes'],
+                'marked_by': current_user.id,
+                'marked_at': item['marked_at'],
+                'created_at': now,
+                'updated_at': now
+            }
+            result = 'applied'
+        
+        if result == 'applied':
+            touched_lessons.add(item['lesson_id'])
+            events.append(AttendanceEvent.entry(
+                item['lesson_id'], item['student_id'], item['status'], item['notes'],
+                current_user.id, item['marked_at'], 'sync'
+            ))
+        
+        results[item['index']] = {'status': result}
+        applied_keys.append({'user_id': current_user.id, 'key': item['key'], 'result': result, 'created_at': now})
+    
+    try:
+        db.session.flush()
+        
+        if new_records:
+            db.session.execute(Attendance.__table__.insert(), list(new_records.values()))
+        if applied_keys:
+            db.session.execute(AttendanceSyncKey.__table__.insert(), applied_keys)
+        AttendanceEvent.record(events)
+        if touched_lessons:
+            Lesson.recount_attendance(touched_lessons)
+            mark_class_changed(*{lessons[lesson_id].class_id for lesson_id in touched_lessons})
+        
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent sync got there first; the client can safely retry the batch
+        db.session.rollback()
+        return jsonify({'error': 'Conflicting concurrent sync, please retry'}), 409
+    
+    return jsonify({
+        'success': True,
+        'results': [
+            {'key': mark.get('key') if isinstance(mark, dict) else None, **results[index]}
+            for index, mark in enumerate(marks)
+        ]
+    })
+
+
+@attendance_bp.route('/lesson/<int:lesson_id>/history')
+@teacher_or_starosta_required
+def lesson_attendance_history(lesson_id):
+    """Change log of a lesson's attendance, or its state at a point in time (JSON)"""
+    lesson = Lesson.query.get_or_404(lesson_id)
+    
+    # Check permissions
+    if current_user.is_teacher():
+        if lesson.class_obj.teacher_id != current_user.id:
+            return jsonify({'error': 'Permission denied'}), 403
+    elif current_user.class_id != lesson.class_id:
+        return jsonify({'error': 'Permission denied'}), 403
+    
+    as_of = request.args.get('as_of')
+    
+    if as_of:
+        try:
+            at = datetime.fromisoformat(as_of)
+        except ValueError:
+            return jsonify({'error': 'Invalid as_of timestamp'}), 400
+        
+        if at.tzinfo:
+            at = at.astimezone(timezone.utc).replace(tzinfo=None)
+        
+        state = AttendanceEvent.state_as_of(lesson_id, at)
+        
+        return jsonify({
+            'lesson_id': lesson_id,
+            'as_of': at.isoformat(),
+            'attendance': [
+                {
+                    'student_id': student_id,
+                    **entry,
+                    'changed_at': entry['changed_at'].isoformat()
+                }
+                for student_id, entry in sorted(state.items())
+            ]
+        })
+    
+    student_id = request.args.get('student_id', type=int)
+    snapshots, events = AttendanceEvent.history(lesson_id, student_id)
+    
+    return jsonify({
+        'lesson_id': lesson_id,
+        'changes': [snapshot.to_dict() for snapshot in snapshots] + [event.to_dict() for event in events]
+    })
+
+
 @attendance_bp.route('/student/<int:student_id>')
 @login_required
 def student_attendance(student_id):
@@ -197,20 +665,64 @@ def student_attendance(student_id):
         flash('You do not have permission to view this student.', 'danger')
         return redirect(url_for('dashboard.home'))
     
-    # Get attendance records
-    attendance_records = Attendance.query.filter_by(
-        student_id=student_id
-    ).order_by(Attendance.marked_at.desc()).all()
+    validators = page_validators(
+        entity_version(User, User.id == student_id),
+        entity_version(Attendance, Attendance.student_id == student_id),
+        entity_version(Lesson, Lesson.id.in_(db.select(Attendance.lesson_id).where(Attendance.student_id == student_id)))
+    )
+    response = not_modified(validators)
+    if response:
+        return response
+    
+    # Calculate statistics in a single grouped query
+    counts = dict(
+        db.session.query(Attendance.status, func.count(Attendance.id))
+        .filter(Attendance.student_id == student_id)
+        .group_by(Attendance.status)
+        .all()
+    )
     
-    # Calculate statistics
-    total = len(attendance_records)
-    present = len([a for a in attendance_records if a.status == 'present'])
-    late = len([a for a in attendance_records if a.status == 'late'])
-    absent = len([a for a in attendance_records if a.status == 'absent'])
+    present = counts.get('present', 0)
+    late = counts.get('late', 0)
+    absent = counts.get('absent', 0)
+    total = present + late + absent
     
     attendance_rate = (present / total * 100) if total > 0 else 0
     
-    return render_template(
+    # Keyset pagination on (marked_at, id), newest first
+    per_page = current_app.config['ITEMS_PER_PAGE']
+    query = Attendance.query.options(
+        joinedload(Attendance.lesson),
+        joinedload(Attendance.marker)
+    ).filter(Attendance.student_id == student_id)
+    
+    cursor = request.args.get('before')
+    if cursor:
+        try:
+            marked_at_str, record_id = cursor.rsplit('_', 1)
+            marked_at = datetime.fromisoformat(marked_at_str)
+            record_id = int(record_id)
+        except ValueError:
+            return redirect(url_for('attendance.student_attendance', student_id=student_id))
+        
+        query = query.filter(
+            or_(
+                Attendance.marked_at < marked_at,
+                and_(Attendance.marked_at == marked_at, Attendance.id < record_id)
+            )
+        )
+    
+    attendance_records = query.order_by(
+        Attendance.marked_at.desc(), Attendance.id.desc()
+    ).limit(per_page + 1).all()
+    
+    next_cursor = None
+    if len(attendance_records) > per_page:
+        attendance_records = attendance_records[:per_page]
+        last = attendance_records[-1]
+        next_cursor = f'{last.marked_at.isoformat()}_{last.id}'
+    
+    return conditional(render_template(
         'attendance/student.html',
         student=student,
         attendance_records=attendance_records,
@@ -218,8 +730,45 @@ def student_attendance(student_id):
         present=present,
         late=late,
         absent=absent,
-        attendance_rate=attendance_rate
+        attendance_rate=attendance_rate,
+        next_cursor=next_cursor,
+        is_first_page=not cursor
+    ), validators)
+
+
+def attendance_export_query(class_id, date_from=None, date_to=None):
+    """Joined attendance rows for a class, newest lessons first, streamed in chunks
+    
+    One query over a server-side cursor instead of lazy loads per lesson.
+    """
+    student = aliased(User)
+    marker = aliased(User)
+    query = db.session.query(
+        student.full_name,
+        Lesson.date,
+        Lesson.subject,
+        Attendance.status,
+        Attendance.notes,
+        marker.full_name,
+        Attendance.marked_at
+    ).join(
+        Lesson, Attendance.lesson_id == Lesson.id
+    ).join(
+        student, Attendance.student_id == student.id
+    ).outerjoin(
+        marker, Attendance.marked_by == marker.id
+    ).filter(
+        Lesson.class_id == class_id
     )
+    
+    if date_from:
+        query = query.filter(Lesson.date >= date_from)
+    if date_to:
+        query = query.filter(Lesson.date <= date_to)
+    
+    return query.order_by(
+        Lesson.date.desc(), Lesson.start_time.desc(), Lesson.id, student.full_name
+    ).execution_options(stream_results=True).yield_per(500)
 
 
 @attendance_bp.route('/export/class/<int:class_id>')
@@ -237,34 +786,78 @@ def export_class_attendance(class_id):
         flash('You do not have permission to export this data.', 'danger')
         return redirect(url_for('dashboard.home'))
     
-    from flask import Response
-    
-    # Create CSV
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    # Write header
-    writer.writerow(['Student Name', 'Date', 'Subject', 'Status', 'Notes', 'Marked By', 'Marked At'])
+    # Optional date range
+    try:
+        date_from, date_to = parse_date_range()
+    except ValueError:
+        flash('Invalid date format.', 'danger')
+        return redirect(url_for('attendance.class_attendance', class_id=class_id))
     
-    # Get all lessons for the class
-    lessons = Lesson.query.filter_by(class_id=class_id).order_by(Lesson.date.desc()).all()
+    query = attendance_export_query(class_id, date_from, date_to)
     
-    for lesson in lessons:
-        for attendance in lesson.attendance_records:
+    def generate():
+        output = io.StringIO()
+        writer = csv.writer(output)
+        
+        # Send the header before the query runs
+        writer.writerow(['Student Name', 'Date', 'Subject', 'Status', 'Notes', 'Marked By', 'Marked At'])
+        yield output.getvalue()
+        
+        output.seek(0)
+        output.truncate()
+        
+        for student_name, lesson_date, subject, status, notes, marker_name, marked_at in query:
             writer.writerow([
-                attendance.student.full_name,
-                lesson.date.isoformat(),
-                lesson.subject,
-                attendance.status,
-                attendance.notes or '',
-                attendance.marker.full_name if attendance.marker else '',
-                attendance.marked_at.isoformat() if attendance.marked_at else ''
+                student_name,
+                lesson_date.isoformat(),
+                subject,
+                status,
+                notes or '',
+                marker_name or '',
+                marked_at.isoformat() if marked_at else ''
             ])
-    
-    output.seek(0)
+            
+            if output.tell() > 16384:
+                yield output.getvalue()
+                output.seek(0)
+                output.truncate()
+        
+        yield output.getvalue()
     
     return Response(
-        output.getvalue(),
+        stream_with_context(generate()),
         mimetype='text/csv',
         headers={'Content-Disposition': f'attachment; filename=attendance_{class_obj.name}_{datetime.now().strftime("%Y%m%d")}.csv'}
-    )
\ No newline at end of file
+    )
+
+
+@attendance_bp.route('/export/class/<int:class_id>/xlsx')
+@teacher_or_starosta_required
+def export_class_attendance_xlsx(class_id):
+    """Export class attendance as an Excel workbook with one sheet per month"""
+    class_obj = Class.query.get_or_404(class_id)
+    
+    # Check permissions
+    if current_user.is_teacher():
+        if class_obj.teacher_id != current_user.id:
+            flash('You do not have permission to export this data.', 'danger')
+            return redirect(url_for('dashboard.home'))
+    elif current_user.class_id != class_id:
+        flash('You do not have permission to export this data.', 'danger')
+        return redirect(url_for('dashboard.home'))
+    
+    # Optional date range
+    try:
+        date_from, date_to = parse_date_range()
+    except ValueError:
+        flash('Invalid date format.', 'danger')
+        return redirect(url_for('attendance.class_attendance', class_id=class_id))
+    
+    output = write_grouped_workbook(
+        attendance_export_query(class_id, date_from, date_to),
+        group_key=lambda row: row[1].strftime('%Y-%m'),
+        header=['Student Name', 'Date', 'Subject', 'Status', 'Notes', 'Marked By', 'Marked At'],
+        to_row=lambda row: [row[0], row[1], row[2], row[3], row[4] or '', row[5] or '', row[6]]
+    )
+    
+    return xlsx_response(output, f'attendance_{class_obj.name}_{datetime.now().strftime("%Y%m%d")}.xlsx')
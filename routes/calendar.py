@@ -0,0 +1,131 @@
+from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app
+from flask_login import current_user
+from sqlalchemy import and_, exists, or_, select
+
+from app import db
+from models import User, Class
+from utils.calendar_feed import feed_token, load_feed_token, feed_start, feed_validators, render_feed
+from utils.conditional import not_modified, conditional
+from utils.decorators import login_required
+
+calendar_bp = Blueprint('calendar', __name__, url_prefix='/calendar')
+
+
+def feed_response(body):
+    """Wrap an iCalendar body in a response calendar apps accept"""
+    response = current_app.response_class(body, mimetype='text/calendar')
+    response.headers['Content-Disposition'] = 'inline; filename="schedule.ics"'
+    return response
+
+
+@calendar_bp.route('/')
+@login_required
+def feeds():
+    """Calendar feed links of the current user
+    
+    Users without a feed secret yet get a button that creates it, so
+    viewing the page never writes.
+    """
+    if current_user.is_teacher():
+        classes = Class.query.filter_by(teacher_id=current_user.id, is_active=True).order_by(Class.name).all()
+    else:
+        classes = [current_user.class_obj] if current_user.class_id else []
+    
+    teacher_feed = None
+    class_feeds = []
+    
+    if current_user.feed_secret:
+        token = feed_token(current_user)
+        if current_user.is_teacher():
+            teacher_feed = url_for('calendar.teacher_feed', token=token, _external=True)
+        class_feeds = [
+            (class_obj, url_for('calendar.class_feed', class_id=class_obj.id, token=token, _external=True))
+            for class_obj in classes
+        ]
+    
+    return render_template(
+        'calendar/feeds.html',
+        has_links=bool(current_user.feed_secret),
+        has_feeds=current_user.is_teacher() or bool(classes),
+        teacher_feed=teacher_feed,
+        class_feeds=class_feeds
+    )
+
+
+@calendar_bp.route('/reset', methods=['POST'])
+@login_required
+def reset_feeds():
+    """Create the current user's feed links, or revoke them by issuing new ones"""
+    created = not current_user.feed_secret
+    current_user.reset_feed_secret()
+    db.session.commit()
+    
+    if created:
+        flash('Your calendar links were created. Subscribe with the links below.', 'success')
+    else:
+        flash('Your calendar links were reset. Subscribe again with the new links below.', 'success')
+    return redirect(url_for('calendar.feeds'))
+
+
+@calendar_bp.route('/class/<int:class_id>.ics')
+def class_feed(class_id):
+    """iCalendar feed of a class's lessons, authenticated by the token in the URL"""
+    token = load_feed_token(request.args.get('token'))
+    if token is None:
+        return 'Invalid calendar token', 403
+    user_id, secret = token
+    
+    # Members of the class and its teacher, checked in the same query as the feed version
+    allowed = exists().where(
+        User.id == user_id,
+        User.feed_secret == secret,
+        User.is_active.is_(True),
+        or_(
+            User.class_id == class_id,
+            and_(User.role == 'teacher', exists().where(Class.id == class_id, Class.teacher_id == User.id))
+        )
+    )
+    class_ids = select(Class.id).where(Class.id == class_id)
+    since = feed_start()
+    
+    validators = feed_validators(('class', class_id), allowed, class_ids, since)
+    if validators is None:
+        return 'Permission denied', 403
+    
+    etag, last_modified, version = validators
+    response = not_modified((etag, last_modified))
+    if response:
+        return response
+    
+    body = render_feed(('class', class_id), lambda: Class.query.get_or_404(class_id).name, class_ids, since, version)
+    return conditional(feed_response(body), (etag, last_modified))
+
+
+@calendar_bp.route('/teacher.ics')
+def teacher_feed():
+    """iCalendar feed of every active class of the token's teacher"""
+    token = load_feed_token(request.args.get('token'))
+    if token is None:
+        return 'Invalid calendar token', 403
+    user_id, secret = token
+    
+    allowed = exists().where(
+        User.id == user_id,
+        User.feed_secret == secret,
+        User.is_active.is_(True),
+        User.role == 'teacher'
+    )
+    class_ids = select(Class.id).where(Class.teacher_id == user_id, Class.is_active.is_(True))
+    since = feed_start()
+    
+    validators = feed_validators(('teacher', user_id), allowed, class_ids, since)
+    if validators is None:
+        return 'Permission denied', 403
+    
+    etag, last_modified, version = validators
+    response = not_modified((etag, last_modified))
+    if response:
+        return response
+    
+    body = render_feed(('teacher', user_id), lambda: 'My lessons', class_ids, since, version, with_class=True)
+    return conditional(feed_response(body), (etag, last_modified))
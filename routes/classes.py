@@ -3,7 +3,8 @@ from flask_login import current_user
 from datetime import datetime
 
 from app import db
-from models import User, Class, Lesson
+from models import User, Class, Lesson, Collection
+from utils.conditional import entity_version, page_validators, not_modified, conditional
 from utils.decorators import login_required, teacher_required, teacher_or_starosta_required
 
 classes_bp = Blueprint('classes', __name__, url_prefix='/classes')
@@ -77,6 +78,15 @@ def view(class_id):
         flash('You do not have permission to view this class.', 'danger')
         return redirect(url_for('classes.index'))
     
+    validators = page_validators(
+        entity_version(Class, Class.id == class_id),
+        entity_version(User, User.class_id == class_id),
+        entity_version(Lesson, Lesson.class_id == class_id)
+    )
+    response = not_modified(validators)
+    if response:
+        return response
+    
     students = class_obj.get_students()
     starosta = class_obj.get_starosta()
     
@@ -85,13 +95,13 @@ def view(class_id):
         class_id=class_id
     ).order_by(Lesson.date.desc(), Lesson.start_time.desc()).limit(5).all()
     
-    return render_template(
+    return conditional(render_template(
         'classes/view.html',
         class_obj=class_obj,
         students=students,
         starosta=starosta,
         recent_lessons=recent_lessons
-    )
+    ), validators)
 
 
 @classes_bp.route('/<int:class_id>/edit', methods=['GET', 'POST'])
@@ -180,6 +190,8 @@ def add_student(class_id):
         
         # Add to class
         user.class_id = class_id
+        if user.role == 'student':
+            Collection.enroll_student(class_id, user.id, current_user.id)
         db.session.commit()
         
         flash(f'{user.full_name} has been added to the class!', 'success')
@@ -206,6 +218,7 @@ def remove_student(class_id, student_id):
         return redirect(url_for('classes.students', class_id=class_id))
     
     student.class_id = None
+    Collection.withdraw_student(class_id, student.id)
     db.session.commit()
     
     flash(f'{student.full_name} has been removed from the class.', 'success')
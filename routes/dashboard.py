@@ -1,11 +1,14 @@
 from flask import Blueprint, render_template, redirect, url_for
 from flask_login import current_user
 from datetime import datetime, timedelta
-from sqlalchemy import and_, or_
+from markupsafe import Markup
+from sqlalchemy import and_, or_, func
+from sqlalchemy.orm import contains_eager
 
 from app import db
 from models import User, Class, Lesson, Attendance, Finance, Collection
 from utils.decorators import login_required
+from utils.dashboard_cache import dashboard_cache, class_version, teacher_version
 
 dashboard_bp = Blueprint('dashboard', __name__)
 
@@ -37,38 +40,56 @@ def teacher_dashboard():
     if not current_user.is_teacher():
         return redirect(url_for('dashboard.home'))
     
-    # Get teacher's classes
-    classes = Class.query.filter_by(teacher_id=current_user.id, is_active=True).all()
-    
-    # Get upcoming lessons (next 7 days)
     today = datetime.now().date()
-    next_week = today + timedelta(days=7)
     
-    upcoming_lessons = []
-    for class_obj in classes:
-        lessons = Lesson.query.filter(
+    def dependencies():
+        class_ids = db.session.query(Class.id).filter_by(teacher_id=current_user.id, is_active=True)
+        return [teacher_version(current_user.id)] + [class_version(class_id) for class_id, in class_ids]
+    
+    def render():
+        # Get teacher's classes
+        classes = Class.query.filter_by(teacher_id=current_user.id, is_active=True).all()
+        
+        class_ids = [class_obj.id for class_obj in classes]
+        
+        # Get upcoming lessons (next 7 days) across all classes in one query
+        next_week = today + timedelta(days=7)
+        
+        upcoming_lessons = Lesson.query.filter(
             and_(
-                Lesson.class_id == class_obj.id,
+                Lesson.class_id.in_(class_ids),
                 Lesson.date >= today,
                 Lesson.date <= next_week
             )
-        ).order_by(Lesson.date, Lesson.start_time).all()
-        upcoming_lessons.extend(lessons)
-    
-    # Sort by date and time
-    upcoming_lessons.sort(key=lambda x: (x.date, x.start_time))
+        ).order_by(Lesson.date, Lesson.start_time).limit(5).all()
+        
+        # Get statistics with one grouped count each
+        student_counts = dict(
+            db.session.query(User.class_id, func.count(User.id))
+            .filter(User.class_id.in_(class_ids), User.role == 'student')
+            .group_by(User.class_id)
+            .all()
+        )
+        lesson_counts = dict(
+            db.session.query(Lesson.class_id, func.count(Lesson.id))
+            .filter(Lesson.class_id.in_(class_ids))
+            .group_by(Lesson.class_id)
+            .all()
+        )
+        
+        return render_template(
+            'dashboard/_teacher.html',
+            classes=classes,
+            upcoming_lessons=upcoming_lessons,
+            student_counts=student_counts,
+            total_students=sum(student_counts.values()),
+            total_lessons=sum(lesson_counts.values())
+        )
     
-    # Get statistics
-    total_students = sum(class_obj.get_student_count() for class_obj in classes)
-    total_lessons = sum(len(class_obj.lessons) for class_obj in classes)
+    # Served from the cache until a lesson, attendance mark, payment or class of the teacher changes
+    content = dashboard_cache.fragment(f'dashboard:teacher:{current_user.id}:{today}', dependencies, render)
     
-    return render_template(
-        'dashboard/teacher.html',
-        classes=classes,
-        upcoming_lessons=upcoming_lessons[:5],  # Show next 5 lessons
-        total_students=total_students,
-        total_lessons=total_lessons
-    )
+    return render_template('dashboard/teacher.html', content=Markup(content))
 
 
 @dashboard_bp.route('/dashboard/starosta')
@@ -78,42 +99,53 @@ def starosta_dashboard():
     if not current_user.is_starosta():
         return redirect(url_for('dashboard.home'))
     
-    # Get starosta's class
-    class_obj = current_user.class_obj
+    if not current_user.class_id:
+        return render_template('dashboard/starosta.html', content=None)
     
-    if not class_obj:
-        return render_template('dashboard/starosta.html', class_obj=None)
-    
-    # Get upcoming lessons
     today = datetime.now().date()
-    next_week = today + timedelta(days=7)
     
-    upcoming_lessons = Lesson.query.filter(
-        and_(
-            Lesson.class_id == class_obj.id,
-            Lesson.date >= today,
-            Lesson.date <= next_week
+    def render():
+        # Get starosta's class
+        class_obj = current_user.class_obj
+        
+        # Get upcoming lessons
+        next_week = today + timedelta(days=7)
+        
+        upcoming_lessons = Lesson.query.filter(
+            and_(
+                Lesson.class_id == class_obj.id,
+                Lesson.date >= today,
+                Lesson.date <= next_week
+            )
+        ).order_by(Lesson.date, Lesson.start_time).limit(5).all()
+        
+        # Get active collections
+        collections = Collection.query.filter_by(
+            class_id=class_obj.id,
+            is_active=True
+        ).order_by(Collection.created_at.desc()).all()
+        
+        # Get recent attendance
+        recent_lessons = Lesson.query.filter_by(
+            class_id=class_obj.id
+        ).order_by(Lesson.date.desc(), Lesson.start_time.desc()).limit(5).all()
+        
+        return render_template(
+            'dashboard/_starosta.html',
+            class_obj=class_obj,
+            upcoming_lessons=upcoming_lessons,
+            collections=collections,
+            payment_statuses=Collection.get_payment_statuses(collections),
+            recent_lessons=recent_lessons
         )
-    ).order_by(Lesson.date, Lesson.start_time).limit(5).all()
     
-    # Get active collections
-    collections = Collection.query.filter_by(
-        class_id=class_obj.id,
-        is_active=True
-    ).order_by(Collection.created_at.desc()).all()
-    
-    # Get recent attendance
-    recent_lessons = Lesson.query.filter_by(
-        class_id=class_obj.id
-    ).order_by(Lesson.date.desc(), Lesson.start_time.desc()).limit(5).all()
-    
-    return render_template(
-        'dashboard/starosta.html',
-        class_obj=class_obj,
-        upcoming_lessons=upcoming_lessons,
-        collections=collections,
-        recent_lessons=recent_lessons
+    content = dashboard_cache.fragment(
+        f'dashboard:starosta:{current_user.id}:{current_user.class_id}:{today}',
+        lambda: [class_version(current_user.class_id)],
+        render
     )
+    
+    return render_template('dashboard/starosta.html', content=Markup(content))
 
 
 @dashboard_bp.route('/dashboard/student')
@@ -123,51 +155,69 @@ def student_dashboard():
     if not current_user.is_student():
         return redirect(url_for('dashboard.home'))
     
-    # Get student's class
-    class_obj = current_user.class_obj
-    
-    if not class_obj:
-        return render_template('dashboard/student.html', class_obj=None)
+    if not current_user.class_id:
+        return render_template('dashboard/student.html', content=None)
     
-    # Get upcoming lessons
     today = datetime.now().date()
-    next_week = today + timedelta(days=7)
     
-    upcoming_lessons = Lesson.query.filter(
-        and_(
+    def render():
+        # Get student's class
+        class_obj = current_user.class_obj
+        
+        # Get upcoming lessons
+        next_week = today + timedelta(days=7)
+        
+        upcoming_lessons = Lesson.query.filter(
+            and_(
+                Lesson.class_id == class_obj.id,
+                Lesson.date >= today,
+                Lesson.date <= next_week
+            )
+        ).order_by(Lesson.date, Lesson.start_time).limit(5).all()
+        
+        # Get attendance statistics for this class, counted per status in SQL
+        total_lessons = Lesson.query.filter(
             Lesson.class_id == class_obj.id,
-            Lesson.date >= today,
-            Lesson.date <= next_week
+            Lesson.date <= today
+        ).count()
+        
+        status_counts = dict(
+            db.session.query(Attendance.status, func.count(Attendance.id))
+            .join(Lesson, Attendance.lesson_id == Lesson.id)
+            .filter(Attendance.student_id == current_user.id, Lesson.class_id == class_obj.id)
+            .group_by(Attendance.status)
+            .all()
+        )
+        
+        # Get pending payments with their collection, earliest due first
+        pending_payments = Finance.query.join(
+            Finance.collection
+        ).options(
+            contains_eager(Finance.collection)
+        ).filter(
+            Finance.student_id == current_user.id,
+            Finance.class_id == class_obj.id,
+            Finance.paid.is_(False)
+        ).order_by(
+            Collection.due_date.is_(None), Collection.due_date, Collection.created_at
+        ).all()
+        
+        return render_template(
+            'dashboard/_student.html',
+            class_obj=class_obj,
+            upcoming_lessons=upcoming_lessons,
+            total_lessons=total_lessons,
+            present_count=status_counts.get('present', 0),
+            late_count=status_counts.get('late', 0),
+            absent_count=status_counts.get('absent', 0),
+            today=today,
+            pending_payments=pending_payments
         )
-    ).order_by(Lesson.date, Lesson.start_time).limit(5).all()
-    
-    # Get attendance statistics
-    total_lessons = Lesson.query.filter(
-        Lesson.class_id == class_obj.id,
-        Lesson.date <= today
-    ).count()
-    
-    attendance_records = Attendance.query.filter_by(
-        student_id=current_user.id
-    ).all()
-    
-    present_count = len([a for a in attendance_records if a.status == 'present'])
-    late_count = len([a for a in attendance_records if a.status == 'late'])
-    absent_count = len([a for a in attendance_records if a.status == 'absent'])
     
-    # Get pending payments
-    pending_payments = Finance.query.filter_by(
-        student_id=current_user.id,
-        paid=False
-    ).all()
+    content = dashboard_cache.fragment(
+        f'dashboard:student:{current_user.id}:{current_user.class_id}:{today}',
+        lambda: [class_version(current_user.class_id)],
+        render
+    )
     
-    return render_template(
-        'dashboard/student.html',
-        class_obj=class_obj,
-        upcoming_lessons=upcoming_lessons,
-        total_lessons=total_lessons,
-        present_count=present_count,
-        late_count=late_count,
-        absent_count=absent_count,
-        pending_payments=pending_payments
-    )
\ No newline at end of file
+    return render_template('dashboard/student.html', content=Markup(content))
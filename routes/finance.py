@@ -1,13 +1,21 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, Response
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, Response, current_app
 from flask_login import current_user
 from datetime import datetime
 from decimal import Decimal
+from sqlalchemy import and_, case, func, or_, update
+from sqlalchemy.orm import contains_eager
 import io
 import csv
+from openpyxl import Workbook
 
 from app import db
 from models import User, Class, Finance, Collection
+from utils.conditional import entity_version, page_validators, not_modified, conditional
 from utils.decorators import login_required, teacher_or_starosta_required
+from utils.excel import new_sheet, save_workbook, write_grouped_workbook, xlsx_response
+from utils.dashboard_cache import mark_class_changed
+from utils.ledger import class_ledger, ledger_table
+from utils.reconcile import parse_statement, match_statement
 
 finance_bp = Blueprint('finance', __name__, url_prefix='/finance')
 
@@ -35,7 +43,8 @@ def class_finance(class_id):
     return render_template(
         'finance/class.html',
         class_obj=class_obj,
-        collections=collections
+        collections=collections,
+        payment_statuses=Collection.get_payment_statuses(collections)
     )
 
 
@@ -94,18 +103,7 @@ def create_collection(class_id):
         db.session.flush()  # Get collection ID
         
         # Create finance records for all students
-        students = class_obj.get_students()
-        for student in students:
-            finance_record = Finance(
-                class_id=class_id,
-                collection_name=name,
-                description=description,
-                amount=amount,
-                student_id=student.id,
-                paid=False,
-                created_by=current_user.id
-            )
-            db.session.add(finance_record)
+        collection.create_student_records(current_user.id)
         
         db.session.commit()
         
@@ -131,21 +129,29 @@ def view_collection(collection_id):
         flash('You do not have permission to view this collection.', 'danger')
         return redirect(url_for('dashboard.home'))
     
+    validators = page_validators(
+        entity_version(Collection, Collection.id == collection.id),
+        entity_version(Finance, Finance.collection_id == collection.id),
+        entity_version(User, User.class_id == collection.class_id)
+    )
+    response = not_modified(validators)
+    if response:
+        return response
+    
     # Get all finance records for this collection
     finance_records = Finance.query.filter_by(
-        class_id=collection.class_id,
-        collection_name=collection.name
+        collection_id=collection.id
     ).order_by(Finance.paid.desc(), Finance.student_id).all()
     
     payment_status = collection.get_payment_status()
     
-    return render_template(
+    return conditional(render_template(
         'finance/collection.html',
         collection=collection,
         class_obj=class_obj,
         finance_records=finance_records,
         payment_status=payment_status
-    )
+    ), validators)
 
 
 @finance_bp.route('/collection/<int:collection_id>/mark-paid', methods=['POST'])
@@ -170,16 +176,26 @@ def mark_paid(collection_id):
     
     # Find finance record
     finance_record = Finance.query.filter_by(
-        collection_name=collection.name,
-        class_id=collection.class_id,
+        collection_id=collection.id,
         student_id=student_id
     ).first()
     
     if not finance_record:
         return jsonify({'error': 'Finance record not found'}), 404
     
-    # Update payment status
-    finance_record.paid = paid
+    # Flip the status only if the row still has the other one, so concurrent
+    # toggles apply the counter delta once
+    flipped = db.session.execute(
+        update(Finance)
+        .where(Finance.id == finance_record.id, Finance.paid.isnot(True) if paid else Finance.paid.is_(True))
+        .values(paid=paid)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if flipped:
+        sign = 1 if paid else -1
+        collection.adjust_payment_counts(paid=sign, collected=sign * finance_record.amount)
+    
+    # Update payment details
     finance_record.payment_date = datetime.utcnow() if paid else None
     finance_record.notes = notes
     
@@ -191,6 +207,101 @@ def mark_paid(collection_id):
     })
 
 
+@finance_bp.route('/class/<int:class_id>/ledger')
+@teacher_or_starosta_required
+def class_ledger_view(class_id):
+    """Students x collections ledger of what each student owes"""
+    class_obj = Class.query.get_or_404(class_id)
+    
+    # Check permissions
+    if current_user.is_teacher():
+        if class_obj.teacher_id != current_user.id:
+            flash('You do not have permission to view this class.', 'danger')
+            return redirect(url_for('dashboard.home'))
+    elif current_user.class_id != class_id:
+        flash('You do not have permission to view this class.', 'danger')
+        return redirect(url_for('dashboard.home'))
+    
+    ledger = class_ledger(class_id)
+    
+    return render_template(
+        'finance/ledger.html',
+        class_obj=class_obj,
+        ledger=ledger,
+        ledger_rows=[
+            (student, zip(ledger['collections'], student['cells']))
+            for student in ledger['students']
+        ]
+    )
+
+
+@finance_bp.route('/collection/<int:collection_id>/bulk-mark-paid', methods=['POST'])
+@teacher_or_starosta_required
+def bulk_mark_paid(collection_id):
+    """Mark many students as paid for a collection in one update (JSON)"""
+    collection = Collection.query.get_or_404(collection_id)
+    
+    # Check permissions
+    if current_user.is_teacher():
+        if collection.class_obj.teacher_id != current_user.id:
+            return jsonify({'error': 'Permission denied'}), 403
+    elif current_user.class_id != collection.class_id:
+        return jsonify({'error': 'Permission denied'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'error': 'A JSON object is required'}), 400
+    
+    payments = data.get('payments')
+    
+    if not isinstance(payments, list) or not payments:
+        return jsonify({'error': 'A list of payments is required'}), 400
+    
+    now = datetime.utcnow()
+    requested = {}
+    
+    for payment in payments:
+        if not isinstance(payment, dict):
+            return jsonify({'error': 'Invalid payment'}), 400
+        
+        try:
+            student_id = int(payment.get('student_id'))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Student ID is required'}), 400
+        
+        payment_date = now
+        if payment.get('payment_date'):
+            try:
+                payment_date = datetime.fromisoformat(payment['payment_date'])
+            except (TypeError, ValueError):
+                return jsonify({'error': f'Invalid payment date for student {student_id}'}), 400
+        
+        if not isinstance(payment.get('notes'), (str, type(None))):
+            return jsonify({'error': f'Notes for student {student_id} must be text'}), 400
+        
+        requested[student_id] = (payment_date, payment.get('notes') or '')
+    
+    records = Finance.query.filter(
+        Finance.collection_id == collection.id,
+        Finance.student_id.in_(requested.keys())
+    ).with_for_update().all()
+    
+    unpaid = [record for record in records if not record.paid]
+    already_paid = sorted(record.student_id for record in records if record.paid)
+    not_found = sorted(requested.keys() - {record.student_id for record in records})
+    
+    marked = Finance.mark_paid_bulk(unpaid, {record.id: requested[record.student_id] for record in unpaid})
+    mark_class_changed(collection.class_id)
+    db.session.commit()
+    
+    return jsonify({
+        'success': True,
+        'marked': marked,
+        'already_paid': already_paid,
+        'not_found': not_found
+    })
+
+
 @finance_bp.route('/collection/<int:collection_id>/toggle-active', methods=['POST'])
 @teacher_or_starosta_required
 def toggle_collection_active(collection_id):
@@ -214,6 +325,81 @@ def toggle_collection_active(collection_id):
     return redirect(url_for('finance.view_collection', collection_id=collection_id))
 
 
+@finance_bp.route('/class/<int:class_id>/reconcile', methods=['GET', 'POST'])
+@teacher_or_starosta_required
+def reconcile_statement(class_id):
+    """Match a CSV bank statement to outstanding payments and mark the matches paid"""
+    class_obj = Class.query.get_or_404(class_id)
+    
+    # Check permissions
+    if current_user.is_teacher():
+        if class_obj.teacher_id != current_user.id:
+            flash('You do not have permission to manage this class.', 'danger')
+            return redirect(url_for('finance.class_finance', class_id=class_id))
+    elif current_user.class_id != class_id:
+        flash('You do not have permission to manage this class.', 'danger')
+        return redirect(url_for('finance.class_finance', class_id=class_id))
+    
+    if request.method == 'POST':
+        statement = request.files.get('statement')
+        
+        if not statement or not statement.filename:
+            flash('Please choose a CSV bank statement.', 'danger')
+            return render_template('finance/reconcile.html', class_obj=class_obj)
+        
+        try:
+            lines = parse_statement(io.TextIOWrapper(statement.stream, encoding='utf-8-sig', newline=''))
+        except (ValueError, UnicodeDecodeError, csv.Error) as e:
+            flash(f'Could not read the statement: {e}', 'danger')
+            return render_template('finance/reconcile.html', class_obj=class_obj)
+        
+        # Outstanding payments of active collections, earliest due first
+        outstanding = Finance.query.join(
+            Finance.collection
+        ).join(
+            Finance.student
+        ).options(
+            contains_eager(Finance.collection),
+            contains_eager(Finance.student)
+        ).filter(
+            Collection.class_id == class_id,
+            Collection.is_active.is_(True),
+            Finance.paid.is_(False)
+        ).order_by(
+            Collection.due_date.is_(None), Collection.due_date, Collection.created_at, Finance.id
+        ).with_for_update().all()
+        
+        matches, unmatched = match_statement(lines, outstanding)
+        now = datetime.utcnow()
+        
+        matched = []
+        payments = {}
+        for line, record in matches:
+            note = f'Bank statement line {line["line"]}'
+            if line['reference']:
+                note += f': {line["reference"]}'
+            payments[record.id] = (line['date'] or now, note)
+            matched.append({
+                'line': line['line'],
+                'student_name': record.student.full_name,
+                'collection_name': record.collection.name,
+                'amount': record.amount,
+                'payment_date': line['date'] or now
+            })
+        
+        Finance.mark_paid_bulk([record for _, record in matches], payments)
+        mark_class_changed(class_id)
+        db.session.commit()
+        
+        flash(
+            f'Marked {len(matched)} payment(s) as paid; {len(unmatched)} line(s) could not be matched.',
+            'warning' if unmatched else 'success'
+        )
+        return render_template('finance/reconcile.html', class_obj=class_obj, matched=matched, unmatched=unmatched)
+    
+    return render_template('finance/reconcile.html', class_obj=class_obj)
+
+
 @finance_bp.route('/student/<int:student_id>')
 @login_required
 def student_finance(student_id):
@@ -229,23 +415,60 @@ def student_finance(student_id):
         flash('You do not have permission to view this student.', 'danger')
         return redirect(url_for('dashboard.home'))
     
-    # Get finance records
-    finance_records = Finance.query.filter_by(
-        student_id=student_id
-    ).order_by(Finance.created_at.desc()).all()
+    # Calculate statistics in SQL, as Decimal
+    total_amount, paid_amount = db.session.query(
+        func.sum(Finance.amount),
+        func.sum(case((Finance.paid.is_(True), Finance.amount), else_=0))
+    ).filter(Finance.student_id == student_id).one()
     
-    # Calculate statistics
-    total_amount = sum(float(f.amount) for f in finance_records)
-    paid_amount = sum(float(f.amount) for f in finance_records if f.paid)
+    total_amount = total_amount if total_amount is not None else Decimal('0.00')
+    paid_amount = paid_amount if paid_amount is not None else Decimal('0.00')
     unpaid_amount = total_amount - paid_amount
     
+    # Keyset pagination on (created_at, id), newest first, with due dates from the collection
+    per_page = current_app.config['ITEMS_PER_PAGE']
+    query = Finance.query.outerjoin(
+        Finance.collection
+    ).options(
+        contains_eager(Finance.collection)
+    ).filter(Finance.student_id == student_id)
+    
+    cursor = request.args.get('before')
+    if cursor:
+        try:
+            created_at_str, record_id = cursor.rsplit('_', 1)
+            created_at = datetime.fromisoformat(created_at_str)
+            record_id = int(record_id)
+        except ValueError:
+            return redirect(url_for('finance.student_finance', student_id=student_id))
+        
+        query = query.filter(
+            or_(
+                Finance.created_at < created_at,
+                and_(Finance.created_at == created_at, Finance.id < record_id)
+            )
+        )
+    
+    finance_records = query.order_by(
+        Finance.created_at.desc(), Finance.id.desc()
+    ).limit(per_page + 1).all()
+    
+    next_cursor = None
+    if len(finance_records) > per_page:
+        finance_records = finance_records[:per_page]
+        last = finance_records[-1]
+        next_cursor = f'{last.created_at.isoformat()}_{last.id}'
+    
     return render_template(
         'finance/student.html',
         student=student,
         finance_records=finance_records,
         total_amount=total_amount,
         paid_amount=paid_amount,
-        unpaid_amount=unpaid_amount
+        unpaid_amount=unpaid_amount,
+        now=datetime.utcnow(),
+        next_cursor=next_cursor,
+        is_first_page=not cursor
     )
 
 
@@ -273,8 +496,7 @@ def export_collection(collection_id):
     
     # Get all finance records for this collection
     finance_records = Finance.query.filter_by(
-        class_id=collection.class_id,
-        collection_name=collection.name
+        collection_id=collection.id
     ).order_by(Finance.student_id).all()
     
     for record in finance_records:
@@ -302,4 +524,154 @@ def export_collection(collection_id):
         output.getvalue(),
         mimetype='text/csv',
         headers={'Content-Disposition': f'attachment; filename=collection_{collection.name}_{datetime.now().strftime("%Y%m%d")}.csv'}
-    )
\ No newline at end of file
+    )
+
+
+def finance_export_query(class_id, collection_id=None):
+    """Payment rows of a class's collections, grouped by collection and streamed in chunks"""
+    query = db.session.query(
+        Collection.id,
+        Collection.name,
+        User.full_name,
+        Finance.amount,
+        Finance.paid,
+        Finance.payment_date,
+        Finance.notes
+    ).join(
+        Finance, Finance.collection_id == Collection.id
+    ).join(
+        User, Finance.student_id == User.id
+    ).filter(
+        Collection.class_id == class_id
+    )
+    
+    if collection_id is not None:
+        query = query.filter(Collection.id == collection_id)
+    
+    return query.order_by(
+        Collection.created_at.desc(), Collection.id, User.full_name
+    ).execution_options(stream_results=True).yield_per(500)
+
+
+FINANCE_XLSX_HEADER = ['Student Name', 'Amount', 'Paid', 'Payment Date', 'Notes']
+
+
+def finance_xlsx_row(row):
+    """Cell values for one payment row of an Excel export"""
+    return [row[2], row[3], 'Yes' if row[4] else 'No', row[5], row[6] or '']
+
+
+@finance_bp.route('/export/collection/<int:collection_id>/xlsx')
+@teacher_or_starosta_required
+def export_collection_xlsx(collection_id):
+    """Export collection payment status as an Excel workbook"""
+    collection = Collection.query.get_or_404(collection_id)
+    
+    # Check permissions
+    if current_user.is_teacher():
+        if collection.class_obj.teacher_id != current_user.id:
+            flash('Permission denied.', 'danger')
+            return redirect(url_for('finance.class_finance', class_id=collection.class_id))
+    elif current_user.class_id != collection.class_id:
+        flash('Permission denied.', 'danger')
+        return redirect(url_for('finance.class_finance', class_id=collection.class_id))
+    
+    payment_status = collection.get_payment_status()
+    
+    output = write_grouped_workbook(
+        finance_export_query(collection.class_id, collection.id),
+        group_key=lambda row: row[0],
+        sheet_name=lambda row: row[1],
+        header=FINANCE_XLSX_HEADER,
+        to_row=finance_xlsx_row,
+        footer=lambda group: [
+            ['Summary'],
+            ['Total Students', payment_status['total_students']],
+            ['Paid', payment_status['paid']],
+            ['Unpaid', payment_status['unpaid']],
+            ['Total Collected', payment_status['total_collected']],
+            ['Expected Total', payment_status['expected_total']]
+        ]
+    )
+    
+    return xlsx_response(output, f'collection_{collection.name}_{datetime.now().strftime("%Y%m%d")}.xlsx')
+
+
+@finance_bp.route('/export/class/<int:class_id>/xlsx')
+@teacher_or_starosta_required
+def export_class_finance_xlsx(class_id):
+    """Export every collection of a class as an Excel workbook, one sheet per collection"""
+    class_obj = Class.query.get_or_404(class_id)
+    
+    # Check permissions
+    if current_user.is_teacher():
+        if class_obj.teacher_id != current_user.id:
+            flash('Permission denied.', 'danger')
+            return redirect(url_for('dashboard.home'))
+    elif current_user.class_id != class_id:
+        flash('Permission denied.', 'danger')
+        return redirect(url_for('dashboard.home'))
+    
+    output = write_grouped_workbook(
+        finance_export_query(class_id),
+        group_key=lambda row: row[0],
+        sheet_name=lambda row: row[1],
+        header=FINANCE_XLSX_HEADER,
+        to_row=finance_xlsx_row
+    )
+    
+    return xlsx_response(output, f'finance_{class_obj.name}_{datetime.now().strftime("%Y%m%d")}.xlsx')
+
+
+@finance_bp.route('/export/class/<int:class_id>/ledger')
+@teacher_or_starosta_required
+def export_class_ledger(class_id):
+    """Export the class finance ledger as CSV"""
+    class_obj = Class.query.get_or_404(class_id)
+    
+    # Check permissions
+    if current_user.is_teacher():
+        if class_obj.teacher_id != current_user.id:
+            flash('Permission denied.', 'danger')
+            return redirect(url_for('dashboard.home'))
+    elif current_user.class_id != class_id:
+        flash('Permission denied.', 'danger')
+        return redirect(url_for('dashboard.home'))
+    
+    header, rows = ledger_table(class_ledger(class_id))
+    
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(header)
+    writer.writerows([[value if value is not None else '' for value in row] for row in rows])
+    
+    return Response(
+        output.getvalue(),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename=ledger_{class_obj.name}_{datetime.now().strftime("%Y%m%d")}.csv'}
+    )
+
+
+@finance_bp.route('/export/class/<int:class_id>/ledger/xlsx')
+@teacher_or_starosta_required
+def export_class_ledger_xlsx(class_id):
+    """Export the class finance ledger as an Excel workbook"""
+    class_obj = Class.query.get_or_404(class_id)
+    
+    # Check permissions
+    if current_user.is_teacher():
+        if class_obj.teacher_id != current_user.id:
+            flash('Permission denied.', 'danger')
+            return redirect(url_for('dashboard.home'))
+    elif current_user.class_id != class_id:
+        flash('Permission denied.', 'danger')
+        return redirect(url_for('dashboard.home'))
+    
+    header, rows = ledger_table(class_ledger(class_id))
+    
+    workbook = Workbook(write_only=True)
+    sheet = new_sheet(workbook, 'Ledger', header)
+    for row in rows:
+        sheet.append(row)
+    
+    return xlsx_response(save_workbook(workbook), f'ledger_{class_obj.name}_{datetime.now().strftime("%Y%m%d")}.xlsx')
@@ -1,15 +1,63 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app
 from flask_login import current_user
+import calendar
 from datetime import datetime, timedelta, time
-from sqlalchemy import and_
+from sqlalchemy import or_
 
 from app import db
-from models import Class, Lesson
+from models import Class, Lesson, RecurringLesson, Holiday
+from models.recurring import WEEKDAYS
+from utils.dashboard_cache import mark_class_changed
+from utils.conditional import entity_version, page_validators, not_modified, conditional
+from utils.conflicts import Slot, find_conflicts, lesson_slots, conflict_report, conflict_message
+from utils.lesson_import import read_timetable, import_timetable, READ_ERRORS
 from utils.decorators import login_required, teacher_or_starosta_required
 
 schedule_bp = Blueprint('schedule', __name__, url_prefix='/schedule')
 
 
+def bucket_by_day(lessons, start, end):
+    """Group lessons by date in one pass, with an entry for every day from ``start`` to ``end``"""
+    days = {start + timedelta(days=i): [] for i in range((end - start).days + 1)}
+    for lesson in lessons:
+        days[lesson.date].append(lesson)
+    return days
+
+
+def parse_schedule_range(args):
+    """Read the span requested from the range API
+    
+    Accepts ``month`` (YYYY-MM), or ``from`` and ``to`` (YYYY-MM-DD), and
+    defaults to the current week. Raises ValueError with a message for the
+    client on a malformed, reversed or too long span.
+    """
+    month = args.get('month')
+    date_from = args.get('from')
+    date_to = args.get('to')
+    
+    try:
+        if month:
+            first = datetime.strptime(month, '%Y-%m').date()
+            start = first
+            end = first.replace(day=calendar.monthrange(first.year, first.month)[1])
+        elif date_from or date_to:
+            start = datetime.strptime(date_from or '', '%Y-%m-%d').date()
+            end = datetime.strptime(date_to or '', '%Y-%m-%d').date()
+        else:
+            today = datetime.now().date()
+            start = today - timedelta(days=today.weekday())
+            end = start + timedelta(days=6)
+    except ValueError:
+        raise ValueError('Invalid date format')
+    
+    if end < start:
+        raise ValueError('End date must not be before start date')
+    if (end - start).days >= current_app.config['SCHEDULE_MAX_RANGE_DAYS']:
+        raise ValueError(f'At most {current_app.config["SCHEDULE_MAX_RANGE_DAYS"]} days per request')
+    
+    return start, end
+
+
 @schedule_bp.route('/class/<int:class_id>')
 @login_required
 def class_schedule(class_id):
@@ -31,30 +79,167 @@ def class_schedule(class_id):
     start_of_week = today - timedelta(days=today.weekday()) + timedelta(weeks=week_offset)
     end_of_week = start_of_week + timedelta(days=6)
     
-    # Get lessons for the week
-    lessons = Lesson.query.filter(
-        and_(
-            Lesson.class_id == class_id,
-            Lesson.date >= start_of_week,
-            Lesson.date <= end_of_week
-        )
-    ).order_by(Lesson.date, Lesson.start_time).all()
+    # Answer a refresh of an unchanged week with 304 before loading anything
+    validators = page_validators(
+        entity_version(Class, Class.id == class_id),
+        entity_version(Lesson, Lesson.class_id == class_id, Lesson.date >= start_of_week, Lesson.date <= end_of_week),
+        extra=(today, week_offset)
+    )
+    response = not_modified(validators)
+    if response:
+        return response
     
-    # Organize lessons by day
-    week_schedule = {}
-    current_day = start_of_week
-    for i in range(7):
-        day = current_day + timedelta(days=i)
-        week_schedule[day] = [l for l in lessons if l.date == day]
+    # Get lessons for the week, grouped by day in one pass
+    week_schedule = bucket_by_day(Lesson.in_range([class_id], start_of_week, end_of_week), start_of_week, end_of_week)
     
-    return render_template(
+    return conditional(render_template(
         'schedule/class.html',
         class_obj=class_obj,
         week_schedule=week_schedule,
         start_of_week=start_of_week,
         end_of_week=end_of_week,
         week_offset=week_offset
+    ), validators)
+
+
+@schedule_bp.route('/range.json')
+@login_required
+def schedule_range():
+    """Lessons of a week, a month or any span up to the limit as JSON, grouped by day
+    
+    Covers one class when ``class_id`` is given, otherwise every active
+    class of a teacher or the user's own class.
+    """
+    class_id = request.args.get('class_id', type=int)
+    
+    # Check permissions
+    if class_id is not None:
+        class_obj = Class.query.get_or_404(class_id)
+        if current_user.is_teacher():
+            if class_obj.teacher_id != current_user.id:
+                return jsonify({'error': 'Permission denied'}), 403
+        elif current_user.class_id != class_id:
+            return jsonify({'error': 'Permission denied'}), 403
+        classes = [class_obj]
+    elif current_user.is_teacher():
+        classes = Class.query.filter_by(teacher_id=current_user.id, is_active=True).order_by(Class.name).all()
+    elif current_user.class_id:
+        classes = [Class.query.get_or_404(current_user.class_id)]
+    else:
+        return jsonify({'error': 'You are not assigned to a class'}), 403
+    
+    try:
+        start, end = parse_schedule_range(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    class_ids = [class_obj.id for class_obj in classes]
+    
+    validators = page_validators(
+        entity_version(Class, Class.id.in_(class_ids)),
+        entity_version(Lesson, Lesson.class_id.in_(class_ids), Lesson.date >= start, Lesson.date <= end),
+        extra=(start, end, class_id)
     )
+    response = not_modified(validators)
+    if response:
+        return response
+    
+    # The classes are already loaded, so lesson.class_obj needs no further queries
+    days = bucket_by_day(Lesson.in_range(class_ids, start, end), start, end)
+    
+    return conditional(jsonify({
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'classes': [{'id': class_obj.id, 'name': class_obj.name} for class_obj in classes],
+        'days': [
+            {'date': day.isoformat(), 'lessons': [lesson.to_dict() for lesson in lessons]}
+            for day, lessons in days.items()
+        ]
+    }), validators)
+
+
+@schedule_bp.route('/class/<int:class_id>/month')
+@login_required
+def month_schedule(class_id):
+    """Month calendar for a class, filled from the range API in one request"""
+    class_obj = Class.query.get_or_404(class_id)
+    
+    # Check permissions
+    if current_user.is_teacher():
+        if class_obj.teacher_id != current_user.id:
+            flash('You do not have permission to view this schedule.', 'danger')
+            return redirect(url_for('dashboard.home'))
+    elif current_user.class_id != class_id:
+        flash('You do not have permission to view this schedule.', 'danger')
+        return redirect(url_for('dashboard.home'))
+    
+    today = datetime.now().date()
+    try:
+        first = datetime.strptime(request.args.get('month', ''), '%Y-%m').date()
+    except ValueError:
+        first = today.replace(day=1)
+    
+    # Whole weeks covering the month, Monday first
+    weeks = calendar.Calendar().monthdatescalendar(first.year, first.month)
+    previous_month = (first - timedelta(days=1)).replace(day=1)
+    next_month = (first + timedelta(days=31)).replace(day=1)
+    
+    return render_template(
+        'schedule/month.html',
+        class_obj=class_obj,
+        month=first,
+        weeks=weeks,
+        weekdays=WEEKDAYS,
+        today=today,
+        previous_month=previous_month,
+        next_month=next_month
+    )
+
+
+@schedule_bp.route('/conflicts.json')
+@teacher_or_starosta_required
+def schedule_conflicts():
+    """Class, teacher and room clashes over a term as JSON
+    
+    Covers one class when ``class_id`` is given, otherwise every active
+    class of a teacher or the starosta's own class. The span defaults to
+    the recurring lesson horizon from today and may be up to a year.
+    """
+    class_id = request.args.get('class_id', type=int) or (None if current_user.is_teacher() else current_user.class_id)
+    
+    # Check permissions
+    if class_id is not None:
+        class_obj = Class.query.get_or_404(class_id)
+        if current_user.is_teacher():
+            if class_obj.teacher_id != current_user.id:
+                return jsonify({'error': 'Permission denied'}), 403
+        elif current_user.class_id != class_id:
+            return jsonify({'error': 'Permission denied'}), 403
+        classes = [class_obj]
+    else:
+        classes = Class.query.filter_by(teacher_id=current_user.id, is_active=True).all()
+    
+    today = datetime.now().date()
+    try:
+        start = datetime.strptime(request.args['from'], '%Y-%m-%d').date() if request.args.get('from') else today
+        end = datetime.strptime(request.args['to'], '%Y-%m-%d').date() if request.args.get('to') else materialize_horizon()
+    except ValueError:
+        return jsonify({'error': 'Invalid date format'}), 400
+    
+    if end < start:
+        return jsonify({'error': 'End date must not be before start date'}), 400
+    if (end - start).days > 366:
+        return jsonify({'error': 'At most a year per request'}), 400
+    
+    conflicts = conflict_report(classes, start, end) if classes else []
+    
+    return jsonify({
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'classes': [{'id': class_obj.id, 'name': class_obj.name} for class_obj in classes],
+        'count': len(conflicts),
+        'conflicts': [conflict.to_dict() for conflict in conflicts]
+    })
 
 
 @schedule_bp.route('/lesson/create/<int:class_id>', methods=['GET', 'POST'])
@@ -78,7 +263,7 @@ def create_lesson(class_id):
         start_time_str = request.form.get('start_time')
         end_time_str = request.form.get('end_time')
         description = request.form.get('description')
-        location = request.form.get('location')
+        location = (request.form.get('location') or '').strip() or None
         
         if not all([subject, date_str, start_time_str, end_time_str]):
             flash('All required fields must be filled.', 'danger')
@@ -97,6 +282,11 @@ def create_lesson(class_id):
             flash('Invalid date or time format.', 'danger')
             return render_template('schedule/create_lesson.html', class_obj=class_obj)
         
+        conflicts = find_conflicts([Slot.for_lesson(class_obj, lesson_date, start_time, end_time, location, subject)])
+        if conflicts:
+            flash(conflict_message(conflicts), 'danger')
+            return render_template('schedule/create_lesson.html', class_obj=class_obj)
+        
         # Create lesson
         lesson = Lesson(
             subject=subject,
@@ -129,6 +319,53 @@ def create_lesson(class_id):
     )
 
 
+@schedule_bp.route('/class/<int:class_id>/import', methods=['GET', 'POST'])
+@teacher_or_starosta_required
+def import_lessons(class_id):
+    """Bulk create lessons from an uploaded CSV or XLSX timetable"""
+    class_obj = Class.query.get_or_404(class_id)
+    
+    # Check permissions
+    if current_user.is_teacher():
+        if class_obj.teacher_id != current_user.id:
+            flash('You do not have permission to create lessons for this class.', 'danger')
+            return redirect(url_for('schedule.class_schedule', class_id=class_id))
+    elif current_user.class_id != class_id:
+        flash('You do not have permission to create lessons for this class.', 'danger')
+        return redirect(url_for('schedule.class_schedule', class_id=class_id))
+    
+    if request.method == 'POST':
+        timetable = request.files.get('timetable')
+        
+        if not timetable or not timetable.filename:
+            flash('Please choose a CSV or XLSX timetable.', 'danger')
+            return render_template('schedule/import.html', class_obj=class_obj)
+        
+        try:
+            frame = read_timetable(timetable.stream, timetable.filename)
+        except READ_ERRORS as e:
+            flash(f'Could not read the timetable: {e}', 'danger')
+            return render_template('schedule/import.html', class_obj=class_obj)
+        
+        # Teachers may fill any of their classes from one file via the class column
+        if current_user.is_teacher():
+            classes = Class.query.filter_by(teacher_id=current_user.id).all()
+        else:
+            classes = [class_obj]
+        
+        created, errors, class_ids = import_timetable(frame, classes, current_user.id, default_class_id=class_id)
+        mark_class_changed(*class_ids)
+        db.session.commit()
+        
+        flash(
+            f'Imported {created} lesson(s); {len(errors)} row(s) were skipped.',
+            'warning' if errors else 'success'
+        )
+        return render_template('schedule/import.html', class_obj=class_obj, created=created, errors=errors)
+    
+    return render_template('schedule/import.html', class_obj=class_obj)
+
+
 @schedule_bp.route('/lesson/<int:lesson_id>')
 @login_required
 def view_lesson(lesson_id):
@@ -177,7 +414,7 @@ def edit_lesson(lesson_id):
         start_time_str = request.form.get('start_time')
         end_time_str = request.form.get('end_time')
         description = request.form.get('description')
-        location = request.form.get('location')
+        location = (request.form.get('location') or '').strip() or None
         
         if not all([subject, date_str, start_time_str, end_time_str]):
             flash('All required fields must be filled.', 'danger')
@@ -196,6 +433,14 @@ def edit_lesson(lesson_id):
             flash('Invalid date or time format.', 'danger')
             return render_template('schedule/edit_lesson.html', lesson=lesson, class_obj=class_obj)
         
+        conflicts = find_conflicts([Slot.for_lesson(class_obj, lesson_date, start_time, end_time, location, subject, lesson_id=lesson.id)])
+        if conflicts:
+            flash(conflict_message(conflicts), 'danger')
+            return render_template('schedule/edit_lesson.html', lesson=lesson, class_obj=class_obj)
+        
+        # An edited occurrence no longer follows its recurring rule
+        RecurringLesson.detach(lesson)
+        
         # Update lesson
         lesson.subject = subject
         lesson.date = lesson_date
@@ -225,8 +470,302 @@ def delete_lesson(lesson_id):
         flash('You do not have permission to delete this lesson.', 'danger')
         return redirect(url_for('schedule.view_lesson', lesson_id=lesson_id))
     
+    RecurringLesson.detach(lesson)
     db.session.delete(lesson)
     db.session.commit()
     
     flash('Lesson has been deleted successfully.', 'success')
-    return redirect(url_for('schedule.class_schedule', class_id=class_id))
\ No newline at end of file
+    return redirect(url_for('schedule.class_schedule', class_id=class_id))
+
+
+def materialize_horizon():
+    """Last date recurring lessons are expanded to, a rolling window from today"""
+    return datetime.now().date() + timedelta(days=current_app.config['RECURRING_HORIZON_DAYS'])
+
+
+def parse_recurring_form(form):
+    """Read a recurring lesson rule from a submitted form
+    
+    Returns a dict of RecurringLesson fields; raises ValueError with a
+    message for the user when the rule is incomplete or invalid.
+    """
+    subject = form.get('subject')
+    fields = [form.get(name) for name in ('weekday', 'start_time', 'end_time', 'start_date', 'end_date')]
+    
+    if not subject or not all(fields):
+        raise ValueError('All required fields must be filled.')
+    
+    try:
+        weekday = int(fields[0])
+        start_time = datetime.strptime(fields[1], '%H:%M').time()
+        end_time = datetime.strptime(fields[2], '%H:%M').time()
+        start_date = datetime.strptime(fields[3], '%Y-%m-%d').date()
+        end_date = datetime.strptime(fields[4], '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError('Invalid day, date or time format.')
+    
+    if weekday not in range(7):
+        raise ValueError('Invalid day of the week.')
+    if end_time <= start_time:
+        raise ValueError('End time must be after start time.')
+    if end_date < start_date:
+        raise ValueError('End date must not be before start date.')
+    if (end_date - start_date).days > 366:
+        raise ValueError('A recurring lesson can run for at most a year.')
+    
+    return {
+        'subject': subject,
+        'weekday': weekday,
+        'start_time': start_time,
+        'end_time': end_time,
+        'start_date': start_date,
+        'end_date': end_date,
+        'description': form.get('description'),
+        'location': (form.get('location') or '').strip() or None
+    }
+
+
+@schedule_bp.route('/class/<int:class_id>/recurring')
+@teacher_or_starosta_required
+def recurring_lessons(class_id):
+    """List recurring lessons and holidays of a class"""
+    class_obj = Class.query.get_or_404(class_id)
+    
+    # Check permissions
+    if current_user.is_teacher():
+        if class_obj.teacher_id != current_user.id:
+            flash('You do not have permission to manage this schedule.', 'danger')
+            return redirect(url_for('schedule.class_schedule', class_id=class_id))
+    elif current_user.class_id != class_id:
+        flash('You do not have permission to manage this schedule.', 'danger')
+        return redirect(url_for('schedule.class_schedule', class_id=class_id))
+    
+    rules = RecurringLesson.query.filter_by(class_id=class_id).order_by(
+        RecurringLesson.weekday, RecurringLesson.start_time
+    ).all()
+    
+    holidays = Holiday.query.filter(
+        or_(Holiday.class_id == class_id, Holiday.class_id.is_(None)),
+        Holiday.date >= datetime.now().date()
+    ).order_by(Holiday.date).all()
+    
+    return render_template(
+        'schedule/recurring.html',
+        class_obj=class_obj,
+        rules=rules,
+        holidays=holidays,
+        weekdays=WEEKDAYS,
+        default_start_date=datetime.now().date()
+    )
+
+
+@schedule_bp.route('/recurring/create/<int:class_id>', methods=['POST'])
+@teacher_or_starosta_required
+def create_recurring_lesson(class_id):
+    """Create a weekly recurring lesson and expand it up to the horizon"""
+    class_obj = Class.query.get_or_404(class_id)
+    
+    # Check permissions
+    if current_user.is_teacher():
+        if class_obj.teacher_id != current_user.id:
+            flash('You do not have permission to manage this schedule.', 'danger')
+            return redirect(url_for('schedule.class_schedule', class_id=class_id))
+    elif current_user.class_id != class_id:
+        flash('You do not have permission to manage this schedule.', 'danger')
+        return redirect(url_for('schedule.class_schedule', class_id=class_id))
+    
+    try:
+        values = parse_recurring_form(request.form)
+    except ValueError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('schedule.recurring_lessons', class_id=class_id))
+    
+    rule = RecurringLesson(class_id=class_id, created_by=current_user.id, **values)
+    db.session.add(rule)
+    db.session.flush()
+    
+    created = RecurringLesson.materialize([rule], materialize_horizon())
+    
+    conflicts = find_conflicts(lesson_slots(Lesson.recurring_id == rule.id))
+    if conflicts:
+        db.session.rollback()
+        flash(conflict_message(conflicts, 'This recurring lesson'), 'danger')
+        return redirect(url_for('schedule.recurring_lessons', class_id=class_id))
+    
+    mark_class_changed(class_id)
+    db.session.commit()
+    
+    flash(f'Recurring lesson "{rule.subject}" has been created with {created} lesson(s) scheduled.', 'success')
+    return redirect(url_for('schedule.recurring_lessons', class_id=class_id))
+
+
+@schedule_bp.route('/recurring/<int:recurring_id>/edit', methods=['GET', 'POST'])
+@teacher_or_starosta_required
+def edit_recurring_lesson(recurring_id):
+    """Edit a recurring lesson, regenerating its future unmarked lessons"""
+    rule = RecurringLesson.query.get_or_404(recurring_id)
+    class_obj = rule.class_obj
+    
+    # Check permissions
+    if current_user.is_teacher():
+        if class_obj.teacher_id != current_user.id:
+            flash('You do not have permission to manage this schedule.', 'danger')
+            return redirect(url_for('schedule.class_schedule', class_id=rule.class_id))
+    elif current_user.class_id != rule.class_id:
+        flash('You do not have permission to manage this schedule.', 'danger')
+        return redirect(url_for('schedule.class_schedule', class_id=rule.class_id))
+    
+    if request.method == 'POST':
+        try:
+            values = parse_recurring_form(request.form)
+        except ValueError as e:
+            flash(str(e), 'danger')
+            return render_template('schedule/edit_recurring.html', rule=rule, class_obj=class_obj, weekdays=WEEKDAYS)
+        
+        for field, value in values.items():
+            setattr(rule, field, value)
+        
+        removed, created = rule.regenerate(materialize_horizon())
+        
+        # Only the regenerated lessons changed; past and marked ones stay as they were
+        conflicts = find_conflicts(lesson_slots(Lesson.recurring_id == rule.id, Lesson.date > datetime.now().date()))
+        if conflicts:
+            db.session.rollback()
+            flash(conflict_message(conflicts, 'The recurring lesson'), 'danger')
+            return render_template('schedule/edit_recurring.html', rule=rule, class_obj=class_obj, weekdays=WEEKDAYS)
+        
+        mark_class_changed(rule.class_id)
+        db.session.commit()
+        
+        flash(f'Recurring lesson has been updated: {removed} future lesson(s) replaced by {created}.', 'success')
+        return redirect(url_for('schedule.recurring_lessons', class_id=rule.class_id))
+    
+    return render_template('schedule/edit_recurring.html', rule=rule, class_obj=class_obj, weekdays=WEEKDAYS)
+
+
+@schedule_bp.route('/recurring/<int:recurring_id>/skip', methods=['POST'])
+@teacher_or_starosta_required
+def skip_recurring_date(recurring_id):
+    """Cancel a single occurrence of a recurring lesson"""
+    rule = RecurringLesson.query.get_or_404(recurring_id)
+    
+    # Check permissions
+    if current_user.is_teacher():
+        if rule.class_obj.teacher_id != current_user.id:
+            flash('You do not have permission to manage this schedule.', 'danger')
+            return redirect(url_for('schedule.class_schedule', class_id=rule.class_id))
+    elif current_user.class_id != rule.class_id:
+        flash('You do not have permission to manage this schedule.', 'danger')
+        return redirect(url_for('schedule.class_schedule', class_id=rule.class_id))
+    
+    try:
+        day = datetime.strptime(request.form.get('date', ''), '%Y-%m-%d').date()
+    except ValueError:
+        flash('Invalid date format.', 'danger')
+        return redirect(url_for('schedule.recurring_lessons', class_id=rule.class_id))
+    
+    if day.weekday() != rule.weekday:
+        flash(f'{rule.subject} takes place on {rule.weekday_name}s only.', 'danger')
+        return redirect(url_for('schedule.recurring_lessons', class_id=rule.class_id))
+    
+    removed = rule.skip_date(day, request.form.get('reason'))
+    mark_class_changed(rule.class_id)
+    db.session.commit()
+    
+    if removed:
+        flash(f'{rule.subject} on {day.strftime("%b %d, %Y")} has been cancelled.', 'success')
+    else:
+        flash(f'{rule.subject} will not be scheduled on {day.strftime("%b %d, %Y")}.', 'success')
+    return redirect(url_for('schedule.recurring_lessons', class_id=rule.class_id))
+
+
+@schedule_bp.route('/recurring/<int:recurring_id>/delete', methods=['POST'])
+@teacher_or_starosta_required
+def delete_recurring_lesson(recurring_id):
+    """Delete a recurring lesson along with its future unmarked lessons"""
+    rule = RecurringLesson.query.get_or_404(recurring_id)
+    class_id = rule.class_id
+    
+    # Check permissions (only teachers can delete recurring lessons)
+    if not current_user.is_teacher() or rule.class_obj.teacher_id != current_user.id:
+        flash('You do not have permission to delete this recurring lesson.', 'danger')
+        return redirect(url_for('schedule.recurring_lessons', class_id=class_id))
+    
+    removed = rule.end()
+    db.session.delete(rule)
+    mark_class_changed(class_id)
+    db.session.commit()
+    
+    flash(f'Recurring lesson has been deleted along with {removed} future lesson(s).', 'success')
+    return redirect(url_for('schedule.recurring_lessons', class_id=class_id))
+
+
+@schedule_bp.route('/holiday/create/<int:class_id>', methods=['POST'])
+@teacher_or_starosta_required
+def create_holiday(class_id):
+    """Add a holiday to a class, cancelling its generated lessons that day"""
+    class_obj = Class.query.get_or_404(class_id)
+    
+    # Check permissions
+    if current_user.is_teacher():
+        if class_obj.teacher_id != current_user.id:
+            flash('You do not have permission to manage this schedule.', 'danger')
+            return redirect(url_for('schedule.class_schedule', class_id=class_id))
+    elif current_user.class_id != class_id:
+        flash('You do not have permission to manage this schedule.', 'danger')
+        return redirect(url_for('schedule.class_schedule', class_id=class_id))
+    
+    name = request.form.get('name')
+    
+    try:
+        day = datetime.strptime(request.form.get('date', ''), '%Y-%m-%d').date()
+    except ValueError:
+        flash('Invalid date format.', 'danger')
+        return redirect(url_for('schedule.recurring_lessons', class_id=class_id))
+    
+    if not name:
+        flash('Holiday name is required.', 'danger')
+        return redirect(url_for('schedule.recurring_lessons', class_id=class_id))
+    
+    holiday = Holiday(class_id=class_id, date=day, name=name, created_by=current_user.id)
+    db.session.add(holiday)
+    
+    removed = holiday.apply()
+    mark_class_changed(class_id)
+    db.session.commit()
+    
+    flash(f'Holiday "{name}" has been added; {removed} lesson(s) cancelled.', 'success')
+    return redirect(url_for('schedule.recurring_lessons', class_id=class_id))
+
+
+@schedule_bp.route('/holiday/<int:holiday_id>/delete', methods=['POST'])
+@teacher_or_starosta_required
+def delete_holiday(holiday_id):
+    """Remove a class holiday, restoring its generated lessons"""
+    holiday = Holiday.query.get_or_404(holiday_id)
+    
+    # School-wide holidays are managed outside the class pages
+    if holiday.class_id is None:
+        flash('School-wide holidays cannot be removed here.', 'danger')
+        return redirect(url_for('dashboard.home'))
+    
+    class_id = holiday.class_id
+    
+    # Check permissions
+    if current_user.is_teacher():
+        if holiday.class_obj.teacher_id != current_user.id:
+            flash('You do not have permission to manage this schedule.', 'danger')
+            return redirect(url_for('schedule.class_schedule', class_id=class_id))
+    elif current_user.class_id != class_id:
+        flash('You do not have permission to manage this schedule.', 'danger')
+        return redirect(url_for('schedule.class_schedule', class_id=class_id))
+    
+    db.session.delete(holiday)
+    db.session.flush()
+    
+    restored = holiday.lift()
+    mark_class_changed(class_id)
+    db.session.commit()
+    
+    flash(f'Holiday has been removed; {restored} lesson(s) restored.', 'success')
+    return redirect(url_for('schedule.recurring_lessons', class_id=class_id))
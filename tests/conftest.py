@@ -0,0 +1,80 @@
+from datetime import date, time
+from decimal import Decimal
+
+import pytest
+
+from app import create_app, db
+from models import User, Class, Lesson, Collection
+
+
+@pytest.fixture
+def app():
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def teacher(app):
+    teacher = User(google_id='t', email='t@test.local', full_name='Teacher', role='teacher')
+    db.session.add(teacher)
+    db.session.commit()
+    return teacher
+
+
+@pytest.fixture
+def class_obj(teacher):
+    class_obj = Class(name='7A', teacher_id=teacher.id)
+    db.session.add(class_obj)
+    db.session.commit()
+    return class_obj
+
+
+@pytest.fixture
+def students(class_obj):
+    students = [
+        User(google_id=f's{number}', email=f's{number}@test.local', full_name=f'Student {number}',
+             role='student', class_id=class_obj.id)
+        for number in range(2)
+    ]
+    db.session.add_all(students)
+    db.session.commit()
+    return students
+
+
+@pytest.fixture
+def student(students):
+    return students[0]
+
+
+@pytest.fixture
+def lesson(class_obj, teacher):
+    lesson = Lesson(subject='Math', class_id=class_obj.id, date=date.today(), start_time=time(9), end_time=time(10), created_by=teacher.id)
+    db.session.add(lesson)
+    db.session.commit()
+    return lesson
+
+
+@pytest.fixture
+def collection(class_obj, teacher, students):
+    collection = Collection(class_id=class_obj.id, name='Trip', amount_per_student=Decimal('10.00'), created_by=teacher.id)
+    db.session.add(collection)
+    db.session.flush()
+    collection.create_student_records(teacher.id)
+    db.session.commit()
+    return collection
+
+
+@pytest.fixture
+def login(app):
+    """Test client signed in as the given user"""
+    def login(user):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user.id)
+            session['_fresh'] = True
+        return client
+    return login
@@ -0,0 +1,163 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+from sqlalchemy.dialects import mysql
+
+from app import db
+from models import Lesson, Attendance, AttendanceEvent, AttendanceSnapshot, AttendanceSyncKey
+
+
+def test_concurrent_sync_returns_409(teacher, student, lesson, login):
+    """A record inserted by a concurrent sync between our read and our INSERT is a 409, not a 500"""
+    client = login(teacher)
+
+    injected = []
+
+    def insert_duplicate(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('INSERT INTO attendance ') and not injected:
+            injected.append(True)
+            conn.execute(Attendance.__table__.insert().values(
+                student_id=student.id, lesson_id=lesson.id, status='absent',
+                marked_by=teacher.id, marked_at=datetime.utcnow()
+            ))
+
+    event.listen(db.engine, 'before_cursor_execute', insert_duplicate)
+    response = client.post('/attendance/sync', json={'marks': [
+        {'key': 'k1', 'lesson_id': lesson.id, 'student_id': student.id, 'status': 'present', 'marked_at': datetime.utcnow().isoformat()},
+        {'key': 'k2', 'lesson_id': lesson.id, 'student_id': student.id, 'status': 'late', 'marked_at': datetime.utcnow().isoformat()}
+    ]})
+    event.remove(db.engine, 'before_cursor_execute', insert_duplicate)
+
+    assert injected
+    assert response.status_code == 409
+    assert Attendance.query.count() == 0
+    assert AttendanceSyncKey.query.count() == 0
+
+    # The retried batch applies cleanly
+    response = client.post('/attendance/sync', json={'marks': [
+        {'key': 'k1', 'lesson_id': lesson.id, 'student_id': student.id, 'status': 'present', 'marked_at': datetime.utcnow().isoformat()}
+    ]})
+    assert response.status_code == 200
+    assert Attendance.query.one().status == 'present'
+
+
+def test_concurrent_first_mark_keeps_counters(teacher, student, lesson, login):
+    """A first mark racing another first mark is a 409 and leaves the counters untouched"""
+    client = login(teacher)
+
+    injected = []
+
+    def insert_duplicate(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('INSERT INTO attendance ') and not injected:
+            injected.append(True)
+            conn.execute(Attendance.__table__.insert().values(
+                student_id=student.id, lesson_id=lesson.id, status='absent',
+                marked_by=teacher.id, marked_at=datetime.utcnow()
+            ))
+
+    event.listen(db.engine, 'before_cursor_execute', insert_duplicate)
+    response = client.post(f'/attendance/lesson/{lesson.id}/mark', data={'student_id': student.id, 'status': 'present'})
+    event.remove(db.engine, 'before_cursor_execute', insert_duplicate)
+
+    assert injected
+    assert response.status_code == 409
+    db.session.expire_all()
+    assert Lesson.find_attendance_count_drift() == []
+
+    response = client.post(f'/attendance/lesson/{lesson.id}/mark', data={'student_id': student.id, 'status': 'late'})
+    assert response.status_code == 200
+    db.session.expire_all()
+    assert (lesson.present_count, lesson.late_count) == (0, 1)
+    assert Lesson.find_attendance_count_drift() == []
+
+
+def test_batch_marks_insert_and_update(teacher, students, lesson, login):
+    """A batch updates existing records, inserts new ones and lets a student's last mark win"""
+    client = login(teacher)
+    db.session.add(Attendance(student_id=students[0].id, lesson_id=lesson.id, status='present', marked_by=teacher.id))
+    db.session.commit()
+
+    response = client.post(f'/attendance/lesson/{lesson.id}/batch', json={'marks': [
+        {'student_id': students[0].id, 'status': 'absent', 'notes': 'Ill'},
+        {'student_id': students[1].id, 'status': 'present'},
+        {'student_id': students[1].id, 'status': 'late'}
+    ]})
+
+    assert response.status_code == 200
+    assert response.get_json()['marked'] == 2
+    db.session.expire_all()
+    records = {record.student_id: (record.status, record.notes) for record in Attendance.query}
+    assert records == {students[0].id: ('absent', 'Ill'), students[1].id: ('late', '')}
+    assert AttendanceEvent.query.count() == 2
+    assert (lesson.present_count, lesson.late_count, lesson.absent_count) == (0, 1, 1)
+
+
+def test_batch_rejects_malformed_payloads(teacher, student, lesson, login):
+    """Bodies that are not objects and non-text notes are a 400 and write nothing"""
+    client = login(teacher)
+
+    assert client.post(f'/attendance/lesson/{lesson.id}/batch', json=[1]).status_code == 400
+    response = client.post(f'/attendance/lesson/{lesson.id}/batch', json={'marks': [
+        {'student_id': student.id, 'status': 'late', 'notes': {'a': 1}}
+    ]})
+    assert response.status_code == 400
+    assert Attendance.query.count() == 0
+
+
+def test_sync_reports_bad_notes_per_mark(teacher, students, lesson, login):
+    """A mark with non-text notes is reported as an error without failing the rest of the batch"""
+    client = login(teacher)
+    marked_at = datetime.utcnow().isoformat()
+
+    assert client.post('/attendance/sync', json=[1]).status_code == 400
+    response = client.post('/attendance/sync', json={'marks': [
+        {'key': 'k1', 'lesson_id': lesson.id, 'student_id': students[0].id, 'status': 'late', 'notes': {'a': 1}, 'marked_at': marked_at},
+        {'key': 'k2', 'lesson_id': lesson.id, 'student_id': students[1].id, 'status': 'present', 'marked_at': marked_at}
+    ]})
+
+    assert response.status_code == 200
+    assert response.get_json()['results'] == [
+        {'key': 'k1', 'status': 'error', 'error': 'Notes must be text'},
+        {'key': 'k2', 'status': 'applied'}
+    ]
+    assert [(record.student_id, record.status) for record in Attendance.query] == [(students[1].id, 'present')]
+
+
+def test_lesson_page_etag_follows_remarks(teacher, student, lesson, login):
+    """Re-marking a student changes the lesson page's ETag, so the browser does not get a stale 304"""
+    client = login(teacher)
+    client.post(f'/attendance/lesson/{lesson.id}/mark', data={'student_id': student.id, 'status': 'present'})
+    etag = client.get(f'/attendance/lesson/{lesson.id}').headers['ETag']
+
+    client.post(f'/attendance/lesson/{lesson.id}/mark', data={'student_id': student.id, 'status': 'absent'})
+    response = client.get(f'/attendance/lesson/{lesson.id}', headers={'If-None-Match': etag})
+
+    assert response.status_code == 200
+
+
+def test_updated_at_keeps_microseconds_on_mysql(app):
+    """Edits within one second must still move max(updated_at), which page ETags compare"""
+    for table in db.metadata.tables.values():
+        if 'updated_at' in table.c:
+            assert table.c.updated_at.type.compile(dialect=mysql.dialect()) == 'DATETIME(6)', table.name
+
+
+def test_compaction_keeps_state_as_of(teacher, student, lesson):
+    """Folding old events into snapshots leaves every state from the cutoff on unchanged"""
+    start = datetime(2026, 1, 5, 9)
+    AttendanceEvent.record([
+        AttendanceEvent.entry(lesson.id, student.id, status, '', teacher.id, start + timedelta(minutes=offset), 'mark')
+        for offset, status in ((0, 'present'), (10, 'late'), (20, 'absent'))
+    ])
+    cutoff = start + timedelta(minutes=15)
+
+    assert AttendanceSnapshot.compact(cutoff) == 2
+    assert AttendanceSnapshot.compact(cutoff) == 0
+    assert AttendanceEvent.query.count() == 1
+    assert AttendanceEvent.state_as_of(lesson.id, cutoff)[student.id]['status'] == 'late'
+    assert AttendanceEvent.state_as_of(lesson.id, start + timedelta(minutes=20))[student.id]['status'] == 'absent'
+
+    assert AttendanceSnapshot.compact(start + timedelta(hours=1)) == 1
+    snapshots, events = AttendanceEvent.history(lesson.id, student.id)
+    assert [snapshot.status for snapshot in snapshots] == ['absent']
+    assert events == []
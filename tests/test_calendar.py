@@ -0,0 +1,53 @@
+import re
+
+from app import db
+from utils.calendar_feed import feed_token
+
+
+def feed_url(client):
+    page = client.get('/calendar/').get_data(as_text=True)
+    return re.search(r'http://localhost(/calendar/teacher\.ics\?token=[^"]+)', page)[1]
+
+
+def test_reset_revokes_feed_links(app, teacher, lesson, login):
+    """Feed links stop working once the user resets them, and the new ones work"""
+    client = login(teacher)
+
+    assert client.post('/calendar/reset').status_code == 302
+    old_url = feed_url(client)
+    response = app.test_client().get(old_url)
+    assert response.status_code == 200
+    assert 'SUMMARY:Math (7A)' in response.get_data(as_text=True)
+
+    assert client.post('/calendar/reset').status_code == 302
+
+    new_url = feed_url(client)
+    assert new_url != old_url
+    assert app.test_client().get(old_url).status_code == 403
+    assert app.test_client().get(new_url).status_code == 200
+
+
+def test_viewing_links_page_does_not_write(teacher, class_obj, login):
+    """The GET only offers to create links; the POST creates the secret"""
+    client = login(teacher)
+
+    page = client.get('/calendar/').get_data(as_text=True)
+    assert 'Create calendar links' in page
+    assert 'token=' not in page
+    db.session.expire_all()
+    assert teacher.feed_secret is None
+
+    client.post('/calendar/reset')
+    assert 'token=' in client.get('/calendar/').get_data(as_text=True)
+
+
+def test_feed_writes_floating_local_times(app, teacher, lesson):
+    """Lessons are stored as wall-clock times, so events carry no TZID that would need a VTIMEZONE"""
+    teacher.reset_feed_secret()
+    db.session.commit()
+
+    body = app.test_client().get(f'/calendar/teacher.ics?token={feed_token(teacher)}').get_data(as_text=True)
+
+    assert f'DTSTART:{lesson.date:%Y%m%d}T090000\r\n' in body
+    assert f'DTEND:{lesson.date:%Y%m%d}T100000\r\n' in body
+    assert 'TZID' not in body
@@ -0,0 +1,56 @@
+from decimal import Decimal
+
+from sqlalchemy import event, update
+
+from app import db
+from models import Finance, Collection
+
+
+def pay_concurrently(record_id):
+    """Listener paying a record, as a concurrent request would, just before our first finance UPDATE"""
+    injected = []
+
+    def pay(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('UPDATE finance ') and not injected:
+            injected.append(True)
+            conn.execute(update(Finance.__table__).where(Finance.__table__.c.id == record_id).values(paid=True))
+            conn.execute(update(Collection.__table__).values(
+                paid_count=Collection.__table__.c.paid_count + 1,
+                collected_amount=Collection.__table__.c.collected_amount + 10
+            ))
+
+    return injected, pay
+
+
+def test_concurrent_mark_paid_counts_once(teacher, students, collection, login):
+    """Paying a record another request has just paid leaves the counters consistent"""
+    client = login(teacher)
+    record = Finance.query.filter_by(student_id=students[0].id).one()
+
+    injected, pay = pay_concurrently(record.id)
+    event.listen(db.engine, 'before_cursor_execute', pay)
+    response = client.post(f'/finance/collection/{collection.id}/mark-paid', data={'student_id': students[0].id, 'paid': 'true'})
+    event.remove(db.engine, 'before_cursor_execute', pay)
+
+    assert injected
+    assert response.status_code == 200
+    db.session.expire_all()
+    assert (collection.paid_count, collection.collected_amount) == (1, Decimal('10.00'))
+    assert Collection.find_payment_count_drift() == []
+
+
+def test_mark_paid_bulk_skips_concurrently_paid(collection):
+    """Records paid after they were loaded are not counted again"""
+    records = Finance.query.order_by(Finance.id).all()
+
+    injected, pay = pay_concurrently(records[0].id)
+    event.listen(db.engine, 'before_cursor_execute', pay)
+    marked = Finance.mark_paid_bulk(records, {record.id: (None, '') for record in records})
+    event.remove(db.engine, 'before_cursor_execute', pay)
+    db.session.commit()
+
+    assert injected
+    assert marked == 1
+    db.session.expire_all()
+    assert (collection.paid_count, collection.collected_amount) == (2, Decimal('20.00'))
+    assert Collection.find_payment_count_drift() == []
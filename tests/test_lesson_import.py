@@ -0,0 +1,35 @@
+import io
+from datetime import date, timedelta
+
+from models import Lesson
+from utils.lesson_import import import_timetable, read_timetable
+
+
+def test_import_reports_bad_rows_and_clashes(teacher, class_obj, lesson):
+    """Invalid rows and rows clashing with the schedule or an earlier row are reported, the rest inserted"""
+    tomorrow = date.today() + timedelta(days=1)
+    frame = read_timetable(io.BytesIO((
+        'Subject,Date,Start,End,Room,Class\n'
+        f'Physics,{tomorrow},09:00,10:00,R1,\n'
+        f'Chemistry,{tomorrow},09:30,10:30,R2,\n'
+        f'Art,{date.today()},09:30,10:15,,7A\n'
+        f'Biology,{tomorrow},11:00,10:00,,\n'
+        f',{tomorrow},12:00,13:00,,\n'
+        'Geography,31.02.2026,12:00,13:00,,\n'
+        ',,,,,\n'
+        f'Music,{tomorrow},14:00,15:00,,8B\n'
+    ).encode()), 'timetable.csv')
+
+    created, errors, class_ids = import_timetable(frame, [class_obj], teacher.id, default_class_id=class_obj.id)
+
+    assert (created, class_ids) == (1, {class_obj.id})
+    assert [(row, message.split(' on ')[0]) for row, message in errors] == [
+        (3, 'Clashes with Physics (7A)'),
+        (4, 'Clashes with Math (7A)'),
+        (5, 'End time must be after start time'),
+        (6, 'Subject is required'),
+        (7, 'Invalid date'),
+        (9, 'Unknown class, or not one you manage')
+    ]
+    imported = Lesson.query.filter_by(subject='Physics').one()
+    assert (imported.date, imported.location, imported.created_by) == (tomorrow, 'R1', teacher.id)
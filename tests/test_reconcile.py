@@ -0,0 +1,58 @@
+import io
+from decimal import Decimal
+
+import pytest
+
+from models import Finance
+from utils.reconcile import match_statement, parse_amount, parse_statement
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('$1,234', Decimal('1234.00')),
+    ('1,234', Decimal('1234.00')),
+    ('1.234,50', Decimal('1234.50')),
+    ('$1,234.50', Decimal('1234.50')),
+    ('1 234,50', Decimal('1234.50')),
+    ('1,234,567.89', Decimal('1234567.89')),
+    ('12,50', Decimal('12.50')),
+    ('12.5', Decimal('12.50')),
+    ('-12.00', Decimal('-12.00')),
+    ('1,234,50', None),
+    ('1.234.5', None),
+    ('12,', None),
+    ('', None)
+])
+def test_parse_amount(value, expected):
+    assert parse_amount(value) == expected
+
+
+def test_match_statement(collection, students):
+    """Lines settle records by email or name and amount, each record once, earliest first"""
+    records = Finance.query.order_by(Finance.id).all()
+    lines = parse_statement(io.StringIO(
+        'Name,Email,Amount\n'
+        f',{students[0].email.upper()},"10,00"\n'
+        '  student   1 ,,$10\n'
+        'Student 1,,10.00\n'
+        'Student 0,,12.00\n'
+        'Nobody,,abc\n'
+    ))
+
+    matches, unmatched = match_statement(lines, records)
+
+    assert [(line['line'], record.id) for line, record in matches] == [(2, records[0].id), (3, records[1].id)]
+    assert [(line['line'], line['error']) for line in unmatched] == [
+        (4, 'No outstanding payment for this payer and amount'),
+        (5, 'No outstanding payment for this payer and amount'),
+        (6, 'Invalid amount')
+    ]
+
+
+def test_bulk_mark_paid_rejects_malformed_payloads(teacher, students, collection, login):
+    """Bodies that are not objects and non-text notes are a 400 and pay nothing"""
+    client = login(teacher)
+    url = f'/finance/collection/{collection.id}/bulk-mark-paid'
+
+    assert client.post(url, json=[1]).status_code == 400
+    assert client.post(url, json={'payments': [{'student_id': students[0].id, 'notes': ['x']}]}).status_code == 400
+    assert Finance.query.filter_by(paid=True).count() == 0
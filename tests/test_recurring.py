@@ -0,0 +1,98 @@
+from datetime import date, time, timedelta
+
+import pytest
+
+from app import db
+from models import Attendance, Holiday, Lesson, RecurringLesson, RecurringLessonException
+
+
+def next_monday():
+    today = date.today()
+    return today + timedelta(days=7 - today.weekday())
+
+
+@pytest.fixture
+def rule(class_obj, teacher):
+    """Monday rule running from two weeks ago to three weeks after next Monday"""
+    monday = next_monday()
+    rule = RecurringLesson(
+        class_id=class_obj.id, subject='Math', weekday=0, start_time=time(9), end_time=time(10),
+        start_date=monday - timedelta(weeks=2), end_date=monday + timedelta(weeks=3), created_by=teacher.id
+    )
+    db.session.add(rule)
+    db.session.commit()
+    return rule
+
+
+def lesson_dates(rule):
+    return sorted(day for (day,) in db.session.query(Lesson.date).filter(Lesson.recurring_id == rule.id))
+
+
+def test_materialize_skips_exceptions_and_holidays(rule, teacher):
+    """Exceptions and holidays are left out, and expanding again creates nothing"""
+    monday = next_monday()
+    db.session.add_all([
+        RecurringLessonException(recurring_id=rule.id, date=monday),
+        Holiday(date=monday + timedelta(weeks=1), name='Bank holiday', created_by=teacher.id)
+    ])
+    db.session.flush()
+
+    assert RecurringLesson.materialize([rule], rule.end_date) == 4
+    assert RecurringLesson.materialize([rule], rule.end_date, since=rule.start_date) == 0
+    assert rule.materialized_until == rule.end_date
+    assert lesson_dates(rule) == [
+        monday - timedelta(weeks=2), monday - timedelta(weeks=1),
+        monday + timedelta(weeks=2), monday + timedelta(weeks=3)
+    ]
+
+
+def test_regenerate_moves_future_unmarked_lessons_to_new_weekday(rule, student, teacher):
+    """Past and marked lessons stay put; the other future ones follow the new weekday"""
+    monday = next_monday()
+    RecurringLesson.materialize([rule], rule.end_date)
+    marked = Lesson.query.filter_by(recurring_id=rule.id, date=monday).one()
+    db.session.add(Attendance(student_id=student.id, lesson_id=marked.id, status='present', marked_by=teacher.id))
+
+    rule.weekday = 2
+    removed, created = rule.regenerate(rule.end_date)
+
+    assert (removed, created) == (3, 3)
+    past = [monday - timedelta(weeks=2), monday - timedelta(weeks=1)]
+    wednesdays = [monday + timedelta(weeks=week, days=2) for week in range(3)]
+    assert lesson_dates(rule) == sorted(past + [monday] + wednesdays)
+
+
+def test_skip_date_keeps_marked_lessons_and_survives_regeneration(rule, student, teacher):
+    """A skipped date loses its unmarked lesson for good; a marked lesson is kept"""
+    monday = next_monday()
+    RecurringLesson.materialize([rule], rule.end_date)
+    marked = Lesson.query.filter_by(recurring_id=rule.id, date=monday + timedelta(weeks=2)).one()
+    db.session.add(Attendance(student_id=student.id, lesson_id=marked.id, status='late', marked_by=teacher.id))
+
+    assert rule.skip_date(monday + timedelta(weeks=1), 'Trip') is True
+    assert rule.skip_date(monday + timedelta(weeks=2)) is False
+    rule.regenerate(rule.end_date)
+
+    assert monday + timedelta(weeks=1) not in lesson_dates(rule)
+    assert monday + timedelta(weeks=2) in lesson_dates(rule)
+
+
+def test_holiday_apply_and_lift_only_touch_future_dates(rule, class_obj, teacher):
+    """A holiday cancels and restores future lessons, but never removes past ones"""
+    monday = next_monday()
+    RecurringLesson.materialize([rule], rule.end_date)
+
+    past = Holiday(class_id=class_obj.id, date=monday - timedelta(weeks=1), name='Strike', created_by=teacher.id)
+    future = Holiday(class_id=class_obj.id, date=monday + timedelta(weeks=1), name='Trip', created_by=teacher.id)
+    db.session.add_all([past, future])
+    db.session.flush()
+
+    assert past.apply() == 0
+    assert future.apply() == 1
+    assert past.date in lesson_dates(rule)
+    assert future.date not in lesson_dates(rule)
+
+    db.session.delete(future)
+    db.session.flush()
+    assert future.lift() == 1
+    assert future.date in lesson_dates(rule)
@@ -0,0 +1,174 @@
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from app import db
+from models import User, Lesson, Attendance
+
+
+HISTORY_COLUMNS = ['student_id', 'lesson_id', 'date', 'subject', 'status']
+
+
+def load_class_history(class_id, until=None):
+    """Fetch a class's attendance history as a DataFrame in one query"""
+    until = until or datetime.now().date()
+
+    result = db.session.execute(
+        db.select(
+            Attendance.student_id,
+            Attendance.lesson_id,
+            Lesson.date,
+            Lesson.subject,
+            Attendance.status
+        ).join(
+            Lesson, Attendance.lesson_id == Lesson.id
+        ).join(
+            User, Attendance.student_id == User.id
+        ).where(
+            Lesson.class_id == class_id,
+            Lesson.date <= until,
+            User.class_id == class_id,
+            User.role == 'student'
+        )
+    )
+
+    # Plain tuples build a DataFrame much faster than Row objects
+    return pd.DataFrame([tuple(row) for row in result], columns=HISTORY_COLUMNS)
+
+
+def _streaks(history):
+    """Current and longest absence streak per student, from date-sorted history"""
+    absent = history['absent'].to_numpy()
+    students = history['student_id'].to_numpy()
+
+    # A new run starts whenever the student or the absent flag changes
+    boundary = np.ones(len(history), dtype=bool)
+    boundary[1:] = (students[1:] != students[:-1]) | (absent[1:] != absent[:-1])
+    run_id = np.cumsum(boundary)
+
+    runs = pd.DataFrame({'student_id': students, 'absent': absent, 'run_id': run_id})
+    runs = runs.groupby('run_id').agg(student_id=('student_id', 'first'), absent=('absent', 'first'), length=('absent', 'size'))
+
+    longest = runs[runs['absent']].groupby('student_id')['length'].max()
+    last_run = runs.groupby('student_id').last()
+    current = last_run['length'].where(last_run['absent'], 0)
+
+    return current, longest
+
+
+def _trend_slopes(table):
+    """Least-squares slope of each row of a (rows x periods) table, ignoring NaNs"""
+    values = table.to_numpy(dtype=float)
+    mask = ~np.isnan(values)
+    x = np.broadcast_to(np.arange(values.shape[1], dtype=float), values.shape)
+
+    n = mask.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_mean = np.where(mask, x, 0).sum(axis=1) / n
+        y_mean = np.where(mask, values, 0).sum(axis=1) / n
+        dx = np.where(mask, x - x_mean[:, None], 0)
+        dy = np.where(mask, values - y_mean[:, None], 0)
+        slopes = (dx * dy).sum(axis=1) / (dx * dx).sum(axis=1)
+
+    return np.where(n > 1, slopes, np.nan)
+
+
+def _percent(value):
+    """Round a 0-1 ratio to a percentage, None for NaN"""
+    return None if pd.isna(value) else round(float(value) * 100, 1)
+
+
+def compute_attendance_analytics(history, students, window=10, at_risk_rate=75, at_risk_streak=3):
+    """Compute rates, rolling rates, absence streaks and lateness trends
+
+    ``history`` has the columns of ``HISTORY_COLUMNS``; ``students`` is a list
+    of (id, full_name) pairs. Rates count present marks over marked lessons,
+    like the student attendance page. A student is at risk when the rolling
+    rate over the last ``window`` marked lessons is below ``at_risk_rate``
+    percent, or the current absence streak reaches ``at_risk_streak``.
+    """
+    history = history.sort_values(['student_id', 'date', 'lesson_id'], kind='stable').reset_index(drop=True)
+    history['present'] = history['status'] == 'present'
+    history['late'] = history['status'] == 'late'
+    history['absent'] = history['status'] == 'absent'
+
+    by_student = history.groupby('student_id')
+    totals = by_student.agg(
+        marked=('status', 'size'),
+        present=('present', 'sum'),
+        late=('late', 'sum'),
+        absent=('absent', 'sum')
+    )
+
+    rolling = by_student['present'].rolling(window, min_periods=1).mean()
+    current_rolling = rolling.groupby(level=0).last()
+    current_streak, longest_streak = _streaks(history)
+
+    student_rows = []
+    for student_id, full_name in students:
+        marked = int(totals['marked'].get(student_id, 0))
+        row = {
+            'id': student_id,
+            'full_name': full_name,
+            'marked': marked,
+            'present': int(totals['present'].get(student_id, 0)),
+            'late': int(totals['late'].get(student_id, 0)),
+            'absent': int(totals['absent'].get(student_id, 0)),
+            'attendance_rate': _percent(totals['present'].get(student_id, 0) / marked) if marked else None,
+            'late_rate': _percent(totals['late'].get(student_id, 0) / marked) if marked else None,
+            'rolling_rate': _percent(current_rolling.get(student_id, np.nan)),
+            'current_absence_streak': int(current_streak.get(student_id, 0)),
+            'longest_absence_streak': int(longest_streak.get(student_id, 0))
+        }
+        row['at_risk'] = bool(
+            (row['rolling_rate'] is not None and row['rolling_rate'] < at_risk_rate)
+            or row['current_absence_streak'] >= at_risk_streak
+        )
+        student_rows.append(row)
+
+    # Class-wide weekly attendance rate
+    weekly = []
+    lateness = []
+    if not history.empty:
+        dates = pd.to_datetime(history['date'])
+        weeks = history.groupby(dates.dt.to_period('W').dt.start_time)['present'].mean()
+        weekly = [{'week': week.date(), 'attendance_rate': _percent(rate)} for week, rate in weeks.items()]
+
+        # Monthly late rate per subject and its trend in percentage points per month
+        months = dates.dt.to_period('M')
+        monthly = history.groupby([history['subject'], months])['late'].mean().unstack()
+        monthly = monthly.reindex(columns=pd.period_range(months.min(), months.max(), freq='M'))
+        slopes = _trend_slopes(monthly)
+        overall = history.groupby('subject')['late'].mean()
+
+        for subject, slope in zip(monthly.index, slopes):
+            lateness.append({
+                'subject': subject,
+                'late_rate': _percent(overall[subject]),
+                'trend': None if np.isnan(slope) else round(float(slope) * 100, 2),
+                'months': {str(month): _percent(rate) for month, rate in monthly.loc[subject].items() if not pd.isna(rate)}
+            })
+
+    at_risk = sorted(
+        (row for row in student_rows if row['at_risk']),
+        key=lambda row: (row['rolling_rate'] if row['rolling_rate'] is not None else 0, -row['current_absence_streak'])
+    )
+
+    return {
+        'window': window,
+        'students': student_rows,
+        'at_risk': at_risk,
+        'weekly': weekly,
+        'lateness_by_subject': lateness
+    }
+
+
+def class_attendance_analytics(class_id, **options):
+    """Load a class's history and compute its attendance analytics"""
+    students = db.session.query(User.id, User.full_name).filter(
+        User.class_id == class_id,
+        User.role == 'student'
+    ).order_by(User.full_name).all()
+
+    history = load_class_history(class_id)
+
+    return compute_attendance_analytics(history, [tuple(student) for student in students], **options)
@@ -0,0 +1,102 @@
+import numpy as np
+from app import db
+from models import User, Lesson, Attendance
+
+
+# Cell codes used in the matrix; 0 means the student was not marked
+STATUS_CODES = {'present': 1, 'late': 2, 'absent': 3}
+STATUS_LABELS = ['', 'present', 'late', 'absent']
+
+
+def _positions(ids, lookup):
+    """Map database ids to matrix positions, returning -1 for unknown ids"""
+    if len(lookup) == 0:
+        return np.full(len(ids), -1, dtype=np.int64)
+
+    order = np.argsort(lookup)
+    sorted_lookup = lookup[order]
+    pos = np.searchsorted(sorted_lookup, ids).clip(0, len(lookup) - 1)
+    return np.where(sorted_lookup[pos] == ids, order[pos], -1)
+
+
+def _rates(numerator, denominator):
+    """Element-wise percentage, None where nothing was marked"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rates = numerator / denominator * 100
+    return [None if np.isnan(rate) else round(float(rate), 1) for rate in rates]
+
+
+def build_attendance_matrix(class_id, date_from, date_to):
+    """Build a students x lessons grid of status codes for a date range
+
+    Attendance is fetched as (student_id, lesson_id, status) tuples in one
+    query and pivoted with NumPy; rates are computed over marked cells only.
+    """
+    students = db.session.query(User.id, User.full_name).filter(
+        User.class_id == class_id,
+        User.role == 'student'
+    ).order_by(User.full_name).all()
+
+    lessons = db.session.query(Lesson.id, Lesson.date, Lesson.start_time, Lesson.subject).filter(
+        Lesson.class_id == class_id,
+        Lesson.date >= date_from,
+        Lesson.date <= date_to
+    ).order_by(Lesson.date, Lesson.start_time).all()
+
+    marks = db.session.query(Attendance.student_id, Attendance.lesson_id, Attendance.status).join(
+        Lesson, Attendance.lesson_id == Lesson.id
+    ).filter(
+        Lesson.class_id == class_id,
+        Lesson.date >= date_from,
+        Lesson.date <= date_to
+    ).all()
+
+    grid = np.zeros((len(students), len(lessons)), dtype=np.int8)
+
+    if marks:
+        count = len(marks)
+        student_ids = np.fromiter((mark[0] for mark in marks), dtype=np.int64, count=count)
+        lesson_ids = np.fromiter((mark[1] for mark in marks), dtype=np.int64, count=count)
+        codes = np.fromiter((STATUS_CODES[mark[2]] for mark in marks), dtype=np.int8, count=count)
+
+        rows = _positions(student_ids, np.array([s.id for s in students], dtype=np.int64))
+        cols = _positions(lesson_ids, np.array([l.id for l in lessons], dtype=np.int64))
+
+        # Former students may still have records in this range
+        valid = (rows >= 0) & (cols >= 0)
+        grid[rows[valid], cols[valid]] = codes[valid]
+
+    marked = grid > 0
+    present = grid == STATUS_CODES['present']
+    late = grid == STATUS_CODES['late']
+    absent = grid == STATUS_CODES['absent']
+
+    student_rates = _rates(present.sum(axis=1), marked.sum(axis=1))
+    lesson_rates = _rates(present.sum(axis=0), marked.sum(axis=0))
+
+    return {
+        'students': [
+            {
+                'id': student.id,
+                'full_name': student.full_name,
+                'present': int(p),
+                'late': int(l),
+                'absent': int(a),
+                'attendance_rate': rate
+            }
+            for student, p, l, a, rate in zip(
+                students, present.sum(axis=1), late.sum(axis=1), absent.sum(axis=1), student_rates
+            )
+        ],
+        'lessons': [
+            {
+                'id': lesson.id,
+                'date': lesson.date,
+                'start_time': lesson.start_time,
+                'subject': lesson.subject,
+                'attendance_rate': rate
+            }
+            for lesson, rate in zip(lessons, lesson_rates)
+        ],
+        'grid': grid
+    }
@@ -0,0 +1,226 @@
+import pickle
+import time
+import uuid
+from collections import OrderedDict
+from threading import Lock
+from sqlalchemy import event
+
+
+class LRUCache:
+    """Small thread-safe least-recently-used cache
+
+    Entries are stored with a version; ``get`` only returns a value stored
+    under the same version, so callers invalidate by changing the version
+    they ask for rather than by deleting keys.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, version):
+        """Return the value cached for ``key`` at ``version``, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, version, value):
+        """Cache ``value`` for ``key`` at ``version``, evicting the oldest entry when full"""
+        with self._lock:
+            self._entries[key] = (version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drop every entry"""
+        with self._lock:
+            self._entries.clear()
+
+
+class MemoryBackend:
+    """In-process cache backend, the default
+
+    Values live in an LRU with a timeout; version counters are kept apart
+    and never evicted, so an invalidation cannot be lost to eviction. Each
+    worker process has its own copy, so with several workers a write is
+    only seen by the process that made it until the timeout expires; use a
+    shared backend there.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._values = OrderedDict()
+        self._versions = {}
+        self._lock = Lock()
+
+    def get(self, key):
+        """Return the value cached for ``key``, or None when missing or expired"""
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires is not None and expires < time.monotonic():
+                del self._values[key]
+                return None
+            self._values.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        """Cache ``value`` for ``timeout`` seconds, evicting the oldest entry when full"""
+        expires = time.monotonic() + timeout if timeout else None
+        with self._lock:
+            self._values[key] = (expires, value)
+            self._values.move_to_end(key)
+            while len(self._values) > self.maxsize:
+                self._values.popitem(last=False)
+
+    def get_versions(self, names):
+        """Current version of each name, 0 for names never bumped"""
+        with self._lock:
+            return [self._versions.get(name, 0) for name in names]
+
+    def bump_versions(self, names):
+        """Move each name to a new version"""
+        with self._lock:
+            for name in names:
+                self._versions[name] = self._versions.get(name, 0) + 1
+
+    def clear(self):
+        """Drop every value and version"""
+        with self._lock:
+            self._values.clear()
+            self._versions.clear()
+
+
+class RedisBackend:
+    """Cache backend shared by every worker through Redis
+
+    Versions are random tokens rather than counters, so a version key lost
+    to Redis eviction reads as None and can never match a stored entry.
+    """
+
+    def __init__(self, url, prefix='classhub:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('CACHE_BACKEND "redis" requires the redis package')
+
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        """Return the value cached for ``key``, or None"""
+        value = self._client.get(self.prefix + key)
+        return pickle.loads(value) if value is not None else None
+
+    def set(self, key, value, timeout=None):
+        """Cache ``value`` for ``timeout`` seconds"""
+        self._client.set(self.prefix + key, pickle.dumps(value), ex=timeout or None)
+
+    def get_versions(self, names):
+        """Current version token of each name, None for names never bumped"""
+        if not names:
+            return []
+        return [
+            version.decode() if version is not None else None
+            for version in self._client.mget([self.prefix + 'version:' + name for name in names])
+        ]
+
+    def bump_versions(self, names):
+        """Move each name to a new version token"""
+        pipeline = self._client.pipeline(transaction=False)
+        for name in names:
+            pipeline.set(self.prefix + 'version:' + name, uuid.uuid4().hex)
+        pipeline.execute()
+
+    def clear(self):
+        """Drop every key under the prefix"""
+        keys = list(self._client.scan_iter(self.prefix + '*'))
+        if keys:
+            self._client.delete(*keys)
+
+
+def make_backend(config):
+    """Build the cache backend named by ``CACHE_BACKEND`` in the app config"""
+    backend = config.get('CACHE_BACKEND', 'memory')
+
+    if backend == 'memory':
+        return MemoryBackend(maxsize=config.get('CACHE_MAXSIZE', 1024))
+    if backend == 'redis':
+        return RedisBackend(config['CACHE_REDIS_URL'])
+
+    raise ValueError(f'Unknown CACHE_BACKEND: {backend}')
+
+
+class FragmentCache:
+    """Rendered fragments that stay valid while the data behind them is unchanged
+
+    Each fragment is stored with the versions of the names it depends on
+    (such as ``class:3``) and is served only while those versions are
+    current. Versions are bumped after a commit: ``resolve`` maps the ORM
+    objects written in each flush to version names, and Core statements
+    that bypass the ORM report theirs through ``mark_changed``.
+    """
+
+    SESSION_KEY = 'changed_versions'
+
+    def __init__(self, resolve):
+        self.resolve = resolve
+        self.backend = MemoryBackend()
+        self.timeout = 300
+        self.session = None
+
+    def init_app(self, app, session):
+        """Configure the backend and listen to ``session`` for writes"""
+        self.backend = make_backend(app.config)
+        self.timeout = app.config.get('CACHE_TIMEOUT', 300)
+
+        if self.session is None:
+            self.session = session
+            event.listen(session, 'after_flush', self._after_flush)
+            event.listen(session, 'after_commit', self._after_commit)
+            event.listen(session, 'after_rollback', self._after_rollback)
+
+    def mark_changed(self, *names):
+        """Bump ``names`` when the current transaction commits"""
+        self.session.info.setdefault(self.SESSION_KEY, set()).update(names)
+
+    def fragment(self, key, dependencies, render):
+        """Return the fragment cached under ``key``, rendering it on a miss
+
+        ``dependencies`` returns the version names the fragment depends on
+        and ``render`` returns its HTML; both are only called on a miss. A
+        hit reads the cache backend only.
+        """
+        entry = self.backend.get(key)
+        if entry is not None:
+            names, versions, html = entry
+            if self.backend.get_versions(names) == versions:
+                return html
+
+        # Versions are read before rendering, so a write that commits
+        # meanwhile leaves the stored entry already out of date
+        names = list(dependencies())
+        versions = self.backend.get_versions(names)
+        html = render()
+        self.backend.set(key, (names, versions, html), self.timeout)
+        return html
+
+    def _after_flush(self, session, flush_context):
+        names = self.resolve(session)
+        if names:
+            session.info.setdefault(self.SESSION_KEY, set()).update(names)
+
+    def _after_commit(self, session):
+        names = session.info.pop(self.SESSION_KEY, None)
+        if names:
+            self.backend.bump_versions(sorted(names))
+
+    def _after_rollback(self, session):
+        session.info.pop(self.SESSION_KEY, None)
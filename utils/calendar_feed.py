@@ -0,0 +1,162 @@
+import hashlib
+from datetime import datetime, timedelta, timezone
+from flask import current_app
+from itsdangerous import BadSignature, URLSafeSerializer
+from sqlalchemy import select
+from app import db
+from models import Class, Lesson
+from utils.cache import LRUCache
+from utils.conditional import entity_version
+
+
+feed_cache = LRUCache(maxsize=256)
+event_cache = LRUCache(maxsize=20000)
+
+
+def _serializer():
+    return URLSafeSerializer(current_app.config['SECRET_KEY'], salt='calendar-feed')
+
+
+def feed_token(user):
+    """Token identifying ``user`` in calendar feed URLs, which carry no session
+
+    It signs the user's ``feed_secret`` too, so resetting the secret
+    revokes the token; the user must have one.
+    """
+    return _serializer().dumps([user.id, user.feed_secret])
+
+
+def load_feed_token(token):
+    """``(user_id, feed_secret)`` of a feed token, or None when the token is not valid"""
+    try:
+        user_id, secret = _serializer().loads(token or '')
+    except (BadSignature, TypeError, ValueError):
+        return None
+    return user_id, secret
+
+
+def feed_start():
+    """First date included in feeds; older lessons drop out"""
+    return datetime.now().date() - timedelta(days=current_app.config['CALENDAR_FEED_PAST_DAYS'])
+
+
+def feed_validators(key, allowed, class_ids, since):
+    """Check access and fingerprint a feed in one query
+
+    ``allowed`` is a boolean SQL expression checking the token's user and
+    secret, and ``class_ids`` a select of the IDs of the classes in the
+    feed. Returns None when access is denied, otherwise
+    ``(etag, last_modified, version)``; the version is what the feed body
+    is cached under.
+    """
+    lessons = entity_version(Lesson, Lesson.class_id.in_(class_ids), Lesson.date >= since)
+    classes = entity_version(Class, Class.id.in_(class_ids))
+    row = db.session.execute(select(allowed, *lessons, *classes)).one()
+
+    if not row[0]:
+        return None
+
+    version = (since,) + tuple(row[1:])
+    etag = hashlib.sha1(repr((key, version)).encode()).hexdigest()
+
+    timestamps = [value for value in row[1:] if isinstance(value, datetime)]
+    last_modified = max(timestamps).replace(tzinfo=timezone.utc, microsecond=0) if timestamps else None
+
+    return etag, last_modified, version
+
+
+def _escape(text):
+    """Escape a TEXT value (RFC 5545, 3.3.11)"""
+    return (
+        text.replace('\\', '\\\\')
+        .replace(';', '\\;')
+        .replace(',', '\\,')
+        .replace('\r\n', '\\n')
+        .replace('\n', '\\n')
+    )
+
+
+def _fold(line):
+    """Fold a content line at 75 octets (RFC 5545, 3.1)"""
+    data = line.encode('utf-8')
+    if len(data) <= 75:
+        return line
+
+    parts = []
+    while data:
+        size = 75 if not parts else 74
+        # Never split a multi-byte character
+        while size < len(data) and (data[size] & 0xC0) == 0x80:
+            size -= 1
+        parts.append(data[:size].decode('utf-8'))
+        data = data[size:]
+    return '\r\n '.join(parts)
+
+
+def _event(row, with_class):
+    """VEVENT text of a lesson row, cached until the lesson or its class name changes
+
+    Lessons are stored as local wall-clock times, so they are written as
+    floating times (no TZID) that calendar apps show as is.
+    """
+    lesson_id, subject, day, start_time, end_time, location, description, updated_at, class_name = row
+    key = (lesson_id, with_class)
+    version = (updated_at, class_name)
+
+    text = event_cache.get(key, version)
+    if text is not None:
+        return text
+
+    summary = f'{subject} ({class_name})' if with_class else subject
+    stamp = (updated_at or datetime.utcnow()).strftime('%Y%m%dT%H%M%SZ')
+    lines = [
+        'BEGIN:VEVENT',
+        f'UID:lesson-{lesson_id}@classhub',
+        f'DTSTAMP:{stamp}',
+        f'LAST-MODIFIED:{stamp}',
+        f'DTSTART:{day:%Y%m%d}T{start_time:%H%M%S}',
+        f'DTEND:{day:%Y%m%d}T{end_time:%H%M%S}',
+        f'SUMMARY:{_escape(summary)}'
+    ]
+    if location:
+        lines.append(f'LOCATION:{_escape(location)}')
+    if description:
+        lines.append(f'DESCRIPTION:{_escape(description)}')
+    lines.append('END:VEVENT')
+
+    text = '\r\n'.join(_fold(line) for line in lines) + '\r\n'
+    event_cache.set(key, version, text)
+    return text
+
+
+def render_feed(key, title, class_ids, since, version, with_class=False):
+    """iCalendar body of a feed, cached under its version
+
+    ``title`` is called for the calendar name only when the body is built.
+    On a version change the lessons are reloaded in one query, but only
+    the events of lessons that changed are rendered again.
+    """
+    body = feed_cache.get(key, version)
+    if body is not None:
+        return body
+
+    rows = db.session.query(
+        Lesson.id, Lesson.subject, Lesson.date, Lesson.start_time, Lesson.end_time,
+        Lesson.location, Lesson.description, Lesson.updated_at, Class.name
+    ).join(Class, Lesson.class_id == Class.id).filter(
+        Lesson.class_id.in_(class_ids),
+        Lesson.date >= since
+    ).order_by(Lesson.date, Lesson.start_time).all()
+
+    header = '\r\n'.join(_fold(line) for line in (
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//ClassHub//Schedule//EN',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        f'X-WR-CALNAME:{_escape(title())}'
+    )) + '\r\n'
+    body = header + ''.join(_event(row, with_class) for row in rows) + 'END:VCALENDAR\r\n'
+
+    feed_cache.set(key, version, body)
+    return body
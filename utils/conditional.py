@@ -0,0 +1,76 @@
+import hashlib
+from datetime import datetime, timezone
+from flask import make_response, request, session
+from flask_login import current_user
+from sqlalchemy import func, select
+from werkzeug.http import is_resource_modified
+from app import db
+
+
+def entity_version(model, *criteria):
+    """Max ``updated_at`` and row count of the matching rows, as scalar subqueries
+
+    The count catches deletions, which leave the max ``updated_at`` as is.
+    """
+    return (
+        select(func.max(model.updated_at)).where(*criteria).scalar_subquery(),
+        select(func.count()).select_from(model).where(*criteria).scalar_subquery()
+    )
+
+
+def page_validators(*versions, extra=()):
+    """ETag and Last-Modified of a page, from ``entity_version`` pairs in one query
+
+    The ETag also covers the current user, whose name and role are part of
+    every page, and any ``extra`` values the page depends on such as the
+    displayed week. Returns None while flash messages are waiting: the page
+    that shows them must be rendered, and must not be revalidated later.
+    """
+    if session.get('_flashes'):
+        return None
+
+    columns = [column for version in versions for column in version]
+    values = tuple(db.session.execute(select(*columns)).one())
+
+    fingerprint = repr((
+        values,
+        tuple(extra),
+        current_user.id,
+        current_user.role,
+        current_user.class_id,
+        current_user.updated_at
+    ))
+    etag = hashlib.sha1(fingerprint.encode()).hexdigest()
+
+    timestamps = [value for value in values if isinstance(value, datetime)]
+    last_modified = max(timestamps).replace(tzinfo=timezone.utc, microsecond=0) if timestamps else None
+
+    return etag, last_modified
+
+
+def not_modified(validators):
+    """A ``304 Not Modified`` response when the client's copy is current, else None"""
+    if validators is None:
+        return None
+
+    etag, last_modified = validators
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return None
+
+    return conditional(make_response('', 304), validators)
+
+
+def conditional(response, validators):
+    """Attach the validators to a response, so the browser revalidates on each visit"""
+    response = make_response(response)
+    if validators is None:
+        return response
+
+    etag, last_modified = validators
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response
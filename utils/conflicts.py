@@ -0,0 +1,235 @@
+from bisect import bisect_left, bisect_right
+from collections import defaultdict, namedtuple
+from sqlalchemy import or_
+from app import db
+from models import Class, Lesson
+
+
+REASON_LABELS = {
+    'class': 'same class',
+    'teacher': 'same teacher',
+    'room': 'same room'
+}
+
+
+def _minutes(value):
+    """Minutes since midnight of a ``time``"""
+    return value.hour * 60 + value.minute
+
+
+def _clock(minutes):
+    """Format minutes since midnight as HH:MM"""
+    return f'{minutes // 60:02d}:{minutes % 60:02d}'
+
+
+class Slot(namedtuple('Slot', 'lesson_id class_id class_name teacher_id subject date start end location')):
+    """A lesson's place in the timetable, with times in minutes since midnight
+
+    ``lesson_id`` is None for a lesson that is not saved yet.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def for_lesson(cls, class_obj, date, start_time, end_time, location=None, subject=None, lesson_id=None):
+        """Slot of a lesson of ``class_obj``, saved or not"""
+        return cls(
+            lesson_id, class_obj.id, class_obj.name, class_obj.teacher_id, subject,
+            date, _minutes(start_time), _minutes(end_time), location or None
+        )
+
+    def to_dict(self):
+        """Convert slot to dictionary"""
+        return {
+            'id': self.lesson_id,
+            'class_id': self.class_id,
+            'class_name': self.class_name,
+            'subject': self.subject,
+            'date': self.date.isoformat(),
+            'start_time': _clock(self.start),
+            'end_time': _clock(self.end),
+            'location': self.location
+        }
+
+
+class Conflict(namedtuple('Conflict', 'slot other reasons')):
+    """Two overlapping lessons and why they clash: 'class', 'teacher' and/or 'room'"""
+    __slots__ = ()
+
+    def describe(self):
+        """One-line description for flash messages"""
+        other = self.other
+        reasons = ', '.join(REASON_LABELS[reason] for reason in self.reasons)
+        return (
+            f'{other.subject} ({other.class_name}) on {other.date.strftime("%b %d")} '
+            f'{_clock(other.start)}-{_clock(other.end)}: {reasons}'
+        )
+
+    def to_dict(self):
+        """Convert conflict to dictionary"""
+        return {
+            'date': self.slot.date.isoformat(),
+            'reasons': list(self.reasons),
+            'lesson': self.slot.to_dict(),
+            'other': self.other.to_dict()
+        }
+
+
+class ScheduleIndex:
+    """Lesson intervals per (date, class), (date, teacher) and (date, room)
+
+    Each key keeps its slots sorted by start time along with its longest
+    lesson, so an overlap check is a bisection plus a backward scan over
+    the few slots that can still be running; it never looks at other days,
+    teachers or rooms. Rooms are matched on the stored location.
+    """
+
+    def __init__(self, slots=()):
+        self._starts = defaultdict(list)
+        self._slots = defaultdict(list)
+        self._longest = defaultdict(int)
+        for slot in slots:
+            self.add(slot)
+
+    @staticmethod
+    def _keys(slot):
+        keys = [('class', slot.date, slot.class_id), ('teacher', slot.date, slot.teacher_id)]
+        if slot.location:
+            keys.append(('room', slot.date, slot.location))
+        return keys
+
+    def add(self, slot):
+        """Index a slot"""
+        for key in self._keys(slot):
+            position = bisect_right(self._starts[key], slot.start)
+            self._starts[key].insert(position, slot.start)
+            self._slots[key].insert(position, slot)
+            self._longest[key] = max(self._longest[key], slot.end - slot.start)
+
+    def _overlapping(self, key, start, end):
+        starts = self._starts.get(key)
+        if not starts:
+            return
+
+        # Slots starting at or before this bound end before ``start``
+        earliest = start - self._longest[key]
+        slots = self._slots[key]
+        for position in range(bisect_left(starts, end) - 1, -1, -1):
+            if starts[position] <= earliest:
+                break
+            if slots[position].end > start:
+                yield slots[position]
+
+    def conflicts(self, slot):
+        """Indexed slots overlapping ``slot``, as a list of Conflict"""
+        found = {}
+        for key in self._keys(slot):
+            for other in self._overlapping(key, slot.start, slot.end):
+                if other is slot or (other.lesson_id is not None and other.lesson_id == slot.lesson_id):
+                    continue
+                found.setdefault(id(other), (other, []))[1].append(key[0])
+
+        conflicts = []
+        for other, reasons in found.values():
+            # A clash within one class is always also a clash for its teacher
+            if 'class' in reasons and 'teacher' in reasons:
+                reasons.remove('teacher')
+            conflicts.append(Conflict(slot, other, tuple(reasons)))
+        return conflicts
+
+
+def lesson_slots(*criteria):
+    """Slots of the saved lessons matching ``criteria``, in one query"""
+    rows = db.session.query(
+        Lesson.id, Lesson.class_id, Class.name, Class.teacher_id, Lesson.subject,
+        Lesson.date, Lesson.start_time, Lesson.end_time, Lesson.location
+    ).join(Class, Lesson.class_id == Class.id).filter(*criteria)
+
+    return [
+        Slot(
+            lesson_id, class_id, class_name, teacher_id, subject,
+            day, _minutes(start_time), _minutes(end_time), location or None
+        )
+        for lesson_id, class_id, class_name, teacher_id, subject, day, start_time, end_time, location in rows
+    ]
+
+
+def neighbour_slots(first, last, teacher_ids, rooms, exclude_ids=()):
+    """Saved lessons from ``first`` to ``last`` that could clash with the given teachers or rooms"""
+    related = [Class.teacher_id.in_(list(teacher_ids))]
+    if rooms:
+        related.append(Lesson.location.in_(list(rooms)))
+
+    criteria = [Lesson.date >= first, Lesson.date <= last, or_(*related)]
+    if exclude_ids:
+        criteria.append(Lesson.id.notin_(list(exclude_ids)))
+    return lesson_slots(*criteria)
+
+
+def find_conflicts(candidates):
+    """Conflicts of new or changed lessons with the saved schedule and with each other
+
+    The saved lessons of the candidates' teachers and rooms over their date
+    span are loaded with one query into a ScheduleIndex; each candidate is
+    then checked and, when clear, added in turn, so clashes inside a batch
+    are found too without a rejected candidate blocking later ones. Saved
+    candidates are excluded from the loaded lessons, so a lesson being
+    edited is checked against its new values only.
+    """
+    if not candidates:
+        return []
+
+    existing = neighbour_slots(
+        min(slot.date for slot in candidates),
+        max(slot.date for slot in candidates),
+        {slot.teacher_id for slot in candidates},
+        {slot.location for slot in candidates if slot.location},
+        exclude_ids={slot.lesson_id for slot in candidates if slot.lesson_id is not None}
+    )
+
+    index = ScheduleIndex(existing)
+    conflicts = []
+    for slot in sorted(candidates, key=lambda slot: (slot.date, slot.start)):
+        clashes = index.conflicts(slot)
+        if clashes:
+            conflicts.extend(clashes)
+        else:
+            index.add(slot)
+    return conflicts
+
+
+def conflict_report(classes, first, last):
+    """Every clash from ``first`` to ``last`` involving a lesson of ``classes``
+
+    Lessons of the classes' teachers and of every room the classes use are
+    swept in schedule order, so each clashing pair is reported once.
+    """
+    class_ids = {class_obj.id for class_obj in classes}
+    rooms = {
+        location for (location,) in db.session.query(Lesson.location).filter(
+            Lesson.class_id.in_(list(class_ids)),
+            Lesson.date >= first,
+            Lesson.date <= last,
+            Lesson.location.isnot(None),
+            Lesson.location != ''
+        ).distinct()
+    }
+
+    slots = neighbour_slots(first, last, {class_obj.teacher_id for class_obj in classes}, rooms)
+    slots.sort(key=lambda slot: (slot.date, slot.start, slot.lesson_id))
+
+    index = ScheduleIndex()
+    conflicts = []
+    for slot in slots:
+        conflicts.extend(
+            conflict for conflict in index.conflicts(slot)
+            if slot.class_id in class_ids or conflict.other.class_id in class_ids
+        )
+        index.add(slot)
+    return conflicts
+
+
+def conflict_message(conflicts, subject='This lesson', limit=3):
+    """Flash message listing the first few conflicts"""
+    lines = '; '.join(conflict.describe() for conflict in conflicts[:limit])
+    more = f' and {len(conflicts) - limit} more' if len(conflicts) > limit else ''
+    return f'{subject} clashes with {lines}{more}.'
@@ -0,0 +1,72 @@
+from itertools import chain
+from sqlalchemy import inspect, select
+from models import User, Class, Lesson, Attendance, Finance, Collection
+from utils.cache import FragmentCache
+
+
+# User columns shown on dashboards; other profile updates (such as a new
+# profile picture at login) leave the cached fragments valid
+USER_DASHBOARD_FIELDS = ('class_id', 'role', 'full_name', 'is_active')
+
+
+def class_version(class_id):
+    """Version name of everything dashboards show about a class"""
+    return f'class:{class_id}'
+
+
+def teacher_version(teacher_id):
+    """Version name of a teacher's set of classes"""
+    return f'teacher:{teacher_id}'
+
+
+def _values(obj, attribute):
+    """Current and previous values of an attribute within the flush"""
+    history = inspect(obj).attrs[attribute].history
+    return {value for value in chain(history.added, history.unchanged, history.deleted) if value is not None}
+
+
+def changed_versions(session):
+    """Version names touched by the ORM objects written in a flush"""
+    names = set()
+    lesson_ids = set()
+
+    # (object, whether it is inserted or deleted rather than updated)
+    written = chain(
+        ((obj, True) for obj in session.new),
+        ((obj, False) for obj in session.dirty),
+        ((obj, True) for obj in session.deleted)
+    )
+
+    for obj, whole in written:
+        if isinstance(obj, (Lesson, Finance, Collection)):
+            names.update(class_version(class_id) for class_id in _values(obj, 'class_id'))
+        elif isinstance(obj, Attendance):
+            lesson_ids.update(_values(obj, 'lesson_id'))
+        elif isinstance(obj, Class):
+            names.add(class_version(obj.id))
+            names.update(teacher_version(teacher_id) for teacher_id in _values(obj, 'teacher_id'))
+        elif isinstance(obj, User):
+            attrs = inspect(obj).attrs
+            if whole or any(attrs[field].history.has_changes() for field in USER_DASHBOARD_FIELDS):
+                names.update(class_version(class_id) for class_id in _values(obj, 'class_id'))
+
+    if lesson_ids:
+        # Straight on the connection, so no autoflush runs inside the flush
+        class_ids = session.connection().execute(
+            select(Lesson.class_id).where(Lesson.id.in_(lesson_ids)).distinct()
+        ).scalars()
+        names.update(class_version(class_id) for class_id in class_ids)
+
+    return names
+
+
+dashboard_cache = FragmentCache(changed_versions)
+
+
+def mark_class_changed(*class_ids):
+    """Invalidate the dashboards of these classes when the transaction commits
+
+    For Core statements (bulk upserts, ``INSERT ... SELECT``, counter
+    updates) that bypass the ORM flush and so are not seen automatically.
+    """
+    dashboard_cache.mark_changed(*(class_version(class_id) for class_id in class_ids))
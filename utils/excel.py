@@ -0,0 +1,88 @@
+import re
+import tempfile
+from flask import send_file
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+def sheet_title(name, used):
+    """Make a valid, unique Excel sheet title (31 chars, no []:*?/\\)"""
+    base = re.sub(r'[\[\]:*?/\\]', '-', str(name)).strip() or 'Sheet'
+    title = base[:31]
+    counter = 2
+    while title.lower() in used:
+        suffix = f' ({counter})'
+        title = base[:31 - len(suffix)] + suffix
+        counter += 1
+    used.add(title.lower())
+    return title
+
+
+def write_grouped_workbook(rows, group_key, header, to_row, sheet_name=None, footer=None):
+    """Write rows into a write-only workbook, one sheet per group
+
+    ``rows`` must arrive ordered by group (e.g. a streamed ``yield_per``
+    query); each row goes to disk as soon as it is appended, so memory stays
+    bounded however many rows there are. ``group_key(row)`` identifies the
+    sheet, ``sheet_name(row)`` titles it (defaults to the group key) and
+    ``to_row(row)`` returns the cell values. ``footer(group)`` may return
+    extra rows to close each sheet with. Returns an open temporary file
+    positioned at the start.
+    """
+    workbook = Workbook(write_only=True)
+    used_titles = set()
+    sheet = None
+    current_group = None
+
+    for row in rows:
+        group = group_key(row)
+        if sheet is None or group != current_group:
+            if sheet is not None and footer:
+                append_rows(sheet, footer(current_group))
+            title = sheet_name(row) if sheet_name else group
+            sheet = new_sheet(workbook, sheet_title(title, used_titles), header)
+            current_group = group
+        sheet.append(to_row(row))
+
+    if sheet is None:
+        new_sheet(workbook, 'Empty', header)
+    elif footer:
+        append_rows(sheet, footer(current_group))
+
+    return save_workbook(workbook)
+
+
+def append_rows(sheet, rows):
+    """Append a blank separator row followed by ``rows``"""
+    sheet.append([])
+    for row in rows:
+        sheet.append(row)
+
+
+def new_sheet(workbook, title, header):
+    """Add a write-only sheet with a bold header row"""
+    sheet = workbook.create_sheet(title=title)
+    cells = []
+    for value in header:
+        cell = WriteOnlyCell(sheet, value=value)
+        cell.font = Font(bold=True)
+        cells.append(cell)
+    sheet.append(cells)
+    return sheet
+
+
+def save_workbook(workbook):
+    """Save a workbook to a temporary file rather than an in-memory buffer"""
+    output = tempfile.TemporaryFile()
+    workbook.save(output)
+    output.seek(0)
+    return output
+
+
+def xlsx_response(output, filename):
+    """Send a saved workbook as a download"""
+    return send_file(output, mimetype=XLSX_MIMETYPE, as_attachment=True, download_name=filename)
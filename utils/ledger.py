@@ -0,0 +1,197 @@
+import numpy as np
+import pandas as pd
+from decimal import Decimal
+from sqlalchemy import case, func, select
+from app import db
+from models import User, Finance, Collection
+from utils.cache import LRUCache
+from utils.conditional import entity_version
+
+
+LEDGER_COLUMNS = ['student_id', 'full_name', 'collection_id', 'owed', 'paid']
+
+ledger_cache = LRUCache(maxsize=128)
+
+
+def _cents(amount):
+    """Exact integer cents of a Decimal amount"""
+    return int((Decimal(amount or 0) * 100).to_integral_value())
+
+
+def _money(cents):
+    """Decimal amount of integer cents"""
+    return (Decimal(int(cents)) / 100).quantize(Decimal('0.01'))
+
+
+def ledger_version(class_id):
+    """Cheap fingerprint of a class's collections and finance records that changes on every payment
+
+    Both contribute their row count and latest ``updated_at`` like
+    ``entity_version``. Timestamps have second precision, so the collected
+    total and the sum of the paid record IDs are included too: they change
+    when payments move between students or collections within one tick.
+    """
+    collections = Collection.class_id == class_id
+    records = Finance.collection_id.in_(select(Collection.id).where(collections))
+
+    return tuple(db.session.execute(select(
+        *entity_version(Collection, collections),
+        *entity_version(Finance, records),
+        select(func.sum(Collection.paid_count)).where(collections).scalar_subquery(),
+        select(func.sum(Collection.student_count)).where(collections).scalar_subquery(),
+        select(func.sum(Collection.collected_amount)).where(collections).scalar_subquery(),
+        select(func.sum(case((Finance.paid.is_(True), Finance.id), else_=0))).where(records).scalar_subquery()
+    )).one())
+
+
+def load_ledger_rows(class_id):
+    """Owed and paid amount per student and collection, as a DataFrame in one aggregate query"""
+    result = db.session.execute(
+        db.select(
+            Finance.student_id,
+            User.full_name,
+            Finance.collection_id,
+            func.sum(Finance.amount),
+            func.sum(case((Finance.paid.is_(True), Finance.amount), else_=0))
+        ).join(
+            Collection, Finance.collection_id == Collection.id
+        ).join(
+            User, Finance.student_id == User.id
+        ).where(
+            Collection.class_id == class_id
+        ).group_by(
+            Finance.student_id, User.full_name, Finance.collection_id
+        )
+    )
+
+    # Money is handled as integer cents so pandas sums stay exact
+    return pd.DataFrame(
+        [(student_id, name, collection_id, _cents(owed), _cents(paid))
+         for student_id, name, collection_id, owed, paid in result],
+        columns=LEDGER_COLUMNS
+    )
+
+
+def build_ledger(rows, collections):
+    """Pivot ledger rows into a students x collections matrix with totals
+
+    ``collections`` is a list of (id, name) pairs in display order. Returns a
+    dict with ``collections``, ``students`` (each with per-collection
+    ``cells`` and ``owed``/``paid``/``outstanding`` totals) and ``totals``
+    per collection and overall. Amounts are Decimal; a cell is None when the
+    student has no record in that collection.
+    """
+    collection_ids = [collection_id for collection_id, _ in collections]
+
+    if rows.empty:
+        owed = paid = pd.DataFrame(index=pd.Index([], name='student_id'), columns=collection_ids, dtype='int64')
+        names = pd.Series(dtype=object)
+    else:
+        owed = rows.pivot_table(index='student_id', columns='collection_id', values='owed', aggfunc='sum')
+        paid = rows.pivot_table(index='student_id', columns='collection_id', values='paid', aggfunc='sum')
+        owed = owed.reindex(columns=collection_ids)
+        paid = paid.reindex(columns=collection_ids)
+        names = rows.groupby('student_id')['full_name'].first()
+
+    has_record = owed.notna()
+    outstanding = (owed - paid).fillna(0).astype('int64')
+    owed = owed.fillna(0).astype('int64')
+    paid = paid.fillna(0).astype('int64')
+
+    # Row totals per student, column totals per collection
+    row_owed = owed.sum(axis=1)
+    row_paid = paid.sum(axis=1)
+    row_outstanding = outstanding.sum(axis=1)
+    order = names.sort_values(kind='stable').index
+
+    has_record_values = has_record.to_numpy()
+    owed_values = owed.to_numpy()
+    paid_values = paid.to_numpy()
+    outstanding_values = outstanding.to_numpy()
+    positions = {student_id: i for i, student_id in enumerate(owed.index)}
+
+    students = []
+    for student_id in order:
+        i = positions[student_id]
+        cells = []
+        for j in range(len(collection_ids)):
+            if not has_record_values[i, j]:
+                cells.append(None)
+                continue
+            cells.append({
+                'owed': _money(owed_values[i, j]),
+                'paid': _money(paid_values[i, j]),
+                'outstanding': _money(outstanding_values[i, j]),
+                'status': 'paid' if outstanding_values[i, j] <= 0 else ('partial' if paid_values[i, j] > 0 else 'unpaid')
+            })
+        students.append({
+            'id': int(student_id),
+            'full_name': names[student_id],
+            'cells': cells,
+            'owed': _money(row_owed[student_id]),
+            'paid': _money(row_paid[student_id]),
+            'outstanding': _money(row_outstanding[student_id])
+        })
+
+    column_owed = owed.sum(axis=0)
+    column_paid = paid.sum(axis=0)
+    column_outstanding = outstanding.sum(axis=0)
+
+    return {
+        'collections': [{'id': collection_id, 'name': name} for collection_id, name in collections],
+        'students': students,
+        'totals': {
+            'collections': [
+                {
+                    'owed': _money(column_owed.get(collection_id, 0)),
+                    'paid': _money(column_paid.get(collection_id, 0)),
+                    'outstanding': _money(column_outstanding.get(collection_id, 0))
+                }
+                for collection_id in collection_ids
+            ],
+            'owed': _money(np.sum(owed_values)),
+            'paid': _money(np.sum(paid_values)),
+            'outstanding': _money(np.sum(outstanding_values))
+        }
+    }
+
+
+def class_ledger(class_id):
+    """The class finance ledger, cached per class until its collections change"""
+    version = ledger_version(class_id)
+    ledger = ledger_cache.get(class_id, version)
+
+    if ledger is None:
+        collections = db.session.query(Collection.id, Collection.name).filter(
+            Collection.class_id == class_id
+        ).order_by(Collection.created_at, Collection.id).all()
+
+        ledger = build_ledger(load_ledger_rows(class_id), [tuple(collection) for collection in collections])
+        ledger_cache.set(class_id, version, ledger)
+
+    return ledger
+
+
+def ledger_table(ledger):
+    """Header and rows of a ledger for CSV/Excel export, outstanding amount per cell"""
+    header = ['Student Name'] + [collection['name'] for collection in ledger['collections']]
+    header += ['Total Owed', 'Total Paid', 'Outstanding']
+
+    rows = []
+    for student in ledger['students']:
+        rows.append(
+            [student['full_name']]
+            + [cell['outstanding'] if cell else None for cell in student['cells']]
+            + [student['owed'], student['paid'], student['outstanding']]
+        )
+
+    totals = ledger['totals']
+    rows.append(
+        ['Outstanding']
+        + [column['outstanding'] for column in totals['collections']]
+        + [totals['owed'], totals['paid'], totals['outstanding']]
+    )
+    rows.append(['Collected'] + [column['paid'] for column in totals['collections']])
+    rows.append(['Expected'] + [column['owed'] for column in totals['collections']])
+
+    return header, rows
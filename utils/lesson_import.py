@@ -0,0 +1,172 @@
+import zipfile
+from datetime import datetime
+import pandas as pd
+from sqlalchemy import insert
+from app import db
+from models import Lesson
+from utils.conflicts import Slot, find_conflicts
+
+
+# Accepted header names for each timetable field, compared case-insensitively
+TIMETABLE_COLUMNS = {
+    'subject': ('subject', 'lesson', 'course'),
+    'date': ('date', 'day'),
+    'start_time': ('start_time', 'start time', 'start', 'from'),
+    'end_time': ('end_time', 'end time', 'end', 'to'),
+    'location': ('location', 'room'),
+    'description': ('description', 'notes', 'comment'),
+    'class': ('class', 'class_id', 'class name', 'group')
+}
+
+REQUIRED_COLUMNS = ('subject', 'date', 'start_time', 'end_time')
+
+DATE_FORMATS = ('%Y-%m-%d', '%d.%m.%Y', '%d/%m/%Y')
+TIME_FORMATS = ('%H:%M', '%H:%M:%S')
+
+# Lessons written per executemany INSERT
+INSERT_BATCH_SIZE = 1000
+
+READ_ERRORS = (ValueError, UnicodeDecodeError, zipfile.BadZipFile)
+
+
+def read_timetable(stream, filename):
+    """Read an uploaded CSV or XLSX timetable into a DataFrame of stripped strings
+
+    Columns are renamed to the keys of TIMETABLE_COLUMNS, missing optional
+    columns are added empty and blank rows are dropped. The index is the
+    spreadsheet row number, the header being row 1. Raises ValueError on an
+    unsupported file type or when a required column is missing.
+    """
+    name = (filename or '').lower()
+    if name.endswith('.xlsx'):
+        frame = pd.read_excel(stream, dtype=str, engine='openpyxl')
+    elif name.endswith('.csv'):
+        frame = pd.read_csv(stream, dtype=str, keep_default_na=False, encoding='utf-8-sig')
+    else:
+        raise ValueError('Upload a .csv or .xlsx file')
+
+    columns = {}
+    for column in frame.columns:
+        title = str(column).strip().casefold()
+        for field, aliases in TIMETABLE_COLUMNS.items():
+            if title in aliases and field not in columns.values():
+                columns[column] = field
+
+    missing = [field for field in REQUIRED_COLUMNS if field not in columns.values()]
+    if missing:
+        raise ValueError(f'Missing column(s): {", ".join(missing)}')
+
+    frame = frame[list(columns)].rename(columns=columns).fillna('')
+    for field in TIMETABLE_COLUMNS:
+        if field not in frame:
+            frame[field] = ''
+    frame = frame.apply(lambda column: column.astype(str).str.strip())
+
+    frame.index = frame.index + 2
+    return frame[(frame != '').any(axis=1)]
+
+
+def _parse(column, formats):
+    """Parse a string column trying each format in turn; NaT where none matches"""
+    parsed = pd.to_datetime(column, format=formats[0], errors='coerce')
+    for parse_format in formats[1:]:
+        parsed = parsed.fillna(pd.to_datetime(column, format=parse_format, errors='coerce'))
+    return parsed
+
+
+def validate_timetable(frame, classes, default_class_id=None):
+    """Check every row with column operations
+
+    ``classes`` are the classes the uploader may schedule; the class column
+    may hold a class name or ID and defaults to ``default_class_id``.
+    Returns ``(lessons, errors)``: a DataFrame of the valid rows ready to
+    insert, with ``start`` and ``end`` in minutes since midnight, and a
+    Series of the first error of each invalid row, indexed by row number.
+    """
+    # Excel dates arrive as "YYYY-MM-DD 00:00:00"
+    dates = _parse(frame['date'].str.replace(r' 00:00:00$', '', regex=True), DATE_FORMATS)
+    starts = _parse(frame['start_time'], TIME_FORMATS)
+    ends = _parse(frame['end_time'], TIME_FORMATS)
+    start_minutes = starts.dt.hour * 60 + starts.dt.minute
+    end_minutes = ends.dt.hour * 60 + ends.dt.minute
+
+    lookup = {str(class_obj.id): class_obj.id for class_obj in classes}
+    lookup.update({class_obj.name.casefold(): class_obj.id for class_obj in classes})
+    class_ids = frame['class'].str.casefold().map(lookup)
+    if default_class_id is not None:
+        class_ids = class_ids.where(frame['class'] != '', default_class_id)
+
+    errors = pd.Series('', index=frame.index)
+    checks = (
+        (frame['subject'] == '', 'Subject is required'),
+        (frame['subject'].str.len() > 100, 'Subject is longer than 100 characters'),
+        (dates.isna(), 'Invalid date'),
+        (starts.isna() | ends.isna(), 'Invalid start or end time'),
+        (end_minutes <= start_minutes, 'End time must be after start time'),
+        (frame['location'].str.len() > 100, 'Location is longer than 100 characters'),
+        ((frame['class'] == '') & class_ids.isna(), 'Class is required'),
+        (class_ids.isna(), 'Unknown class, or not one you manage')
+    )
+    # Keep the first failing check of each row
+    for failed, message in checks:
+        errors = errors.mask(failed & (errors == ''), message)
+
+    valid = errors == ''
+    lessons = pd.DataFrame({
+        'subject': frame['subject'],
+        'class_id': class_ids,
+        'date': dates.dt.date,
+        'start_time': starts.dt.time,
+        'end_time': ends.dt.time,
+        'start': start_minutes,
+        'end': end_minutes,
+        # As objects, or pandas fills the blanks with NaN rather than None
+        'location': frame['location'].astype(object).where(frame['location'] != '', None),
+        'description': frame['description'].astype(object).where(frame['description'] != '', None)
+    })[valid]
+    lessons = lessons.astype({'class_id': int, 'start': int, 'end': int})
+
+    return lessons, errors[~valid]
+
+
+def import_timetable(frame, classes, created_by, default_class_id=None):
+    """Validate a timetable, drop clashing rows and bulk insert the rest
+
+    Rows clashing with the saved schedule or with earlier rows of the file
+    (same class, teacher or room at overlapping times) are reported rather
+    than inserted. Lessons are written with one executemany INSERT per
+    INSERT_BATCH_SIZE rows, without building ORM objects. Returns
+    ``(created, errors, class_ids)`` where ``errors`` is a list of
+    ``(row, message)`` in row order. The caller is responsible for
+    committing.
+    """
+    lessons, errors = validate_timetable(frame, classes, default_class_id)
+    classes_by_id = {class_obj.id: class_obj for class_obj in classes}
+
+    rows = {}
+    for row, class_id, subject, day, start, end, location in zip(
+        lessons.index, lessons['class_id'], lessons['subject'], lessons['date'],
+        lessons['start'], lessons['end'], lessons['location']
+    ):
+        class_obj = classes_by_id[class_id]
+        slot = Slot(None, class_id, class_obj.name, class_obj.teacher_id, subject, day, start, end, location)
+        rows[id(slot)] = (row, slot)
+
+    clashes = {}
+    for conflict in find_conflicts([slot for _, slot in rows.values()]):
+        row = rows[id(conflict.slot)][0]
+        clashes.setdefault(row, f'Clashes with {conflict.describe()}')
+
+    if clashes:
+        errors = pd.concat([errors, pd.Series(clashes)])
+        lessons = lessons.drop(index=list(clashes))
+
+    records = lessons.drop(columns=['start', 'end']).assign(created_by=created_by)
+    now = datetime.utcnow()
+    for offset in range(0, len(records), INSERT_BATCH_SIZE):
+        chunk = records.iloc[offset:offset + INSERT_BATCH_SIZE].to_dict('records')
+        for record in chunk:
+            record['created_at'] = record['updated_at'] = now
+        db.session.execute(insert(Lesson.__table__), chunk)
+
+    return len(records), sorted(errors.items()), set(records['class_id'].tolist())
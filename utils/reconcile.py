@@ -0,0 +1,155 @@
+import csv
+import re
+from datetime import datetime
+from decimal import Decimal
+
+
+# Accepted header names for each statement field, compared case-insensitively
+STATEMENT_COLUMNS = {
+    'name': ('name', 'payer', 'payer name', 'student', 'student name', 'full name'),
+    'email': ('email', 'e-mail', 'payer email'),
+    'amount': ('amount', 'sum', 'credit', 'paid'),
+    'date': ('date', 'payment date', 'booking date', 'value date'),
+    'reference': ('reference', 'description', 'details', 'memo')
+}
+
+DATE_FORMATS = ('%Y-%m-%d', '%d.%m.%Y', '%d/%m/%Y')
+
+# Sign, whole part with optional thousands groups, then optional decimal separator and cents
+AMOUNT_PATTERN = re.compile(r'(-?)(\d+|\d{1,3}([,.])\d{3}(?:\3\d{3})*)(?:([,.])(\d{1,2}))?')
+
+
+def normalize_name(name):
+    """Case- and whitespace-insensitive form of a person's name"""
+    return ' '.join((name or '').casefold().split())
+
+
+def parse_amount(value):
+    """Parse a statement amount like "$1,234.50", "1.234,50" or "12,50" into a 2-place Decimal
+
+    A "," or "." followed by one or two digits at the end is the decimal
+    separator; followed by three it groups thousands. None when the amount
+    is ambiguous, e.g. "1,234,50", so the line is reported as unmatched.
+    """
+    match = AMOUNT_PATTERN.fullmatch(re.sub(r'[^\d,.\-]', '', value or ''))
+    if not match or (match[3] and match[3] == match[4]):
+        return None
+
+    sign, whole, _, _, cents = match.groups()
+    return Decimal(f'{sign}{re.sub(r"[,.]", "", whole)}.{cents or 0}').quantize(Decimal('0.01'))
+
+
+def parse_date(value):
+    """Parse a statement date, None when empty or unrecognised"""
+    value = (value or '').strip()
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            continue
+    return None
+
+
+def parse_statement(stream):
+    """Read a CSV bank statement into a list of line dicts
+
+    Raises ValueError when the header has no amount column or neither a name
+    nor an email column. Each line dict has ``line`` (the CSV line number),
+    ``name``, ``email``, ``amount``, ``date``, ``reference``, ``raw`` and an
+    ``error`` that is None for usable lines.
+    """
+    reader = csv.reader(stream)
+    header = next(reader, None)
+    if not header:
+        raise ValueError('The statement is empty')
+
+    positions = {}
+    for index, title in enumerate(header):
+        title = title.strip().casefold()
+        for field, aliases in STATEMENT_COLUMNS.items():
+            if title in aliases and field not in positions:
+                positions[field] = index
+
+    if 'amount' not in positions or not ('name' in positions or 'email' in positions):
+        raise ValueError('The statement needs an amount column and a name or email column')
+
+    lines = []
+    for row in reader:
+        if not any(cell.strip() for cell in row):
+            continue
+
+        def cell(field):
+            index = positions.get(field)
+            return row[index].strip() if index is not None and index < len(row) else ''
+
+        line = {
+            'line': reader.line_num,
+            'name': cell('name'),
+            'email': cell('email').lower(),
+            'amount': parse_amount(cell('amount')),
+            'date': parse_date(cell('date')),
+            'reference': cell('reference'),
+            'raw': ', '.join(row),
+            'error': None
+        }
+
+        if line['amount'] is None:
+            line['error'] = 'Invalid amount'
+        elif line['amount'] <= 0:
+            line['error'] = 'Not an incoming payment'
+        elif not line['name'] and not line['email']:
+            line['error'] = 'No payer name or email'
+
+        lines.append(line)
+
+    return lines
+
+
+def match_statement(lines, outstanding):
+    """Match statement lines to outstanding finance records
+
+    ``outstanding`` are unpaid Finance records with their student loaded, in
+    the order they should be settled. They are indexed in a dict by
+    (email, amount) and (normalized name, amount), so each line is matched
+    with a hash lookup; email wins over name when a line has both. Returns
+    ``(matches, unmatched)``: a list of (line, record) pairs and a list of
+    lines, each unmatched line carrying its ``error``.
+    """
+    index = {}
+    for record in outstanding:
+        amount = Decimal(record.amount).quantize(Decimal('0.01'))
+        index.setdefault(('email', (record.student.email or '').lower(), amount), []).append(record)
+        index.setdefault(('name', normalize_name(record.student.full_name), amount), []).append(record)
+
+    used = set()
+    matches = []
+    unmatched = []
+
+    for line in lines:
+        if line['error']:
+            unmatched.append(line)
+            continue
+
+        keys = []
+        if line['email']:
+            keys.append(('email', line['email'], line['amount']))
+        if line['name']:
+            keys.append(('name', normalize_name(line['name']), line['amount']))
+
+        record = None
+        for key in keys:
+            candidates = index.get(key, [])
+            while candidates and candidates[0].id in used:
+                candidates.pop(0)
+            if candidates:
+                record = candidates.pop(0)
+                break
+
+        if record is None:
+            line['error'] = 'No outstanding payment for this payer and amount'
+            unmatched.append(line)
+        else:
+            used.add(record.id)
+            matches.append((line, record))
+
+    return matches, unmatched